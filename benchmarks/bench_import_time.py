@@ -0,0 +1,71 @@
+"""Measure how long ``import envoy_reader.envoy_reader`` takes.
+
+Run with ``python -m benchmarks.bench_import_time`` from the repository root.
+Each run imports the module in a fresh interpreter under ``-X importtime``
+and prints one JSON object with the cumulative import time of the module and
+of its heaviest dependencies. Exits with status 1 if a dependency that should
+be imported lazily was loaded, or if ``--max-ms`` is exceeded.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+MODULE = "envoy_reader.envoy_reader"
+
+# Only needed on the HTTPS token path or for installer passwords.
+LAZY_MODULES = ("bs4", "jwt", "envoy_utils")
+
+REPORTED_MODULES = (MODULE, "httpx", "orjson", *LAZY_MODULES)
+
+
+def import_times(module=MODULE):
+    """Return the cumulative import time in microseconds of each top module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        if cumulative.strip().isdigit():
+            times[name] = int(cumulative)
+    return times
+
+
+def main(argv=None):
+    """Time the import ``--repeat`` times and print the fastest run."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    runs = [import_times() for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times.get(MODULE, 0))
+    lazy_loaded = sorted(name for name in LAZY_MODULES if name in best)
+    print(
+        json.dumps(
+            {
+                "module": MODULE,
+                "us_cumulative": {
+                    name: best[name] for name in REPORTED_MODULES if name in best
+                },
+                "lazy_loaded": lazy_loaded,
+            }
+        )
+    )
+    if lazy_loaded:
+        return 1
+    if args.max_ms is not None and best.get(MODULE, 0) / 1000 > args.max_ms:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
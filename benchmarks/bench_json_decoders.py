@@ -0,0 +1,51 @@
+"""Compare the JSON decoders on the firmware fixtures.
+
+Run with ``python -m benchmarks.bench_json_decoders`` from the repository
+root. Prints one JSON object per fixture and decoder.
+"""
+
+import json
+import sys
+import timeit
+from pathlib import Path
+
+from envoy_reader.envoy_reader import decode_json_orjson, decode_json_stdlib, orjson
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "fixtures"
+
+
+def _decoders():
+    decoders = {
+        "stdlib": decode_json_stdlib,
+        # What httpx.Response.json() does: decode to str, then parse.
+        "text": lambda content: json.loads(content.decode("utf-8")),
+    }
+    if orjson is not None:
+        decoders["orjson"] = decode_json_orjson
+    return decoders
+
+
+def main(number=2000):
+    """Time every decoder on every fixture and print the results."""
+    for path in sorted(FIXTURES_DIR.glob("*/*")):
+        if path.parent.name == "legacy":
+            continue
+        content = path.read_bytes()
+        for name, decoder in _decoders().items():
+            seconds = min(
+                timeit.repeat(lambda: decoder(content), number=number, repeat=5)
+            )
+            print(
+                json.dumps(
+                    {
+                        "fixture": f"{path.parent.name}/{path.name}",
+                        "bytes": len(content),
+                        "decoder": name,
+                        "us_per_decode": round(seconds / number * 1e6, 3),
+                    }
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,222 @@
+"""Measure the cost of polling an Envoy on the firmware fixtures.
+
+Run with ``python -m benchmarks.bench_poll`` from the repository root. The
+Envoys are mocked with respx, so the figures cover the reader's own work
+(request building, decoding, snapshot and accessor code) plus the mock
+transport, not the network. Prints one JSON object per case:
+
+* ``poll/<firmware>``: a steady-state getData() after detection
+* ``accessors/<firmware>``: every metric accessor after a poll
+* ``poll_inverters/<count>`` and ``inverters_production/<count>``: a poll and
+  inverters_production() with a synthetic list of inverters
+* ``fleet/<hosts>``: one EnvoyFleet round over hosts served by an
+  EnvoySimulator answering after ``--latency`` seconds
+
+Each case reports the median and minimum wall and CPU time per iteration in
+microseconds, and the bytes allocated at peak during one traced iteration.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+import respx
+from httpx import Response
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.fleet import EnvoyFleet
+from envoy_reader.simulator import EnvoySimulator, synthetic_inverters
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "fixtures"
+
+FIRMWARES = ("3.9.36", "3.17.3", "4.2.27", "5.0.49")
+INVERTER_COUNTS = (1000, 5000)
+FLEET_SIZES = (10, 100, 1000)
+
+ACCESSORS = (
+    "production",
+    "consumption",
+    "daily_production",
+    "daily_consumption",
+    "seven_days_production",
+    "seven_days_consumption",
+    "lifetime_production",
+    "lifetime_consumption",
+    "inverters_production",
+    "battery_storage",
+)
+
+
+def mock_envoy(router, firmware, inverters=None):
+    """Add the routes of an Envoy running ``firmware`` to a respx router.
+
+    Routes match on path only, so every host is served the same fixture.
+    Returns whether the Envoy serves inverter data.
+    """
+    fixture = FIXTURES_DIR / firmware
+
+    def _body(name):
+        return Response(200, content=(fixture / name).read_bytes())
+
+    router.get(path="/info.xml").mock(return_value=Response(200, text=""))
+    if (fixture / "production.json").exists():
+        router.get(path="/production.json").mock(return_value=_body("production.json"))
+    else:
+        router.get(path="/production.json").mock(return_value=Response(404))
+    router.get(path="/api/v1/production").mock(return_value=_body("api_v1_production"))
+    if inverters is not None:
+        router.get(path="/api/v1/production/inverters").mock(
+            return_value=Response(200, json=inverters)
+        )
+        return True
+    if (fixture / "api_v1_production_inverters").exists():
+        router.get(path="/api/v1/production/inverters").mock(
+            return_value=_body("api_v1_production_inverters")
+        )
+        return True
+    return False
+
+
+async def measure(name, func, iterations, **extra):
+    """Time ``iterations`` awaits of ``func`` and return the result dict."""
+    wall = []
+    cpu = []
+    for _ in range(iterations):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        await func()
+        cpu.append(time.process_time() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        await func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "case": name,
+        "iterations": iterations,
+        "wall_us_median": round(statistics.median(wall) * 1e6, 1),
+        "wall_us_min": round(min(wall) * 1e6, 1),
+        "cpu_us_median": round(statistics.median(cpu) * 1e6, 1),
+        "cpu_us_min": round(min(cpu) * 1e6, 1),
+        "alloc_peak_bytes": peak - baseline,
+        **extra,
+    }
+
+
+async def bench_firmware(firmware, iterations):
+    """Yield the poll and accessor results of one firmware fixture."""
+    with respx.mock(assert_all_called=False) as router:
+        has_inverters = mock_envoy(router, firmware)
+        async with EnvoyReader("127.0.0.1", inverters=has_inverters) as reader:
+            await reader.getData()
+
+            async def _accessors():
+                for accessor in ACCESSORS:
+                    await getattr(reader, accessor)()
+
+            yield await measure(f"poll/{firmware}", reader.getData, iterations)
+            yield await measure(f"accessors/{firmware}", _accessors, iterations)
+
+
+async def bench_inverters(count, iterations):
+    """Yield the poll and inverters_production() results for ``count`` inverters."""
+    with respx.mock(assert_all_called=False) as router:
+        mock_envoy(router, "5.0.49", inverters=synthetic_inverters(count))
+        async with EnvoyReader("127.0.0.1", inverters=True) as reader:
+            await reader.getData()
+            yield await measure(f"poll_inverters/{count}", reader.getData, iterations)
+            yield await measure(
+                f"inverters_production/{count}",
+                reader.inverters_production,
+                iterations,
+            )
+
+
+async def bench_fleet(size, iterations, latency=0):
+    """Yield the result of polling a fleet of ``size`` simulated hosts."""
+    hosts = [f"10.{idx // 65536}.{idx // 256 % 256}.{idx % 256}" for idx in range(size)]
+    simulator = EnvoySimulator(FIXTURES_DIR / "5.0.49", latency=latency)
+    async with httpx.AsyncClient(transport=simulator) as client:
+        async with EnvoyFleet(hosts, async_client=client, inverters=True) as fleet:
+            await fleet.poll()
+            rounds = []
+
+            async def _round():
+                rounds.append(await fleet.poll())
+
+            result = await measure(f"fleet/{size}", _round, iterations)
+            # The last round ran under tracemalloc, leave it out of the rates.
+            rounds = rounds[:iterations]
+            result["errors"] = sum(len(fleet_round.errors) for fleet_round in rounds)
+            result["hosts_per_second"] = round(
+                statistics.median(r.hosts_per_second for r in rounds), 1
+            )
+            result["latency_p95_ms"] = round(
+                statistics.median(r.latency_p95 for r in rounds) * 1e3, 3
+            )
+            yield result
+
+
+async def run(iterations, only=None, latency=0):
+    """Run the selected cases and print one JSON line per result."""
+    cases = [
+        (("poll/", "accessors/"), bench_firmware, firmware, iterations)
+        for firmware in FIRMWARES
+    ]
+    cases += [
+        (
+            ("poll_inverters/", "inverters_production/"),
+            bench_inverters,
+            count,
+            iterations,
+        )
+        for count in INVERTER_COUNTS
+    ]
+    fleet_iterations = max(1, iterations // 10)
+    cases += [
+        (
+            ("fleet/",),
+            functools.partial(bench_fleet, latency=latency),
+            size,
+            fleet_iterations,
+        )
+        for size in FLEET_SIZES
+    ]
+    for prefixes, bench, param, count in cases:
+        names = [f"{prefix}{param}" for prefix in prefixes]
+        if only and not any(name.startswith(only) for name in names):
+            continue
+        async for result in bench(param, count):
+            if only and not result["case"].startswith(only):
+                continue
+            result["python"] = sys.version.split()[0]
+            print(json.dumps(result), flush=True)
+
+
+def main(argv=None):
+    """Parse the command line and run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--only", default=None, help="only print cases starting with this prefix"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="simulated Envoy latency (s)"
+    )
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.iterations, args.only, args.latency))
+
+
+if __name__ == "__main__":
+    main()
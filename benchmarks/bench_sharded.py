@@ -0,0 +1,77 @@
+"""Measure how ShardedFleet throughput scales with worker processes.
+
+Run with ``python -m benchmarks.bench_sharded`` from the repository root.
+Every worker polls its hosts through its own EnvoySimulator, answering after
+``--latency`` seconds with ``--inverters`` synthetic inverters, so the
+figures cover decoding, snapshot building and the trip of the results back
+to the parent. Prints one JSON object per worker count, with the median
+hosts polled per second over ``--rounds`` rounds after a warm-up round.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+from pathlib import Path
+
+from envoy_reader.sharding import ShardedFleet
+from envoy_reader.simulator import EnvoySimulator
+
+FIXTURE_DIR = Path(__file__).parent.parent / "tests" / "fixtures" / "5.0.49"
+
+
+async def bench(workers, hosts, rounds, latency, inverters):
+    """Return the result dict of polling ``hosts`` simulated hosts."""
+    simulator = EnvoySimulator(
+        FIXTURE_DIR, inverter_count=inverters, latency=latency, seed=1
+    )
+    fleet = ShardedFleet(
+        [f"10.{idx // 65536}.{idx // 256 % 256}.{idx % 256}" for idx in range(hosts)],
+        workers=workers,
+        max_concurrency=500,
+        transport=simulator,
+        inverters=True,
+    )
+    async with fleet:
+        await fleet.poll()
+        rates = []
+        errors = 0
+        for _ in range(rounds):
+            fleet_round = await fleet.poll()
+            rates.append(len(fleet_round.results) / fleet_round.elapsed)
+            errors += len(fleet_round.errors)
+    return {
+        "case": f"sharded/{workers}",
+        "hosts": hosts,
+        "rounds": rounds,
+        "hosts_per_s_median": round(statistics.median(rates), 1),
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    """Poll the simulated fleet with 1, 2, 4, ... workers and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--inverters", type=int, default=30)
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Largest worker count to measure",
+    )
+    args = parser.parse_args(argv)
+
+    workers = 1
+    while workers <= args.max_workers:
+        result = asyncio.run(
+            bench(workers, args.hosts, args.rounds, args.latency, args.inverters)
+        )
+        print(json.dumps(result))
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
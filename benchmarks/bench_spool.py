@@ -0,0 +1,111 @@
+"""Measure the throughput of the on-disk SnapshotSpool.
+
+Run with ``python -m benchmarks.bench_spool`` from the repository root.
+Prints one JSON object per case:
+
+* ``append/<inverters>``: append() one reading at a time
+* ``extend/<inverters>``: extend() with all readings in one call
+* ``read/<inverters>``: read() and commit() everything appended
+
+where ``<inverters>`` is the number of inverters per reading. Each case
+reports readings per second and the bytes per reading on disk.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+from envoy_reader.envoy_reader import EnvoySnapshot
+from envoy_reader.inverters import InverterTable
+from envoy_reader.spool import SnapshotSpool
+
+INVERTER_COUNTS = (0, 30)
+
+
+def _readings(count, inverter_count):
+    inverters = None
+    if inverter_count:
+        inverters = InverterTable(
+            [f"1219{idx:08d}" for idx in range(inverter_count)],
+            [250] * inverter_count,
+            [1600000000] * inverter_count,
+        )
+    return [
+        (
+            f"envoy-{idx % 1000}",
+            EnvoySnapshot(
+                timestamp=1600000000.0 + idx,
+                endpoint_type="PC",
+                is_metering_enabled=True,
+                production=idx,
+                consumption=idx,
+                daily_production=17920,
+                daily_consumption=20000,
+                lifetime_production=2**40,
+                lifetime_consumption=2**40,
+                inverters=inverters,
+            ),
+        )
+        for idx in range(count)
+    ]
+
+
+def _report(case, count, seconds, disk_usage):
+    print(
+        json.dumps(
+            {
+                "case": case,
+                "readings": count,
+                "readings_per_s": round(count / seconds),
+                "bytes_per_reading": round(disk_usage / count, 1),
+            }
+        )
+    )
+
+
+def main(argv=None):
+    """Time appending and replaying readings and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument(
+        "--sync-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between fsyncs, 0 to fsync every append",
+    )
+    args = parser.parse_args(argv)
+
+    for inverter_count in INVERTER_COUNTS:
+        readings = _readings(args.readings, inverter_count)
+        for case in ("append", "extend"):
+            with tempfile.TemporaryDirectory() as directory:
+                with SnapshotSpool(
+                    directory, max_bytes=None, sync_interval=args.sync_interval
+                ) as spool:
+                    count = len(readings)
+                    started = time.perf_counter()
+                    if case == "append":
+                        for host, snapshot in readings:
+                            spool.append(host, snapshot)
+                    else:
+                        spool.extend(readings)
+                    spool.sync()
+                    seconds = time.perf_counter() - started
+                    disk_usage = spool.disk_usage
+                    _report(f"{case}/{inverter_count}", count, seconds, disk_usage)
+                    if case != "extend":
+                        continue
+                    started = time.perf_counter()
+                    count = 0
+                    while True:
+                        batch = spool.read()
+                        if not batch:
+                            break
+                        count += len(batch)
+                        spool.commit()
+                    seconds = time.perf_counter() - started
+                    _report(f"read/{inverter_count}", count, seconds, disk_usage)
+
+
+if __name__ == "__main__":
+    main()
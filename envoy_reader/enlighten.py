@@ -0,0 +1,187 @@
+"""Share one Enlighten login across the readers of an installer account."""
+import asyncio
+import functools
+import html
+import logging
+import re
+import time
+
+import httpx
+
+LOGIN_URL = "https://entrez.enphaseenergy.com/login"
+TOKEN_URL = "https://entrez.enphaseenergy.com/entrez_tokens"
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_RATE_LIMIT = 5
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class EnlightenAuthError(Exception):
+    """Enlighten did not return a token."""
+
+
+@functools.lru_cache(8)
+def _tag_regex(tag):
+    return re.compile(
+        rf"<{tag}(?:\s[^>]*)?>(.*?)</{tag}\s*>", re.IGNORECASE | re.DOTALL
+    )
+
+
+def tag_text(text, tag):
+    """Return the stripped text of the first ``tag`` element, or None.
+
+    Enough for the one-element pages served by Enlighten and the Envoy,
+    without pulling in a full HTML parser.
+    """
+    match = _tag_regex(tag).search(text)
+    if match is None:
+        return None
+    return html.unescape(re.sub(r"<[^>]*>", "", match.group(1))).strip()
+
+
+def parse_token_html(text):
+    """Return the token from the entrez token page, or None if missing."""
+    return tag_text(text, "textarea") or None
+
+
+class EnlightenSession:
+    """Log in to Enlighten once and fetch tokens for many Envoys.
+
+    The login cookie is reused for every token request until Enlighten
+    rejects it. Token requests run at most ``max_concurrency`` at a time and
+    start at most ``rate_limit`` per second. A session can be shared by any
+    number of readers through their ``enlighten_session`` argument.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        username,
+        password,
+        async_client=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        rate_limit=DEFAULT_RATE_LIMIT,
+    ):
+        """Init the EnlightenSession."""
+        self.username = username
+        self.password = password
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.login_count = 0
+        self._async_client = async_client
+        self._owns_async_client = async_client is None
+        self._cookies = None
+        self._login_task = None
+        self._semaphore = None
+        self._throttle_lock = None
+        self._next_request_at = 0.0
+
+    @property
+    def async_client(self):
+        """Return the httpx client."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient()
+            self._owns_async_client = True
+        return self._async_client
+
+    async def __aenter__(self):
+        """Enter the session's context."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Close the session when leaving the context."""
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the httpx client if it was created by the session."""
+        if self._owns_async_client and self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def _throttle(self):
+        """Wait until the rate limit allows another request to start."""
+        if not self.rate_limit:
+            return
+        if self._throttle_lock is None:
+            self._throttle_lock = asyncio.Lock()
+        async with self._throttle_lock:
+            delay = self._next_request_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_request_at = time.monotonic() + 1 / self.rate_limit
+
+    async def _async_post(self, url, data):
+        """Post to Enlighten once the rate limit allows it."""
+        await self._throttle()
+        _LOGGER.debug("HTTP POST Attempt: %s", url)
+        # An owned client keeps the login cookie in its own jar; a shared
+        # client may hold cookies of other accounts, so pass ours explicitly.
+        cookies = None if self._owns_async_client else self._cookies
+        resp = await self.async_client.post(url, cookies=cookies, data=data, timeout=30)
+        _LOGGER.debug("HTTP POST %s: %s", url, resp)
+        return resp
+
+    async def async_login(self):
+        """Log in to Enlighten, joining a login that is already running."""
+        if self._login_task is None or self._login_task.done():
+            self._login_task = asyncio.ensure_future(self._async_login())
+        await asyncio.shield(self._login_task)
+
+    async def _async_login(self):
+        """Log in to Enlighten and store the session cookie."""
+        self.login_count += 1
+        self._cookies = None
+        resp = await self._async_post(
+            LOGIN_URL, data={"username": self.username, "password": self.password}
+        )
+        self._cookies = resp.cookies
+
+    async def async_get_token(self, serial_num=None, site_id=None, commissioned=True):
+        """Return an Envoy token for a serial number.
+
+        Uncommissioned tokens are not tied to a site or serial number.
+        """
+        if commissioned:
+            payload = {"Site": site_id, "serialNum": serial_num}
+        else:
+            payload = {"uncommissioned": "true", "Site": ""}
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            for attempt in range(2):
+                if self._cookies is None or attempt:
+                    await self.async_login()
+                response = await self._async_post(TOKEN_URL, data=payload)
+                token = None
+                if response.status_code == 200:
+                    token = parse_token_html(response.text)
+                if token:
+                    _LOGGER.debug("Token for %s: %s", serial_num, token)
+                    return token
+                _LOGGER.debug("No token for %s, logging in again", serial_num)
+
+        raise EnlightenAuthError(f"Enlighten did not return a token for {serial_num}")
+
+    async def async_get_tokens(self, serial_nums, site_id=None):
+        """Fetch tokens for many serial numbers concurrently.
+
+        ``serial_nums`` is a dict mapping each serial number to the site ID
+        it is commissioned on, or an iterable of serial numbers and
+        ``(serial, site_id)`` pairs. ``site_id`` is used for serial numbers
+        without a site of their own.
+
+        Returns a dict mapping each serial number to its token, or to the
+        exception raised while fetching it.
+        """
+        if isinstance(serial_nums, dict):
+            serial_nums = serial_nums.items()
+        sites = {}
+        for item in serial_nums:
+            serial, site = item if isinstance(item, tuple) else (item, None)
+            sites[serial] = site if site is not None else site_id
+        results = await asyncio.gather(
+            *(self.async_get_token(serial, site) for serial, site in sites.items()),
+            return_exceptions=True,
+        )
+        return dict(zip(sites, results))
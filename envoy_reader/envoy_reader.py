@@ -1,28 +1,58 @@
 """Module to read production and consumption values from an Enphase Envoy on the local network."""
 import argparse
 import asyncio
-import datetime
+import functools
+import json
 import logging
-import jwt
+import random
 import re
 import time
 from json.decoder import JSONDecodeError
 
 import httpx
-from bs4 import BeautifulSoup
-from envoy_utils.envoy_utils import EnvoyUtils
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from .enlighten import LOGIN_URL, TOKEN_URL, EnlightenSession, tag_text  # noqa: F401
+from .instrumentation import (
+    EVENT_ACCESSOR,
+    EVENT_DETECTION_PROBE,
+    EVENT_PARSE,
+    EVENT_REQUEST,
+    EVENT_TOKEN_REFRESH,
+    ConnectTrace,
+)
+from .inverters import InverterTable
+from .retry import STATE_CLOSED, CircuitBreaker, CircuitOpenError, RetryPolicy
+from .schedule import TickSchedule
+from .timeouts import AdaptiveTimeouts
+from .token_manager import DEFAULT_REFRESH_MARGIN, TokenManager
 
 #
 # Legacy parser is only used on ancient firmwares
 #
-PRODUCTION_REGEX = r"<td>Currentl.*</td>\s+<td>\s*(\d+|\d+\.\d+)\s*(W|kW|MW)</td>"
-DAY_PRODUCTION_REGEX = r"<td>Today</td>\s+<td>\s*(\d+|\d+\.\d+)\s*(Wh|kWh|MWh)</td>"
-WEEK_PRODUCTION_REGEX = (
-    r"<td>Past Week</td>\s+<td>\s*(\d+|\d+\.\d+)\s*(Wh|kWh|MWh)</td>"
-)
-LIFE_PRODUCTION_REGEX = (
-    r"<td>Since Installation</td>\s+<td>\s*(\d+|\d+\.\d+)\s*(Wh|kWh|MWh)</td>"
+# All four values of the /production page are extracted in one scan. The
+# label selects the metric and the unit is normalized to W or Wh.
+LEGACY_PRODUCTION_REGEX = re.compile(
+    r"<td>(Currentl[^<]*|Today|Past Week|Since Installation)</td>\s+"
+    r"<td>\s*(\d+(?:\.\d+)?)\s*(W|kW|MW|Wh|kWh|MWh)</td>"
 )
+LEGACY_PRODUCTION_METRICS = {
+    "Today": "daily_production",
+    "Past Week": "seven_days_production",
+    "Since Installation": "lifetime_production",
+}
+LEGACY_UNIT_FACTORS = {
+    "W": 1,
+    "Wh": 1,
+    "kW": 1000,
+    "kWh": 1000,
+    "MW": 1000000,
+    "MWh": 1000000,
+}
 SERIAL_REGEX = re.compile(r"Envoy\s*Serial\s*Number:\s*([0-9]+)")
 
 ENDPOINT_URL_PRODUCTION_JSON = "http{}://{}/production.json"
@@ -31,18 +61,39 @@ ENDPOINT_URL_PRODUCTION_INVERTERS = "http{}://{}/api/v1/production/inverters"
 ENDPOINT_URL_PRODUCTION = "http{}://{}/production"
 ENDPOINT_URL_CHECK_JWT = "https://{}/auth/check_jwt"
 
+# Requests in flight to one Envoy at a time: the detection probes and the
+# serial lookup, or the production and inverter endpoints of a poll.
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+
 # pylint: disable=pointless-string-statement
 
 ENVOY_MODEL_S = "PC"
 ENVOY_MODEL_C = "P"
 ENVOY_MODEL_LEGACY = "P0"
 
-LOGIN_URL = "https://entrez.enphaseenergy.com/login"
-TOKEN_URL = "https://entrez.enphaseenergy.com/entrez_tokens"
-
 _LOGGER = logging.getLogger(__name__)
 
 
+def decode_json_stdlib(content):
+    """Decode a JSON body from bytes with the standard library."""
+    return json.loads(content)
+
+
+def decode_json_orjson(content):
+    """Decode a JSON body from bytes with orjson."""
+    return orjson.loads(content)
+
+
+# The default decoder parses response bytes directly, using orjson when it
+# is installed.
+decode_json = decode_json_orjson if orjson is not None else decode_json_stdlib
+
+
+def _endpoint_path(url):
+    """Return the path of an Envoy URL."""
+    return "/" + url.partition("//")[2].partition("/")[2]
+
+
 def has_production_and_consumption(json):
     """Check if json has keys for both production and consumption."""
     return "production" in json and "consumption" in json
@@ -53,10 +104,195 @@ def has_metering_setup(json):
     return json["production"][1]["activeCount"] > 0
 
 
+@functools.lru_cache(maxsize=64)
+def parse_legacy_production(text):
+    """Parse the legacy /production page in a single pass.
+
+    Returns the current production (W) and today's, last seven days' and
+    lifetime production (Wh) as a tuple of ints, with None for values not
+    found. Results are cached by page body.
+    """
+    values = {}
+    for match in LEGACY_PRODUCTION_REGEX.finditer(text):
+        label, number, unit = match.groups()
+        metric = LEGACY_PRODUCTION_METRICS.get(label, "production")
+        values.setdefault(metric, int(float(number) * LEGACY_UNIT_FACTORS[unit]))
+    return (
+        values.get("production"),
+        values.get("daily_production"),
+        values.get("seven_days_production"),
+        values.get("lifetime_production"),
+    )
+
+
+class EnvoySnapshot:
+    """Immutable set of values parsed from one poll of an Envoy.
+
+    Every endpoint body is decoded once when the snapshot is built and only
+    the metrics are kept, as plain ints. Values the Envoy did not report are
+    None. ``inverters`` is an InverterTable, or None if inverter data was not
+    retrieved.
+    """
+
+    __slots__ = (
+        "timestamp",
+        "endpoint_type",
+        "is_metering_enabled",
+        "production",
+        "consumption",
+        "daily_production",
+        "daily_consumption",
+        "seven_days_production",
+        "seven_days_consumption",
+        "lifetime_production",
+        "lifetime_consumption",
+        "battery_storage",
+        "inverters",
+    )
+
+    def __init__(self, **values):
+        """Init the EnvoySnapshot."""
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, EnvoySnapshot):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        values = ", ".join(f"{key}={value!r}" for key, value in self.as_dict().items())
+        return f"{type(self).__name__}({values})"
+
+    def as_dict(self):
+        """Return the snapshot values as a dict."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_payloads(  # pylint: disable=too-many-arguments
+        cls,
+        endpoint_type,
+        is_metering_enabled,
+        production_json=None,
+        production_v1_json=None,
+        production_html=None,
+        inverters_json=None,
+        inverters=None,
+        timestamp=None,
+    ):
+        """Build a snapshot from the decoded endpoint bodies of one poll.
+
+        ``inverters`` carries already parsed inverter readings over from a
+        previous snapshot when ``inverters_json`` was not fetched.
+        """
+        values = {
+            "timestamp": time.time() if timestamp is None else timestamp,
+            "endpoint_type": endpoint_type,
+            "is_metering_enabled": is_metering_enabled,
+        }
+
+        if production_json is not None:
+            idx = 1 if is_metering_enabled else 0
+            try:
+                values["production"] = int(production_json["production"][idx]["wNow"])
+            except (KeyError, IndexError, TypeError):
+                pass
+            if is_metering_enabled:
+                try:
+                    meter = production_json["production"][1]
+                    values["daily_production"] = int(meter["whToday"])
+                    values["seven_days_production"] = int(meter["whLastSevenDays"])
+                    values["lifetime_production"] = int(meter["whLifetime"])
+                except (KeyError, IndexError, TypeError):
+                    pass
+            try:
+                meter = production_json["consumption"][0]
+                values["consumption"] = int(meter["wNow"])
+                values["daily_consumption"] = int(meter["whToday"])
+                values["seven_days_consumption"] = int(meter["whLastSevenDays"])
+                values["lifetime_consumption"] = int(meter["whLifetime"])
+            except (KeyError, IndexError, TypeError):
+                pass
+            try:
+                storage = production_json["storage"][0]
+                if "percentFull" in storage:
+                    values["battery_storage"] = storage
+            except (KeyError, IndexError, TypeError):
+                pass
+
+        if production_v1_json is not None:
+            try:
+                if production_json is None:
+                    values["production"] = int(production_v1_json["wattsNow"])
+                values["daily_production"] = int(production_v1_json["wattHoursToday"])
+                values["seven_days_production"] = int(
+                    production_v1_json["wattHoursSevenDays"]
+                )
+                values["lifetime_production"] = int(
+                    production_v1_json["wattHoursLifetime"]
+                )
+            except (KeyError, TypeError):
+                pass
+
+        if production_html is not None:
+            (
+                values["production"],
+                values["daily_production"],
+                values["seven_days_production"],
+                values["lifetime_production"],
+            ) = parse_legacy_production(production_html)
+
+        values["inverters"] = inverters
+        if inverters_json is not None:
+            try:
+                values["inverters"] = InverterTable.from_json(inverters_json)
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass
+
+        return cls(**values)
+
+
 class SwitchToHTTPS(Exception):
     pass
 
 
+class ReusableDigestAuth(httpx.DigestAuth):
+    """Digest auth that counts the challenges answered and avoided.
+
+    httpx keeps the last challenge and signs later requests with it, so only
+    the first request (or one the Envoy rejects) pays the extra 401 round
+    trip. This wraps the stock flow to count how often that happens.
+    """
+
+    def __init__(self, username, password):
+        """Init the ReusableDigestAuth."""
+        super().__init__(username, password)
+        self.challenges = 0
+        self.challenges_avoided = 0
+
+    def auth_flow(self, request):
+        """Run the httpx digest flow, counting challenges."""
+        flow = super().auth_flow(request)
+        request = next(flow)
+        signed = "Authorization" in request.headers
+        while True:
+            response = yield request
+            try:
+                request = flow.send(response)
+            except StopIteration:
+                break
+            self.challenges += 1
+            signed = False
+        if signed:
+            self.challenges_avoided += 1
+
+
 class EnvoyReader:  # pylint: disable=too-many-instance-attributes
     """Instance of EnvoyReader"""
 
@@ -85,155 +321,309 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         enlighten_site_id=None,
         enlighten_serial_num=None,
         https_flag="",
+        concurrent_requests=False,
+        max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+        detection_record=None,
+        state_store=None,
+        token_refresh_margin=DEFAULT_REFRESH_MARGIN,
+        enlighten_session=None,
+        history=None,
+        json_decoder=None,
+        retry_policy=None,
+        circuit_breaker=None,
+        timeouts=None,
+        hooks=None,
     ):
         """Init the EnvoyReader."""
         self.host = host.lower()
         self.username = username
         self.password = password
+        self._configured_password = password
         self.get_inverters = inverters
         self.endpoint_type = None
+        self.serial_number = None
         self.serial_number_last_six = None
-        self.endpoint_production_json_results = None
-        self.endpoint_production_v1_results = None
-        self.endpoint_production_inverters = None
-        self.endpoint_production_results = None
+        self.snapshot = None
+        self.history = history
+        self.json_decoder = json_decoder or decode_json
+        self.endpoint_errors = {}
+        self.concurrent_requests = concurrent_requests
+        self.max_concurrent_requests = max_concurrent_requests
+        self._request_semaphore = None
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.timeouts = timeouts or AdaptiveTimeouts()
+        self.hooks = list(hooks or ())
+        self.skipped_ticks = 0
+        self._inverters_auth = None
+        self._inverters_auth_credentials = None
+        self._last_inverters = None
+        self._inverter_changes = None
         self.isMeteringEnabled = False  # pylint: disable=invalid-name
         self._async_client = async_client
-        self._authorization_header = None
+        self._owns_async_client = async_client is None
         self.enlighten_user = enlighten_user
         self.enlighten_pass = enlighten_pass
+        self.enlighten_session = enlighten_session
         self.commissioned = commissioned
         self.enlighten_site_id = enlighten_site_id
         self.enlighten_serial_num = enlighten_serial_num
         self.https_flag = https_flag
-        self._token = ""
+        self._token_manager = TokenManager(self._refresh_token, token_refresh_margin)
+        self.state_store = state_store
+        self._state_loaded = False
+        self._state_restored = False
+        self._saved_state = None
+        if detection_record:
+            self._apply_detection_record(detection_record)
+
+    async def __aenter__(self):
+        """Enter the reader's context; the connection pool stays open."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Close the connection pool when leaving the reader's context."""
+        await self.aclose()
 
     @property
     def async_client(self):
-        """Return the httpx client."""
-        return self._async_client or httpx.AsyncClient(verify=False)
+        """Return the httpx client.
+
+        The client is created on first use and kept for the lifetime of the
+        reader so every poll reuses the same keep-alive connection pool.
+        """
+        if self._async_client is None or (
+            self._owns_async_client and self._async_client.is_closed
+        ):
+            self._async_client = httpx.AsyncClient(verify=False)
+            self._owns_async_client = True
+        return self._async_client
+
+    async def aclose(self):
+        """Close the httpx client if it was created by the reader.
+
+        Clients passed in through ``async_client`` are left open since the
+        caller owns them. Pending state store writes are flushed.
+        """
+        self._token_manager.close()
+        if self.state_store is not None:
+            await self.state_store.aflush()
+        if self._owns_async_client and self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
 
     async def _update(self):
-        """Update the data."""
+        """Update the data and return the decoded endpoint bodies."""
+        payloads = {}
         if self.endpoint_type == ENVOY_MODEL_S:
-            await self._update_from_pc_endpoint()
+            response = await self._update_from_pc_endpoint()
+            response.raise_for_status()
+            payloads["production_json"] = self._decode_json(response)
         if self.endpoint_type == ENVOY_MODEL_C or (
             self.endpoint_type == ENVOY_MODEL_S and not self.isMeteringEnabled
         ):
-            await self._update_from_p_endpoint()
+            response = await self._update_from_p_endpoint()
+            response.raise_for_status()
+            payloads["production_v1_json"] = self._decode_json(response)
         if self.endpoint_type == ENVOY_MODEL_LEGACY:
-            await self._update_from_p0_endpoint()
+            response = await self._update_from_p0_endpoint()
+            response.raise_for_status()
+            payloads["production_html"] = response.text
+        return payloads
 
     async def _update_from_pc_endpoint(self):
         """Update from PC endpoint."""
-        await self._update_endpoint(
-            "endpoint_production_json_results", ENDPOINT_URL_PRODUCTION_JSON
-        )
+        return await self._update_endpoint(ENDPOINT_URL_PRODUCTION_JSON)
 
     async def _update_from_p_endpoint(self):
         """Update from P endpoint."""
-        await self._update_endpoint(
-            "endpoint_production_v1_results", ENDPOINT_URL_PRODUCTION_V1
-        )
+        return await self._update_endpoint(ENDPOINT_URL_PRODUCTION_V1)
 
     async def _update_from_p0_endpoint(self):
         """Update from P0 endpoint."""
-        await self._update_endpoint(
-            "endpoint_production_results", ENDPOINT_URL_PRODUCTION
-        )
+        return await self._update_endpoint(ENDPOINT_URL_PRODUCTION)
 
-    async def _update_endpoint(self, attr, url):
-        """Update a property from an endpoint."""
+    async def _update_endpoint(self, url):
+        """Fetch an endpoint and return the response."""
         formatted_url = url.format(self.https_flag, self.host)
-        response = await self._async_fetch_with_retry(
-            formatted_url, follow_redirects=False
-        )
-        setattr(self, attr, response)
+        return await self._async_fetch_with_retry(formatted_url, follow_redirects=False)
+
+    def _device_semaphore(self):
+        """Return the semaphore limiting concurrent requests to the Envoy."""
+        if self._request_semaphore is None:
+            self._request_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._request_semaphore
+
+    async def _async_fetch_with_retry(self, url, refresh_on_401=True, **kwargs):
+        """Fetch the url, retrying transport errors as the retry policy says."""
+        """A 401 with an Enphase token refreshes the token and retries once."""
+        async with self._device_semaphore():
+            resp = await self._async_fetch_with_retry_unlocked(url, **kwargs)
+        if (
+            resp.status_code == 401
+            and refresh_on_401
+            and self.https_flag == "s"
+            and self._token_manager.token
+        ):
+            _LOGGER.debug("Token rejected by %s, refreshing", url)
+            await self._token_manager.refresh()
+            async with self._device_semaphore():
+                resp = await self._async_fetch_with_retry_unlocked(url, **kwargs)
+        return resp
+
+    async def _async_fetch_with_retry_unlocked(self, url, **kwargs):
+        """Fetch the url through the circuit breaker, without a limit."""
+        self.circuit_breaker.before_request(url)
+        try:
+            resp = await self._async_fetch_attempts(url, **kwargs)
+        except httpx.TransportError:
+            self.circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            self.circuit_breaker.release_probe()
+            raise
+        self.circuit_breaker.record_success()
+        return resp
 
-    async def _async_fetch_with_retry(self, url, **kwargs):
-        """Retry 3 times to fetch the url if there is a transport error."""
-        for attempt in range(3):
+    async def _async_fetch_attempts(self, url, **kwargs):
+        """Fetch the url, backing off between retries of transport errors."""
+        attempts = self.retry_policy.attempts
+        for attempt in range(attempts):
             _LOGGER.debug(
                 "HTTP GET Attempt #%s: %s: Header:%s",
                 attempt + 1,
                 url,
                 self._authorization_header,
             )
+            # Detection keeps the generous initial timeout, later requests
+            # get one derived from the latency the endpoint has shown.
+            timeout = self.timeouts.timeout(url, detecting=not self.endpoint_type)
+            trace = None
+            if self.hooks:
+                trace = ConnectTrace()
+                kwargs["extensions"] = {"trace": trace}
+            start = time.monotonic()
             try:
-                async with self.async_client as client:
-                    resp = await client.get(
-                        url, headers=self._authorization_header, timeout=30, **kwargs
-                    )
-                    _LOGGER.debug("Fetched from %s: %s: %s", url, resp, resp.text)
-                    return resp
-            except httpx.TransportError:
-                if attempt == 2:
-                    raise
-
-    async def _async_post(self, url, data, cookies=None, **kwargs):
-        _LOGGER.debug("HTTP POST Attempt: %s", url)
-        # _LOGGER.debug("HTTP POST Data: %s", data)
-        try:
-            async with self.async_client as client:
-                resp = await client.post(
-                    url, cookies=cookies, data=data, timeout=30, **kwargs
+                resp = await self.async_client.get(
+                    url, headers=self._authorization_header, timeout=timeout, **kwargs
                 )
-                _LOGGER.debug("HTTP POST %s: %s: %s", url, resp, resp.text)
-                _LOGGER.debug("HTTP POST Cookie: %s", resp.cookies)
+                elapsed = time.monotonic() - start
+                self.timeouts.observe(url, elapsed)
+                if trace is not None:
+                    self._emit_request(url, attempt, elapsed, trace, response=resp)
+                _LOGGER.debug("Fetched from %s: %s: %s", url, resp, resp.text)
                 return resp
-        except httpx.TransportError:  # pylint: disable=try-except-raise
-            raise
+            except httpx.TransportError as err:
+                if trace is not None:
+                    elapsed = time.monotonic() - start
+                    self._emit_request(url, attempt, elapsed, trace, error=err)
+                if isinstance(err, httpx.TimeoutException):
+                    self.timeouts.record_timeout(url)
+                if attempt == attempts - 1:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                _LOGGER.debug(
+                    "Fetching %s failed (%r), retry in %.2fs", url, err, delay
+                )
+            await asyncio.sleep(delay)
+
+    def _emit(self, event, **fields):
+        """Report an event to every hook."""
+        fields["host"] = self.host
+        fields["model"] = self.endpoint_type
+        fields.setdefault("error", None)
+        for hook in self.hooks:
+            try:
+                hook(event, fields)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Hook %r failed on %s", hook, event)
 
-    async def _getEnphaseToken(  # pylint: disable=invalid-name
-        self,
+    def _emit_request(  # pylint: disable=too-many-arguments
+        self, url, attempt, elapsed, trace, response=None, error=None
     ):
-        payload_login = {
-            "username": self.enlighten_user,
-            "password": self.enlighten_pass,
-        }
+        """Report an HTTP request to the hooks."""
+        self._emit(
+            EVENT_REQUEST,
+            endpoint=_endpoint_path(url),
+            status=None if response is None else response.status_code,
+            bytes=0 if response is None else len(response.content),
+            attempt=attempt + 1,
+            elapsed=elapsed,
+            connect=trace.connect_time,
+            error=None if error is None else repr(error),
+        )
 
-        # Login to website and store cookie
-        resp = await self._async_post(LOGIN_URL, data=payload_login)
+    def _decode_json(self, response):
+        """Decode a JSON response body, reporting the time taken to the hooks."""
+        if not self.hooks:
+            return self.json_decoder(response.content)
+        start = time.monotonic()
+        result = self.json_decoder(response.content)
+        self._emit(
+            EVENT_PARSE,
+            endpoint=response.url.path,
+            bytes=len(response.content),
+            elapsed=time.monotonic() - start,
+        )
+        return result
 
-        if self.commissioned == "True" or self.commissioned == "Commissioned":
-            payload_token = {
-                "Site": self.enlighten_site_id,
-                "serialNum": self.enlighten_serial_num,
-            }
-            response = await self._async_post(
-                TOKEN_URL, data=payload_token, cookies=resp.cookies
+    async def _refresh_token(self):
+        """Fetch a new Enphase token, reporting the refresh to the hooks."""
+        if not self.hooks:
+            return await self._getEnphaseToken()
+        start = time.monotonic()
+        try:
+            result = await self._getEnphaseToken()
+        except Exception as err:
+            self._emit(
+                EVENT_TOKEN_REFRESH, elapsed=time.monotonic() - start, error=repr(err)
             )
+            raise
+        self._emit(EVENT_TOKEN_REFRESH, elapsed=time.monotonic() - start)
+        return result
 
-            parsed_html = BeautifulSoup(response.text, features="html.parser")
-            self._token = parsed_html.body.find(  # pylint: disable=invalid-name, unused-variable, redefined-outer-name
-                "textarea"
-            ).text
-            _LOGGER.debug("Commissioned Token: %s", self._token)
-
-        else:
-            payload_token = {"uncommissioned": "true", "Site": ""}
-            response = await self._async_post(
-                TOKEN_URL, data=payload_token, cookies=resp.cookies
-            )
-            soup = BeautifulSoup(response.text, features="html.parser")
-            self._token = soup.find("textarea").contents[
-                0
-            ]  # pylint: disable=invalid-name
-            _LOGGER.debug("Uncommissioned Token: %s", self._token)
+    async def _getEnphaseToken(  # pylint: disable=invalid-name
+        self,
+    ):
+        # A shared session reuses its login across readers; otherwise log in
+        # for this token only, using the reader's own client.
+        session = self.enlighten_session or EnlightenSession(
+            self.enlighten_user,
+            self.enlighten_pass,
+            async_client=self.async_client,
+            rate_limit=None,
+        )
+        token = await session.async_get_token(
+            self.enlighten_serial_num,
+            self.enlighten_site_id,
+            commissioned=self.commissioned == "True"
+            or self.commissioned == "Commissioned",
+        )
 
-        # Create HTTP Header
-        self._authorization_header = {"Authorization": "Bearer " + self._token}
+        # Store the token, which also creates the HTTP Header
+        self._token_manager.set_token(token)
 
         # Fetch the Enphase Token status from the local Envoy
         token_validation_html = await self._async_fetch_with_retry(
-            ENDPOINT_URL_CHECK_JWT.format(self.host)
+            ENDPOINT_URL_CHECK_JWT.format(self.host), refresh_on_401=False
         )
 
         # Parse the HTML return from Envoy and check the text
-        soup = BeautifulSoup(token_validation_html.text, features="html.parser")
-        token_validation = soup.find("h2").contents[0]
+        token_validation = tag_text(token_validation_html.text, "h2")
         self._is_enphase_token_valid(token_validation)
 
+    @property
+    def _token(self):
+        """Return the current Enphase token."""
+        return self._token_manager.token
+
+    @property
+    def _authorization_header(self):
+        """Return the HTTP header carrying the Enphase token."""
+        if not self._token_manager.token:
+            return None
+        return {"Authorization": "Bearer " + self._token_manager.token}
+
     def _is_enphase_token_valid(self, response):
         if response == "Valid token.":
             _LOGGER.debug("Token is valid")
@@ -242,19 +632,6 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
             _LOGGER.debug("Invalid token!")
             return False
 
-    def _is_enphase_token_expired(self, token):
-        decode = jwt.decode(
-            token, options={"verify_signature": False}, algorithms="ES256"
-        )
-        exp_epoch = decode["exp"]
-        exp_time = datetime.datetime.fromtimestamp(exp_epoch)
-        if datetime.datetime.now() < exp_time:
-            _LOGGER.debug("Token expires at: %s", exp_time)
-            return False
-        else:
-            _LOGGER.debug("Token expired on: %s", exp_time)
-            return True
-
     async def check_connection(self):
         """Check if the Envoy is reachable. Also check if HTTP or"""
         """HTTPS is needed."""
@@ -268,36 +645,159 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
 
     async def getData(self, getInverters=True):  # pylint: disable=invalid-name
         """Fetch data from the endpoint and if inverters selected default"""
-        """to fetching inverter data."""
+        """to fetching inverter data. Returns the EnvoySnapshot of this poll."""
+        if self.state_store is None:
+            return await self._async_get_data(getInverters)
+
+        if not self._state_loaded:
+            self._load_state()
+        try:
+            snapshot = await self._async_get_data(getInverters)
+        except httpx.TransportError:
+            # The Envoy did not answer (including an open circuit breaker),
+            # which says nothing about the stored state; keep it.
+            raise
+        except (httpx.HTTPError, ValueError, RuntimeError):
+            # State restored from the store may be outdated (new firmware,
+            # revoked token); forget it and start over with a full probe.
+            if not self._state_restored or "inverters" in self.endpoint_errors:
+                raise
+            _LOGGER.debug("Stored state for %s was rejected", self.host)
+            self._discard_state()
+            snapshot = await self._async_get_data(getInverters)
+        self._state_restored = False
+        self._save_state()
+        return snapshot
+
+    def _load_state(self):
+        """Warm start from the state store."""
+        self._state_loaded = True
+        state = self.state_store.load(self.host)
+        if not state:
+            return
+        _LOGGER.debug("Restoring stored state for %s", self.host)
+        self._state_restored = self.restore_state(state)
+        self._saved_state = state
+
+    def export_state(self):
+        """Return the detection, password and token as a JSON serializable dict.
+
+        Returns None until the model has been detected. Passing the state to
+        restore_state() of a reader for the same Envoy skips detection and,
+        while the token is valid, the Enlighten login.
+        """
+        if not self.endpoint_type:
+            return None
+        return {
+            "detection": self.detection_record(),
+            "password": self.password if self._configured_password == "" else None,
+            "token": self._token or None,
+            "token_expiry": self._token_manager.expires_at,
+        }
+
+    def restore_state(self, state):
+        """Restore what export_state() returned, keeping what is already known.
+
+        Returns True if anything was restored.
+        """
+        restored = False
+        if not self.endpoint_type and state.get("detection"):
+            self._apply_detection_record(state["detection"])
+            restored = True
+        if self.password == "" and state.get("password"):
+            self.password = state["password"]
+            restored = True
+        if (
+            self._token == ""
+            and state.get("token")
+            and (state.get("token_expiry") or 0) > time.time()
+        ):
+            self._token_manager.set_token(state["token"], state["token_expiry"])
+            restored = True
+        return restored
+
+    def _discard_state(self):
+        """Forget the restored state so the next poll probes the Envoy again."""
+        self.state_store.delete(self.host)
+        self._saved_state = None
+        self._state_restored = False
+        self.endpoint_type = None
+        self.isMeteringEnabled = False
+        self.password = self._configured_password
+        self.serial_number_last_six = None
+        self._token_manager.clear()
+
+    def _save_state(self):
+        """Write the reader state to the state store if it changed."""
+        state = self.export_state()
+        if state is None:
+            return
+        saved = self._saved_state or {}
+        if any(saved.get(key) != value for key, value in state.items()):
+            self.state_store.save(self.host, state)
+            self._saved_state = state
 
+    async def _async_get_data(self, getInverters):  # pylint: disable=invalid-name
+        """Fetch data for one poll."""
         # Check if the Secure flag is set
+        # The token manager refreshes ahead of expiry in the background, so
+        # this only waits on Enlighten for the first token or an expired one.
         if self.https_flag == "s":
-            _LOGGER.debug("Checking Token value: %s", self._token)
-            # Check if a token has already been retrieved
-            if self._token == "":
-                _LOGGER.debug("Found empty token: %s", self._token)
-                await self._getEnphaseToken()
+            await self._token_manager.async_get_token()
+
+        self.endpoint_errors = {}
+        fetch_inverters = self.get_inverters and getInverters
+
+        # The production and inverter endpoints are independent once the
+        # model (and the password derived from the serial) is known, so they
+        # can be requested at the same time.
+        if self.concurrent_requests and self.endpoint_type and fetch_inverters:
+            payloads, inverters_json = await asyncio.gather(
+                self._update(), self._update_inverters(), return_exceptions=True
+            )
+            if isinstance(payloads, BaseException):
+                raise payloads
+            if isinstance(inverters_json, BaseException):
+                self._set_endpoint_error("inverters", inverters_json)
             else:
-                _LOGGER.debug("Token is populated: %s", self._token)
-                if self._is_enphase_token_expired(self._token):
-                    _LOGGER.debug("Found Expired token - Retrieving new token")
-                    await self._getEnphaseToken()
+                payloads["inverters_json"] = inverters_json
+            return self._set_snapshot(payloads)
 
         if not self.endpoint_type:
-            await self.detect_model()
+            payloads = await self.detect_model()
         else:
-            await self._update()
+            payloads = await self._update()
 
-        if not self.get_inverters or not getInverters:
-            return
+        if not fetch_inverters:
+            if self.snapshot is not None:
+                payloads["inverters"] = self.snapshot.inverters
+            return self._set_snapshot(payloads)
 
+        try:
+            payloads["inverters_json"] = await self._update_inverters()
+        except httpx.HTTPError as err:
+            self._set_endpoint_error("inverters", err)
+            if not self.concurrent_requests:
+                self._set_snapshot(payloads)
+                raise
+        return self._set_snapshot(payloads)
+
+    async def _update_inverters(self):
+        """Fetch the inverters endpoint and return the decoded body."""
         inverters_url = ENDPOINT_URL_PRODUCTION_INVERTERS.format(
             self.https_flag, self.host
         )
-        inverters_auth = httpx.DigestAuth(self.username, self.password)
+        # Keep the digest state across polls; it is only rebuilt when the
+        # credentials change, e.g. once the password is derived from the serial.
+        if self._inverters_auth is None or self._inverters_auth_credentials != (
+            self.username,
+            self.password,
+        ):
+            self._inverters_auth = ReusableDigestAuth(self.username, self.password)
+            self._inverters_auth_credentials = (self.username, self.password)
 
         response = await self._async_fetch_with_retry(
-            inverters_url, auth=inverters_auth
+            inverters_url, auth=self._inverters_auth
         )
         _LOGGER.debug(
             "Fetched from %s: %s: %s",
@@ -307,70 +807,172 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         )
         if response.status_code == 401:
             response.raise_for_status()
-        self.endpoint_production_inverters = response
-        return
+        try:
+            return self._decode_json(response)
+        except JSONDecodeError:
+            return None
+
+    @property
+    def digest_auth_stats(self):
+        """Return the digest challenges received and avoided by inverter polls."""
+        if self._inverters_auth is None:
+            return {"challenges": 0, "challenges_avoided": 0}
+        return {
+            "challenges": self._inverters_auth.challenges,
+            "challenges_avoided": self._inverters_auth.challenges_avoided,
+        }
+
+    def _set_endpoint_error(self, endpoint, err):
+        """Record the error of an endpoint that failed during this poll."""
+        if not isinstance(err, Exception):
+            raise err
+        _LOGGER.debug("Fetching %s from %s failed: %r", endpoint, self.host, err)
+        self.endpoint_errors[endpoint] = err
+
+    async def stream(
+        self, interval, jitter=0, getInverters=True, return_exceptions=False
+    ):  # pylint: disable=invalid-name
+        """Poll every ``interval`` seconds and yield each EnvoySnapshot.
+
+        Polls are scheduled on the monotonic clock, so the cadence does not
+        drift by the poll duration. A poll (or consumer) that overruns its
+        tick skips the missed ticks instead of queueing them; skipped ticks
+        are counted in ``skipped_ticks``. Each poll starts a random delay of
+        up to ``jitter`` seconds after its tick. With ``return_exceptions``
+        a failed poll yields its exception instead of ending the stream.
+        """
+        ticks = TickSchedule(interval)
+        while True:
+            if jitter:
+                await asyncio.sleep(random.uniform(0, jitter))
+            try:
+                result = await self.getData(getInverters)
+            except Exception as err:  # pylint: disable=broad-except
+                if not return_exceptions:
+                    raise
+                result = err
+            yield result
+
+            missed = await ticks.wait()
+            if missed:
+                _LOGGER.debug(
+                    "Poll of %s overran, skipped %s ticks", self.host, missed
+                )
+                self.skipped_ticks += missed
+
+    def _set_snapshot(self, payloads):
+        """Build the snapshot for this poll from the decoded endpoint bodies."""
+        fetched_inverters = "inverters_json" in payloads
+        self.snapshot = EnvoySnapshot.from_payloads(
+            self.endpoint_type, self.isMeteringEnabled, **payloads
+        )
+        if fetched_inverters and self.snapshot.inverters is not None:
+            self._inverter_changes = self.snapshot.inverters.changes_since(
+                self._last_inverters
+            )
+            self._last_inverters = self.snapshot.inverters
+        else:
+            self._inverter_changes = None
+        if self.history is not None:
+            self.history.append(self.snapshot)
+        return self.snapshot
+
+    async def _probe_endpoint(self, url):
+        """Fetch an endpoint during detection, returning None on HTTP errors."""
+        start = time.monotonic()
+        try:
+            response = await self._update_endpoint(url)
+        except CircuitOpenError:
+            raise
+        except httpx.HTTPError as err:
+            if self.hooks:
+                self._emit(
+                    EVENT_DETECTION_PROBE,
+                    endpoint=_endpoint_path(url),
+                    status=None,
+                    elapsed=time.monotonic() - start,
+                    error=repr(err),
+                )
+            return None
+        if self.hooks:
+            self._emit(
+                EVENT_DETECTION_PROBE,
+                endpoint=_endpoint_path(url),
+                status=response.status_code,
+                elapsed=time.monotonic() - start,
+            )
+        return response
 
     async def detect_model(self):
         """Method to determine if the Envoy supports consumption values or only production."""
+        """Returns the decoded endpoint bodies fetched while probing."""
         # If a password was not given as an argument when instantiating
         # the EnvoyReader object than use the last six numbers of the serial
         # number as the password.  Otherwise use the password argument value.
-        if self.password == "" and not self.serial_number_last_six:
+        needs_serial = self.password == "" and not self.serial_number_last_six
+        if needs_serial and self.circuit_breaker.state != STATE_CLOSED:
+            # A half open breaker lets a single request through; let the
+            # serial lookup close it before the probes start.
             await self.get_serial_number()
+            needs_serial = False
 
+        # All candidate endpoints are probed at the same time and the most
+        # capable one that answers wins, so an unreachable endpoint only costs
+        # its own retries instead of delaying the probes after it.
+        probes = {}
         try:
-            await self._update_from_pc_endpoint()
-        except httpx.HTTPError:
-            pass
-
-        # If self.endpoint_production_json_results.status_code is set with
-        # 401 then we will give an error
-        if (
-            self.endpoint_production_json_results
-            and self.endpoint_production_json_results.status_code == 401
-        ):
+            for url in (
+                ENDPOINT_URL_PRODUCTION_JSON,
+                ENDPOINT_URL_PRODUCTION_V1,
+                ENDPOINT_URL_PRODUCTION,
+            ):
+                probes[url] = asyncio.ensure_future(self._probe_endpoint(url))
+                if self.circuit_breaker.state != STATE_CLOSED:
+                    # Wait for the probe holding the half open slot, the
+                    # breaker would reject the next one.
+                    await asyncio.wait([probes[url]])
+            if needs_serial:
+                await self.get_serial_number()
+            return await self._detect_model_from_probes(probes)
+        finally:
+            for task in probes.values():
+                task.cancel()
+
+    async def _detect_model_from_probes(self, probes):
+        """Pick the Envoy model from the concurrently running endpoint probes."""
+        response = await probes[ENDPOINT_URL_PRODUCTION_JSON]
+
+        # If the production.json status code is set with 401 then we will
+        # give an error
+        if response is not None and response.status_code == 401:
             raise RuntimeError(
                 "Could not connect to Envoy model. "
                 + "Appears your Envoy is running firmware that requires secure communcation. "
                 + "Please enter in the needed Enlighten credentials during setup."
             )
 
-        if (
-            self.endpoint_production_json_results
-            and self.endpoint_production_json_results.status_code == 200
-            and has_production_and_consumption(
-                self.endpoint_production_json_results.json()
-            )
-        ):
-            self.isMeteringEnabled = has_metering_setup(
-                self.endpoint_production_json_results.json()
-            )
-            if not self.isMeteringEnabled:
-                await self._update_from_p_endpoint()
-            self.endpoint_type = ENVOY_MODEL_S
-            return
-
-        try:
-            await self._update_from_p_endpoint()
-        except httpx.HTTPError:
-            pass
-        if (
-            self.endpoint_production_v1_results
-            and self.endpoint_production_v1_results.status_code == 200
-        ):
+        if response is not None and response.status_code == 200:
+            production_json = self._decode_json(response)
+            if has_production_and_consumption(production_json):
+                self.isMeteringEnabled = has_metering_setup(production_json)
+                payloads = {"production_json": production_json}
+                if not self.isMeteringEnabled:
+                    response = await probes[ENDPOINT_URL_PRODUCTION_V1]
+                    if response is None:
+                        response = await self._update_from_p_endpoint()
+                    payloads["production_v1_json"] = self._decode_json(response)
+                self.endpoint_type = ENVOY_MODEL_S
+                return payloads
+
+        response = await probes[ENDPOINT_URL_PRODUCTION_V1]
+        if response is not None and response.status_code == 200:
             self.endpoint_type = ENVOY_MODEL_C  # Envoy-C, production only
-            return
+            return {"production_v1_json": self._decode_json(response)}
 
-        try:
-            await self._update_from_p0_endpoint()
-        except httpx.HTTPError:
-            pass
-        if (
-            self.endpoint_production_results
-            and self.endpoint_production_results.status_code == 200
-        ):
+        response = await probes[ENDPOINT_URL_PRODUCTION]
+        if response is not None and response.status_code == 200:
             self.endpoint_type = ENVOY_MODEL_LEGACY  # older Envoy-C
-            return
+            return {"production_html": response.text}
 
         raise RuntimeError(
             "Could not connect or determine Envoy model. "
@@ -379,15 +981,48 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
             + "'."
         )
 
+    def detection_record(self):
+        """Return the result of detect_model() as a JSON serializable dict.
+
+        Passing the record back in as ``detection_record`` when creating a
+        reader for the same Envoy skips detection entirely.
+        """
+        if not self.endpoint_type:
+            return None
+        return {
+            "host": self.host,
+            "endpoint_type": self.endpoint_type,
+            "is_metering_enabled": self.isMeteringEnabled,
+            "https": self.https_flag == "s",
+            "serial_number": self.serial_number,
+        }
+
+    def _apply_detection_record(self, record):
+        """Restore the detected model from a detection record."""
+        self.endpoint_type = record["endpoint_type"]
+        self.isMeteringEnabled = record.get("is_metering_enabled", False)
+        if record.get("https"):
+            self.https_flag = "s"
+        self.serial_number = record.get("serial_number")
+        if self.serial_number and self.password == "":
+            self._set_serial_number(self.serial_number)
+
     async def get_serial_number(self):
         """Method to get last six digits of Envoy serial number for auth"""
         full_serial = await self.get_full_serial_number()
         if full_serial:
-            gen_passwd = EnvoyUtils.get_password(full_serial, self.username)
-            if self.username == "envoy" or self.username != "installer":
-                self.password = self.serial_number_last_six = full_serial[-6:]
-            else:
-                self.password = gen_passwd
+            self._set_serial_number(full_serial)
+
+    def _set_serial_number(self, full_serial):
+        """Store the serial number and derive the password from it if needed."""
+        self.serial_number = full_serial
+        if self.username == "envoy" or self.username != "installer":
+            self.password = self.serial_number_last_six = full_serial[-6:]
+        else:
+            # Only installer passwords need envoy_utils, import it on first use.
+            from envoy_utils.envoy_utils import EnvoyUtils
+
+            self.password = EnvoyUtils.get_password(full_serial, self.username)
 
     async def get_full_serial_number(self):
         """Method to get the  Envoy serial number."""
@@ -422,31 +1057,23 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
             + "support the requested metric."
         )
 
+    def _snapshot_metric(self, name):
+        """Return a metric from the last snapshot."""
+        if self.hooks:
+            start = time.monotonic()
+            value = getattr(self.snapshot, name, None)
+            self._emit(EVENT_ACCESSOR, name=name, elapsed=time.monotonic() - start)
+        else:
+            value = getattr(self.snapshot, name, None)
+        if value is None:
+            raise RuntimeError(self.create_json_errormessage())
+        return value
+
     async def production(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
         """so that this method will only read data from stored variables"""
 
-        if self.endpoint_type == ENVOY_MODEL_S:
-            raw_json = self.endpoint_production_json_results.json()
-            idx = 1 if self.isMeteringEnabled else 0
-            production = raw_json["production"][idx]["wNow"]
-        elif self.endpoint_type == ENVOY_MODEL_C:
-            raw_json = self.endpoint_production_v1_results.json()
-            production = raw_json["wattsNow"]
-        elif self.endpoint_type == ENVOY_MODEL_LEGACY:
-            text = self.endpoint_production_results.text
-            match = re.search(PRODUCTION_REGEX, text, re.MULTILINE)
-            if match:
-                if match.group(2) == "kW":
-                    production = float(match.group(1)) * 1000
-                else:
-                    if match.group(2) == "mW":
-                        production = float(match.group(1)) * 1000000
-                    else:
-                        production = float(match.group(1))
-            else:
-                raise RuntimeError("No match for production, check REGEX  " + text)
-        return int(production)
+        return self._snapshot_metric("production")
 
     async def consumption(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
@@ -459,38 +1086,13 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         ):
             return self.message_consumption_not_available
 
-        raw_json = self.endpoint_production_json_results.json()
-        consumption = raw_json["consumption"][0]["wNow"]
-        return int(consumption)
+        return self._snapshot_metric("consumption")
 
     async def daily_production(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
         """so that this method will only read data from stored variables"""
 
-        if self.endpoint_type == ENVOY_MODEL_S and self.isMeteringEnabled:
-            raw_json = self.endpoint_production_json_results.json()
-            daily_production = raw_json["production"][1]["whToday"]
-        elif self.endpoint_type == ENVOY_MODEL_C or (
-            self.endpoint_type == ENVOY_MODEL_S and not self.isMeteringEnabled
-        ):
-            raw_json = self.endpoint_production_v1_results.json()
-            daily_production = raw_json["wattHoursToday"]
-        elif self.endpoint_type == ENVOY_MODEL_LEGACY:
-            text = self.endpoint_production_results.text
-            match = re.search(DAY_PRODUCTION_REGEX, text, re.MULTILINE)
-            if match:
-                if match.group(2) == "kWh":
-                    daily_production = float(match.group(1)) * 1000
-                else:
-                    if match.group(2) == "MWh":
-                        daily_production = float(match.group(1)) * 1000000
-                    else:
-                        daily_production = float(match.group(1))
-            else:
-                raise RuntimeError(
-                    "No match for Day production, " "check REGEX  " + text
-                )
-        return int(daily_production)
+        return self._snapshot_metric("daily_production")
 
     async def daily_consumption(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
@@ -503,38 +1105,13 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         ):
             return self.message_consumption_not_available
 
-        raw_json = self.endpoint_production_json_results.json()
-        daily_consumption = raw_json["consumption"][0]["whToday"]
-        return int(daily_consumption)
+        return self._snapshot_metric("daily_consumption")
 
     async def seven_days_production(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
         """so that this method will only read data from stored variables"""
 
-        if self.endpoint_type == ENVOY_MODEL_S and self.isMeteringEnabled:
-            raw_json = self.endpoint_production_json_results.json()
-            seven_days_production = raw_json["production"][1]["whLastSevenDays"]
-        elif self.endpoint_type == ENVOY_MODEL_C or (
-            self.endpoint_type == ENVOY_MODEL_S and not self.isMeteringEnabled
-        ):
-            raw_json = self.endpoint_production_v1_results.json()
-            seven_days_production = raw_json["wattHoursSevenDays"]
-        elif self.endpoint_type == ENVOY_MODEL_LEGACY:
-            text = self.endpoint_production_results.text
-            match = re.search(WEEK_PRODUCTION_REGEX, text, re.MULTILINE)
-            if match:
-                if match.group(2) == "kWh":
-                    seven_days_production = float(match.group(1)) * 1000
-                else:
-                    if match.group(2) == "MWh":
-                        seven_days_production = float(match.group(1)) * 1000000
-                    else:
-                        seven_days_production = float(match.group(1))
-            else:
-                raise RuntimeError(
-                    "No match for 7 Day production, " "check REGEX " + text
-                )
-        return int(seven_days_production)
+        return self._snapshot_metric("seven_days_production")
 
     async def seven_days_consumption(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
@@ -547,38 +1124,13 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         ):
             return self.message_consumption_not_available
 
-        raw_json = self.endpoint_production_json_results.json()
-        seven_days_consumption = raw_json["consumption"][0]["whLastSevenDays"]
-        return int(seven_days_consumption)
+        return self._snapshot_metric("seven_days_consumption")
 
     async def lifetime_production(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
         """so that this method will only read data from stored variables"""
 
-        if self.endpoint_type == ENVOY_MODEL_S and self.isMeteringEnabled:
-            raw_json = self.endpoint_production_json_results.json()
-            lifetime_production = raw_json["production"][1]["whLifetime"]
-        elif self.endpoint_type == ENVOY_MODEL_C or (
-            self.endpoint_type == ENVOY_MODEL_S and not self.isMeteringEnabled
-        ):
-            raw_json = self.endpoint_production_v1_results.json()
-            lifetime_production = raw_json["wattHoursLifetime"]
-        elif self.endpoint_type == ENVOY_MODEL_LEGACY:
-            text = self.endpoint_production_results.text
-            match = re.search(LIFE_PRODUCTION_REGEX, text, re.MULTILINE)
-            if match:
-                if match.group(2) == "kWh":
-                    lifetime_production = float(match.group(1)) * 1000
-                else:
-                    if match.group(2) == "MWh":
-                        lifetime_production = float(match.group(1)) * 1000000
-                    else:
-                        lifetime_production = float(match.group(1))
-            else:
-                raise RuntimeError(
-                    "No match for Lifetime production, " "check REGEX " + text
-                )
-        return int(lifetime_production)
+        return self._snapshot_metric("lifetime_production")
 
     async def lifetime_consumption(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
@@ -591,9 +1143,7 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         ):
             return self.message_consumption_not_available
 
-        raw_json = self.endpoint_production_json_results.json()
-        lifetime_consumption = raw_json["consumption"][0]["whLifetime"]
-        return int(lifetime_consumption)
+        return self._snapshot_metric("lifetime_consumption")
 
     async def inverters_production(self):
         """Running getData() beforehand will set self.enpoint_type and self.isDataRetrieved"""
@@ -603,19 +1153,33 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         if self.endpoint_type == ENVOY_MODEL_LEGACY:
             return None
 
-        response_dict = {}
-        try:
-            for item in self.endpoint_production_inverters.json():
-                response_dict[item["serialNumber"]] = [
-                    item["lastReportWatts"],
-                    time.strftime(
-                        "%Y-%m-%d %H:%M:%S", time.localtime(item["lastReportDate"])
-                    ),
-                ]
-        except (JSONDecodeError, KeyError, IndexError, TypeError, AttributeError):
+        if self.snapshot is None or self.snapshot.inverters is None:
             return None
 
-        return response_dict
+        if not self.hooks:
+            return self.snapshot.inverters.as_dict()
+        start = time.monotonic()
+        result = self.snapshot.inverters.as_dict()
+        self._emit(
+            EVENT_ACCESSOR,
+            name="inverters_production",
+            elapsed=time.monotonic() - start,
+        )
+        return result
+
+    async def inverters_table(self):
+        """Return the inverter readings of the last poll as an InverterTable."""
+        """Cheaper than inverters_production() on sites with many inverters."""
+        if self.endpoint_type == ENVOY_MODEL_LEGACY or self.snapshot is None:
+            return None
+        return self.snapshot.inverters
+
+    async def inverters_changes(self):
+        """Return the InverterChanges between the last two inverter polls."""
+        """None if the last poll did not fetch inverter data."""
+        if self.endpoint_type == ENVOY_MODEL_LEGACY:
+            return None
+        return self._inverter_changes
 
     async def battery_storage(self):
         """Return battery data from Envoys that support and have batteries installed"""
@@ -625,26 +1189,19 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         ):
             return self.message_battery_not_available
 
-        try:
-            raw_json = self.endpoint_production_json_results.json()
-        except JSONDecodeError:
-            return None
-
         """For Envoys that support batteries but do not have them installed the"""
         """percentFull will not be available in the JSON results. The API will"""
         """only return battery data if batteries are installed."""
-        if "percentFull" not in raw_json["storage"][0].keys():
+        if self.snapshot is None or self.snapshot.battery_storage is None:
             return self.message_battery_not_available
 
-        return raw_json["storage"][0]
+        return self.snapshot.battery_storage
 
     def run_in_console(self):
         """If running this module directly, print all the values in the console."""
         print("Reading...")
         loop = asyncio.get_event_loop()
-        data_results = loop.run_until_complete(
-            asyncio.gather(self.getData(), return_exceptions=False)
-        )
+        loop.run_until_complete(self.getData())
 
         loop = asyncio.get_event_loop()
         results = loop.run_until_complete(
@@ -662,6 +1219,7 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
                 return_exceptions=False,
             )
         )
+        loop.run_until_complete(self.aclose())
 
         print(f"production:              {results[0]}")
         print(f"consumption:             {results[1]}")
@@ -671,7 +1229,7 @@ class EnvoyReader:  # pylint: disable=too-many-instance-attributes
         print(f"seven_days_consumption:  {results[5]}")
         print(f"lifetime_production:     {results[6]}")
         print(f"lifetime_consumption:    {results[7]}")
-        if "401" in str(data_results):
+        if isinstance(self.endpoint_errors.get("inverters"), httpx.HTTPStatusError):
             print(
                 "inverters_production:    Unable to retrieve inverter data - Authentication failure"
             )
@@ -755,6 +1313,7 @@ if __name__ == "__main__":
             enlighten_site_id=args.enlighten_site_id,
             enlighten_serial_num=args.enlighten_serial_num,
             https_flag=SECURE,
+            concurrent_requests=True,
         )
     else:
         TESTREADER = EnvoyReader(
@@ -768,6 +1327,7 @@ if __name__ == "__main__":
             enlighten_site_id=args.enlighten_site_id,
             enlighten_serial_num=args.enlighten_serial_num,
             https_flag=SECURE,
+            concurrent_requests=True,
         )
 
     TESTREADER.run_in_console()
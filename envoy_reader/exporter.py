@@ -0,0 +1,351 @@
+"""Serve the readings of Envoys as OpenMetrics, polled in the background.
+
+Run with ``python -m envoy_reader.exporter HOST [HOST ...]``. The Envoys
+are polled every ``--interval`` seconds regardless of scrapes; after each
+poll the metrics text is rendered once and every scrape of ``/metrics``
+is answered from memory, so scrapes never reach the Envoys.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import time
+
+from .enlighten import EnlightenSession
+from .fleet import EnvoyFleet, parse_host_spec
+from .instrumentation import EVENT_REQUEST, PerfStats
+from .schedule import TickSchedule
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+DEFAULT_PORT = 9433
+DEFAULT_INTERVAL = 60
+
+# Snapshot attribute, metric name, help text.
+SNAPSHOT_METRICS = (
+    ("production", "envoy_production_watts", "Current production."),
+    ("consumption", "envoy_consumption_watts", "Current consumption."),
+    (
+        "daily_production",
+        "envoy_daily_production_watt_hours",
+        "Energy produced today.",
+    ),
+    (
+        "daily_consumption",
+        "envoy_daily_consumption_watt_hours",
+        "Energy consumed today.",
+    ),
+    (
+        "seven_days_production",
+        "envoy_seven_days_production_watt_hours",
+        "Energy produced in the last seven days.",
+    ),
+    (
+        "seven_days_consumption",
+        "envoy_seven_days_consumption_watt_hours",
+        "Energy consumed in the last seven days.",
+    ),
+    (
+        "lifetime_production",
+        "envoy_lifetime_production_watt_hours",
+        "Energy produced since installation.",
+    ),
+    (
+        "lifetime_consumption",
+        "envoy_lifetime_consumption_watt_hours",
+        "Energy consumed since installation.",
+    ),
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _escape(value):
+    """Escape a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return (
+        "{" + ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items()) + "}"
+    )
+
+
+class _Family:
+    """Lines of one metric family."""
+
+    def __init__(self, lines, name, metric_type, help_text):
+        self.lines = lines
+        self.name = name
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"# HELP {name} {help_text}")
+
+    def sample(self, value, suffix="", **labels):
+        """Add a sample, skipping missing values."""
+        if value is None:
+            return
+        self.lines.append(f"{self.name}{suffix}{_labels(**labels)} {value}")
+
+
+class EnvoyExporter:
+    """Poll a fleet on a fixed schedule and keep its OpenMetrics text ready.
+
+    ``stats`` is the PerfStats hook of the fleet's readers, with the default
+    grouping, used for the request duration histograms. ``body`` holds the rendered text of the
+    last poll.
+    """
+
+    def __init__(self, fleet, interval=DEFAULT_INTERVAL, stats=None):
+        """Init the EnvoyExporter."""
+        self.fleet = fleet
+        self.interval = interval
+        self.stats = stats
+        self.polls = collections.Counter()
+        self.last_success = {}
+        self.rounds = 0
+        self.scrapes = 0
+        self.skipped_ticks = 0
+        self.body = b"# EOF\n"
+
+    async def poll(self):
+        """Poll the fleet once and render the metrics text."""
+        fleet_round = await self.fleet.poll()
+        now = time.time()
+        for host, result in fleet_round.results.items():
+            if isinstance(result, Exception):
+                self.polls[host, "error"] += 1
+            else:
+                self.polls[host, "success"] += 1
+                self.last_success[host] = now
+        self.rounds += 1
+        self.body = self.render().encode()
+        return fleet_round
+
+    async def run(self):
+        """Poll every ``interval`` seconds, skipping ticks a poll overran."""
+        ticks = TickSchedule(self.interval)
+        while True:
+            try:
+                await self.poll()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Polling the fleet failed")
+            self.skipped_ticks += await ticks.wait()
+
+    def render(self):
+        """Return the OpenMetrics text of the last poll."""
+        lines = []
+        fleet_round = self.fleet.last_round
+        results = fleet_round.results if fleet_round else {}
+        latencies = fleet_round.latencies if fleet_round else {}
+        readers = self.fleet.readers
+
+        family = _Family(lines, "envoy_up", "gauge", "Whether the last poll succeeded.")
+        for host in readers:
+            if host in results:
+                family.sample(int(not isinstance(results[host], Exception)), host=host)
+
+        for attribute, name, help_text in SNAPSHOT_METRICS:
+            family = _Family(lines, name, "gauge", help_text)
+            for host, reader in readers.items():
+                family.sample(getattr(reader.snapshot, attribute, None), host=host)
+
+        family = _Family(
+            lines, "envoy_battery_percent_full", "gauge", "Battery charge in %."
+        )
+        for host, reader in readers.items():
+            storage = getattr(reader.snapshot, "battery_storage", None)
+            if storage:
+                family.sample(storage.get("percentFull"), host=host)
+
+        # Each family's samples must follow its own header, so the inverters
+        # are walked once per family.
+        family = _Family(
+            lines, "envoy_inverter_watts", "gauge", "Last reported inverter output."
+        )
+        for host, reader in readers.items():
+            inverters = getattr(reader.snapshot, "inverters", None)
+            for serial, inverter_watts, _ in inverters or ():
+                family.sample(inverter_watts, host=host, serial=serial)
+
+        family = _Family(
+            lines,
+            "envoy_inverter_last_report_timestamp_seconds",
+            "gauge",
+            "Time of the last inverter report.",
+        )
+        for host, reader in readers.items():
+            inverters = getattr(reader.snapshot, "inverters", None)
+            for serial, _, last_report in inverters or ():
+                family.sample(last_report, host=host, serial=serial)
+
+        family = _Family(
+            lines, "envoy_poll_duration_seconds", "gauge", "Duration of the last poll."
+        )
+        for host, latency in latencies.items():
+            family.sample(latency, host=host)
+
+        family = _Family(
+            lines,
+            "envoy_last_success_timestamp_seconds",
+            "gauge",
+            "Time of the last successful poll.",
+        )
+        for host, timestamp in self.last_success.items():
+            family.sample(timestamp, host=host)
+
+        family = _Family(lines, "envoy_polls", "counter", "Polls by outcome.")
+        for (host, outcome), count in sorted(self.polls.items()):
+            family.sample(count, "_total", host=host, outcome=outcome)
+
+        family = _Family(
+            lines, "envoy_circuit_open", "gauge", "Whether the circuit breaker is open."
+        )
+        for host, state in self.fleet.circuit_states().items():
+            family.sample(int(state != "closed"), host=host)
+
+        if self.stats is not None:
+            self._render_request_histograms(lines)
+
+        family = _Family(
+            lines, "envoy_exporter_rounds", "counter", "Polling rounds completed."
+        )
+        family.sample(self.rounds, "_total")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _render_request_histograms(self, lines):
+        """Add the request duration histogram of each endpoint."""
+        family = _Family(
+            lines,
+            "envoy_request_duration_seconds",
+            "histogram",
+            "Duration of HTTP requests to the Envoys.",
+        )
+        for key, histogram in sorted(self.stats.timings.items(), key=str):
+            if key[0] != EVENT_REQUEST:
+                continue
+            endpoint = key[1]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                family.sample(cumulative, "_bucket", endpoint=endpoint, le=float(bound))
+            family.sample(histogram.count, "_bucket", endpoint=endpoint, le="+Inf")
+            family.sample(histogram.count, "_count", endpoint=endpoint)
+            family.sample(histogram.sum, "_sum", endpoint=endpoint)
+
+    async def handle(self, reader, writer):
+        """Answer HTTP/1.1 requests on a connection with the cached text."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                parts = request_line.split()
+                path = parts[1].split(b"?")[0] if len(parts) > 1 else b""
+                if parts and parts[0] == b"GET" and path == b"/metrics":
+                    self.scrapes += 1
+                    status, content_type, body = b"200 OK", CONTENT_TYPE, self.body
+                else:
+                    status, content_type, body = b"404 Not Found", "text/plain", b""
+                writer.write(
+                    b"HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n"
+                    % (status, content_type.encode(), len(body))
+                    + body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="0.0.0.0", port=DEFAULT_PORT):
+        """Start serving /metrics and return the asyncio server."""
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def _main(args):
+    stats = PerfStats()
+    reader_kwargs = {
+        "username": args.username,
+        "password": args.password,
+        "inverters": args.inverters,
+        "concurrent_requests": True,
+        "hooks": [stats],
+    }
+    session = None
+    if args.enlighten_user:
+        session = EnlightenSession(args.enlighten_user, args.enlighten_pass)
+        reader_kwargs.update(
+            enlighten_session=session,
+            commissioned=str(args.commissioned),
+            enlighten_site_id=args.site_id,
+            https_flag="s",
+        )
+    fleet = EnvoyFleet(
+        [parse_host_spec(spec) for spec in args.hosts],
+        max_concurrency=args.max_concurrency,
+        **reader_kwargs,
+    )
+    exporter = EnvoyExporter(fleet, args.interval, stats)
+    server = await exporter.serve(args.listen, args.port)
+    _LOGGER.info("Serving metrics on %s:%s", args.listen, args.port)
+    try:
+        async with server:
+            await exporter.run()
+    finally:
+        await fleet.aclose()
+        if session is not None:
+            await session.aclose()
+
+
+def main(argv=None):
+    """Parse the command line and run the exporter."""
+    parser = argparse.ArgumentParser(
+        description="Serve Enphase Envoy readings as OpenMetrics."
+    )
+    parser.add_argument(
+        "hosts",
+        nargs="+",
+        help="Envoy host names, as HOST, HOST=SERIAL or HOST=SERIAL:SITE",
+    )
+    parser.add_argument("--listen", default="0.0.0.0", help="Address to serve on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help="Seconds between polls",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=50)
+    parser.add_argument("--username", default="envoy")
+    parser.add_argument("--password", default="")
+    parser.add_argument(
+        "--no-inverters",
+        dest="inverters",
+        action="store_false",
+        help="Do not poll inverter data",
+    )
+    parser.add_argument("--enlighten-user", help="Enlighten Username")
+    parser.add_argument("--enlighten-pass", help="Enlighten Password")
+    parser.add_argument(
+        "--uncommissioned",
+        dest="commissioned",
+        action="store_false",
+        help="Fetch uncommissioned tokens",
+    )
+    parser.add_argument(
+        "--site-id", help="Enlighten Site ID of hosts given without a SITE"
+    )
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Poll many Enphase Envoys concurrently from a single event loop."""
+import asyncio
+import logging
+import math
+import time
+
+import httpx
+
+from .envoy_reader import EnvoyReader
+from .retry import CircuitOpenError
+
+DEFAULT_MAX_CONCURRENCY = 50
+DEFAULT_HOST_TIMEOUT = 60
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _percentile(values, pct):
+    """Return the linearly interpolated percentile of a list of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def parse_host_spec(spec):
+    """Return the reader arguments of a ``HOST[=SERIAL[:SITE]]`` argument.
+
+    SERIAL and SITE are the Enlighten serial number and site ID used to
+    fetch the host's token.
+    """
+    host, _, serial = spec.partition("=")
+    serial, _, site_id = serial.partition(":")
+    config = {"host": host}
+    if serial:
+        config["enlighten_serial_num"] = serial
+    if site_id:
+        config["enlighten_site_id"] = site_id
+    return config
+
+
+class FleetRound:
+    """Results of one polling round across the fleet.
+
+    ``results`` maps each host to the EnvoySnapshot of a successful poll, or
+    to the exception that poll raised. ``latencies`` maps each host to the time
+    its poll took in seconds, excluding time spent waiting for a slot.
+    """
+
+    def __init__(self, results, latencies, elapsed):
+        """Init the FleetRound."""
+        self.results = results
+        self.latencies = latencies
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        """Return the results of the hosts that were polled successfully."""
+        return {
+            host: result
+            for host, result in self.results.items()
+            if not isinstance(result, Exception)
+        }
+
+    @property
+    def errors(self):
+        """Return the exceptions of the hosts that failed to poll."""
+        return {
+            host: result
+            for host, result in self.results.items()
+            if isinstance(result, Exception)
+        }
+
+    @property
+    def hosts_per_second(self):
+        """Return the number of hosts polled per second of wall-clock time."""
+        if not self.elapsed:
+            return 0.0
+        return len(self.results) / self.elapsed
+
+    @property
+    def latency_p50(self):
+        """Return the median poll latency in seconds."""
+        return _percentile(list(self.latencies.values()), 50)
+
+    @property
+    def latency_p95(self):
+        """Return the 95th percentile poll latency in seconds."""
+        return _percentile(list(self.latencies.values()), 95)
+
+
+class EnvoyFleet:
+    """Run getData() across many Envoys with bounded concurrency.
+
+    ``hosts`` is an iterable of host names, dicts of EnvoyReader keyword
+    arguments (which must include ``host`` and may include a per-host
+    ``timeout``), or existing EnvoyReader instances. All readers created by
+    the fleet share one connection pool.
+    """
+
+    def __init__(
+        self,
+        hosts,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timeout=DEFAULT_HOST_TIMEOUT,
+        async_client=None,
+        **reader_kwargs,
+    ):
+        """Init the EnvoyFleet."""
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._async_client = async_client
+        self._owns_async_client = async_client is None
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                verify=False,
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                ),
+            )
+        self.readers = {}
+        self._timeouts = {}
+        for config in hosts:
+            self.add_host(config, **reader_kwargs)
+        self.last_round = None
+
+    def add_host(self, config, **reader_kwargs):
+        """Add a host to the fleet and return its reader."""
+        timeout = self.timeout
+        if isinstance(config, EnvoyReader):
+            reader = config
+        else:
+            if isinstance(config, str):
+                config = {"host": config}
+            kwargs = {**reader_kwargs, **config}
+            timeout = kwargs.pop("timeout", timeout)
+            kwargs.setdefault("async_client", self._async_client)
+            reader = EnvoyReader(**kwargs)
+        self.readers[reader.host] = reader
+        self._timeouts[reader.host] = timeout
+        return reader
+
+    async def remove_host(self, host):
+        """Remove a host from the fleet and close its reader."""
+        reader = self.readers.pop(host)
+        del self._timeouts[host]
+        await reader.aclose()
+
+    async def __aenter__(self):
+        """Enter the fleet's context."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Close the shared connection pool when leaving the context."""
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the shared httpx client if it was created by the fleet."""
+        for reader in self.readers.values():
+            await reader.aclose()
+        if self._owns_async_client:
+            await self._async_client.aclose()
+
+    def circuit_states(self):
+        """Return the circuit breaker state of every host."""
+        return {
+            host: reader.circuit_breaker.state for host, reader in self.readers.items()
+        }
+
+    async def _poll_host(self, semaphore, host, reader, results, latencies):
+        """Poll a single host, recording its result or error."""
+        # Hosts whose breaker is open fail without waiting for a slot.
+        if reader.circuit_breaker.is_open:
+            results[host] = CircuitOpenError(f"Circuit open for {host}")
+            return
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                results[host] = await asyncio.wait_for(
+                    reader.getData(), self._timeouts[host]
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.debug("Polling %s failed: %r", host, err)
+                results[host] = err
+            latencies[host] = time.monotonic() - start
+
+    async def poll(self):
+        """Poll every host once and return a FleetRound."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = {}
+        latencies = {}
+        start = time.monotonic()
+        await asyncio.gather(
+            *(
+                self._poll_host(semaphore, host, reader, results, latencies)
+                for host, reader in self.readers.items()
+            )
+        )
+        self.last_round = FleetRound(
+            {host: results[host] for host in self.readers},
+            latencies,
+            time.monotonic() - start,
+        )
+        return self.last_round
@@ -0,0 +1,164 @@
+"""Bounded, array-backed history of the values polled from an Envoy."""
+import collections
+import time
+from array import array
+
+# Power values (W) fit in 32 bits, energy counters (Wh) need 64.
+DEFAULT_COLUMNS = (
+    ("production", "i"),
+    ("consumption", "i"),
+    ("daily_production", "q"),
+    ("daily_consumption", "q"),
+)
+
+# Values the Envoy did not report are stored as the smallest integer of the
+# column type and skipped by the rolling statistics.
+MISSING = {"i": -(2**31), "q": -(2**63)}
+
+
+class _RollingWindow:
+    """Running sum and monotonic min/max queues over the last ``size`` samples."""
+
+    __slots__ = ("size", "total", "count", "_min", "_max")
+
+    def __init__(self, size):
+        self.size = size
+        self.total = 0
+        self.count = 0
+        self._min = collections.deque()
+        self._max = collections.deque()
+
+    def push(self, index, value):
+        """Add the sample at absolute ``index``."""
+        self.total += value
+        self.count += 1
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((index, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((index, value))
+
+    def evict(self, index, value):
+        """Remove the sample at absolute ``index`` as it leaves the window."""
+        self.total -= value
+        self.count -= 1
+        if self._min and self._min[0][0] == index:
+            self._min.popleft()
+        if self._max and self._max[0][0] == index:
+            self._max.popleft()
+
+    @property
+    def minimum(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def maximum(self):
+        return self._max[0][1] if self._max else None
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class SnapshotHistory:
+    """Ring buffer of the last ``capacity`` snapshots, one array per column.
+
+    Each sample costs a monotonic timestamp (8 bytes) plus 4 bytes per power
+    column and 8 bytes per energy column. Appending is O(1), and so are the
+    rolling mean, min and max over each of the ``windows`` (sizes in samples,
+    at most ``capacity``).
+    """
+
+    def __init__(self, capacity, columns=DEFAULT_COLUMNS, windows=()):
+        """Init the SnapshotHistory."""
+        self.capacity = capacity
+        self._count = 0
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._columns = {}
+        self._missing = {}
+        for name, typecode in columns:
+            column = array(typecode)
+            column.frombytes(bytes(column.itemsize * capacity))
+            self._columns[name] = column
+            self._missing[name] = MISSING[typecode]
+        self._windows = {}
+        self._window_sizes = tuple(sorted(set(windows)))
+        for size in self._window_sizes:
+            if not 0 < size <= capacity:
+                raise ValueError(f"Window of {size} samples does not fit the history")
+            for name in self._columns:
+                self._windows[name, size] = _RollingWindow(size)
+
+    def __len__(self):
+        """Return the number of samples held."""
+        return min(self._count, self.capacity)
+
+    @property
+    def columns(self):
+        """Return the names of the value columns."""
+        return tuple(self._columns)
+
+    def append(self, snapshot, timestamp=None):
+        """Add the values of a snapshot, overwriting the oldest when full."""
+        index = self._count
+        pos = index % self.capacity
+        self._timestamps[pos] = time.monotonic() if timestamp is None else timestamp
+        for name, column in self._columns.items():
+            value = getattr(snapshot, name, None)
+            value = self._missing[name] if value is None else int(value)
+            for size in self._window_sizes:
+                window = self._windows[name, size]
+                if index >= size:
+                    old_index = index - size
+                    old_value = column[old_index % self.capacity]
+                    if old_value != self._missing[name]:
+                        window.evict(old_index, old_value)
+                if value != self._missing[name]:
+                    window.push(index, value)
+            column[pos] = value
+        self._count += 1
+
+    def _window(self, column, window):
+        try:
+            return self._windows[column, window]
+        except KeyError:
+            raise ValueError(
+                f"No rolling window of {window} samples for {column}"
+            ) from None
+
+    def mean(self, column, window):
+        """Return the mean of a column over the last ``window`` samples."""
+        return self._window(column, window).mean
+
+    def min(self, column, window):
+        """Return the minimum of a column over the last ``window`` samples."""
+        return self._window(column, window).minimum
+
+    def max(self, column, window):
+        """Return the maximum of a column over the last ``window`` samples."""
+        return self._window(column, window).maximum
+
+    def export(self, column="timestamp"):
+        """Return the samples of a column, oldest first, without copying.
+
+        The result is a list of one or two memoryviews over the underlying
+        array, since the ring buffer may wrap around. Missing values hold
+        ``MISSING`` for the column type.
+        """
+        data = self._timestamps if column == "timestamp" else self._columns[column]
+        view = memoryview(data)
+        if self._count <= self.capacity:
+            return [view[: self._count]]
+        pos = self._count % self.capacity
+        if pos == 0:
+            return [view]
+        return [view[pos:], view[:pos]]
+
+    def to_array(self, column="timestamp"):
+        """Return a contiguous copy of a column, oldest first."""
+        data = self._timestamps if column == "timestamp" else self._columns[column]
+        result = array(data.typecode)
+        for segment in self.export(column):
+            result.frombytes(segment.cast("B"))
+        return result
@@ -0,0 +1,195 @@
+"""Timing events reported by readers and built-in aggregation of them.
+
+A hook is any callable taking ``(event, fields)``, registered through the
+``hooks`` argument of EnvoyReader or its ``hooks`` list. Readers only build
+events when at least one hook is registered. The events are:
+
+* ``request``: every HTTP request to the Envoy, with ``endpoint``,
+  ``status`` (None on a transport error), ``bytes``, ``attempt`` (from 1),
+  ``elapsed`` and ``connect`` (seconds spent opening the connection, 0 when
+  a kept-alive connection was reused, None if unknown)
+* ``token_refresh``: every Enphase token refresh, with ``elapsed``
+* ``detection_probe``: every endpoint probed while detecting the model,
+  with ``endpoint``, ``status`` and ``elapsed``
+* ``parse``: decoding an endpoint body, with ``endpoint``, ``bytes`` and
+  ``elapsed``
+* ``accessor``: every metric accessor, with ``name`` and ``elapsed``
+
+Every event also has ``host``, ``model`` (the detected endpoint type, None
+while detecting) and ``error`` holding the repr of the
+exception when the step failed.
+"""
+import bisect
+import collections
+import math
+import time
+
+EVENT_REQUEST = "request"
+EVENT_TOKEN_REFRESH = "token_refresh"
+EVENT_DETECTION_PROBE = "detection_probe"
+EVENT_PARSE = "parse"
+EVENT_ACCESSOR = "accessor"
+
+# Upper bounds in seconds, from 100 us to 60 s.
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class ConnectTrace:
+    """httpcore trace callback measuring how long a request spent connecting."""
+
+    __slots__ = ("traced", "started", "connected")
+
+    def __init__(self):
+        """Init the ConnectTrace."""
+        self.traced = False
+        self.started = None
+        self.connected = None
+
+    async def __call__(self, event_name, info):
+        """Record the start and end of the TCP connect and TLS handshake."""
+        self.traced = True
+        if event_name == "connection.connect_tcp.started":
+            self.started = time.monotonic()
+        elif event_name in (
+            "connection.connect_tcp.complete",
+            "connection.start_tls.complete",
+        ):
+            self.connected = time.monotonic()
+
+    @property
+    def connect_time(self):
+        """Return the seconds spent connecting, or None if not traced.
+
+        Requests sent on a kept-alive connection took 0 seconds to connect.
+        """
+        if self.started is None:
+            return 0.0 if self.traced else None
+        if self.connected is None:
+            return None
+        return self.connected - self.started
+
+
+class Histogram:
+    """Count of observations per bucket, plus their sum, minimum and maximum."""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Init the Histogram."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        """Add an observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """Return the mean observation, or None without observations."""
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, quantile):
+        """Return the upper bound of the bucket holding a quantile, or None."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(quantile * self.count))
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                bound = self.buckets[idx] if idx < len(self.buckets) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        """Return the summary of the histogram as a dict."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.mean,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+class PerfStats:
+    """Hook aggregating events into counters and timing histograms.
+
+    Events are grouped by event type and the event fields named in
+    ``group_by``, by default the endpoint or accessor name; add ``host`` or
+    ``model`` to split them by Envoy or by model. ``counters`` counts events
+    by group and outcome (the HTTP status, ``error`` or ``ok``), ``timings``
+    holds a Histogram of the ``elapsed`` seconds per group and ``bytes`` the
+    body bytes per group.
+    """
+
+    def __init__(self, group_by=("endpoint", "name"), buckets=DEFAULT_BUCKETS):
+        """Init the PerfStats."""
+        self.group_by = tuple(group_by)
+        self.buckets = buckets
+        self.counters = collections.Counter()
+        self.timings = {}
+        self.bytes = collections.Counter()
+
+    def __call__(self, event, fields):
+        """Aggregate an event."""
+        key = (event, *(fields.get(name) for name in self.group_by))
+        if fields.get("error") is not None:
+            outcome = "error"
+        else:
+            outcome = fields.get("status", "ok")
+        self.counters[key + (outcome,)] += 1
+        histogram = self.timings.get(key)
+        if histogram is None:
+            histogram = self.timings[key] = Histogram(self.buckets)
+        histogram.observe(fields["elapsed"])
+        if fields.get("bytes"):
+            self.bytes[key] += fields["bytes"]
+
+    def summary(self):
+        """Return the timing summary of every group, most total time first."""
+        return sorted(
+            (
+                {"group": key, "bytes": self.bytes[key], **histogram.as_dict()}
+                for key, histogram in self.timings.items()
+            ),
+            key=lambda item: item["sum"],
+            reverse=True,
+        )
+
+    def reset(self):
+        """Forget everything aggregated so far."""
+        self.counters.clear()
+        self.timings.clear()
+        self.bytes.clear()
@@ -0,0 +1,152 @@
+"""Columnar storage for the readings of an Envoy's microinverters."""
+import time
+from array import array
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class InverterChanges:
+    """Difference between the inverter readings of two polls.
+
+    ``updated`` is an InverterTable of the inverters that sent a new report
+    (including ones that appeared), ``added`` and ``removed`` are the serial
+    numbers that appeared or disappeared.
+    """
+
+    __slots__ = ("updated", "added", "removed")
+
+    def __init__(self, updated, added=(), removed=()):
+        """Init the InverterChanges."""
+        self.updated = updated
+        self.added = tuple(added)
+        self.removed = tuple(removed)
+
+    def __bool__(self):
+        """Return True if any inverter changed."""
+        return bool(len(self.updated) or self.removed)
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(updated={len(self.updated)}, "
+            f"added={len(self.added)}, removed={len(self.removed)})"
+        )
+
+
+class InverterTable:
+    """Inverter readings stored as a serial index plus watts/timestamp arrays.
+
+    Iterating yields ``(serial, watts, last_report_epoch)`` tuples. Report
+    dates are kept as epoch seconds and only formatted on request.
+    """
+
+    __slots__ = ("serials", "watts", "last_report", "_index")
+
+    def __init__(self, serials, watts, last_report):
+        """Init the InverterTable."""
+        self.serials = tuple(serials)
+        self.watts = array("q", watts)
+        self.last_report = array("q", last_report)
+        self._index = None
+
+    @classmethod
+    def from_json(cls, items):
+        """Build the table from the decoded /api/v1/production/inverters body."""
+        serials = []
+        watts = []
+        last_report = []
+        for item in items:
+            serials.append(item["serialNumber"])
+            watts.append(int(item["lastReportWatts"]))
+            last_report.append(int(item["lastReportDate"]))
+        return cls(serials, watts, last_report)
+
+    def __len__(self):
+        """Return the number of inverters."""
+        return len(self.serials)
+
+    def __iter__(self):
+        """Yield ``(serial, watts, last_report_epoch)`` for each inverter."""
+        return zip(self.serials, self.watts, self.last_report)
+
+    def __eq__(self, other):
+        if not isinstance(other, InverterTable):
+            return NotImplemented
+        return (
+            self.serials == other.serials
+            and self.watts == other.watts
+            and self.last_report == other.last_report
+        )
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} inverters)"
+
+    @property
+    def index(self):
+        """Return a dict mapping each serial number to its row."""
+        if self._index is None:
+            self._index = {serial: row for row, serial in enumerate(self.serials)}
+        return self._index
+
+    def get(self, serial):
+        """Return ``(watts, last_report_epoch)`` for a serial, or None."""
+        row = self.index.get(serial)
+        if row is None:
+            return None
+        return self.watts[row], self.last_report[row]
+
+    def total(self):
+        """Return the summed watts of all inverters."""
+        return sum(self.watts)
+
+    def mean(self):
+        """Return the mean watts per inverter, or None without inverters."""
+        return sum(self.watts) / len(self.watts) if self.watts else None
+
+    def min(self):
+        """Return the lowest inverter watts, or None without inverters."""
+        return min(self.watts) if self.watts else None
+
+    def max(self):
+        """Return the highest inverter watts, or None without inverters."""
+        return max(self.watts) if self.watts else None
+
+    def count_stale(self, max_age, now=None):
+        """Return how many inverters have not reported for ``max_age`` seconds."""
+        cutoff = (time.time() if now is None else now) - max_age
+        return sum(1 for last_report in self.last_report if last_report < cutoff)
+
+    def changes_since(self, previous):
+        """Return the InverterChanges from a previous table to this one."""
+        if previous is None:
+            return InverterChanges(self, added=self.serials)
+        previous_index = previous.index
+        previous_reports = previous.last_report
+        rows = []
+        added = []
+        for row, serial in enumerate(self.serials):
+            previous_row = previous_index.get(serial)
+            if previous_row is None:
+                added.append(serial)
+                rows.append(row)
+            elif previous_reports[previous_row] != self.last_report[row]:
+                rows.append(row)
+        current = self.index
+        removed = [serial for serial in previous.serials if serial not in current]
+        updated = InverterTable(
+            [self.serials[row] for row in rows],
+            [self.watts[row] for row in rows],
+            [self.last_report[row] for row in rows],
+        )
+        return InverterChanges(updated, added, removed)
+
+    def formatted_last_report(self, serial):
+        """Return the local time of an inverter's last report as a string."""
+        row = self.index[serial]
+        return time.strftime(TIME_FORMAT, time.localtime(self.last_report[row]))
+
+    def as_dict(self):
+        """Return the ``serial -> [watts, formatted date]`` dict of inverters_production()."""
+        return {
+            serial: [watts, time.strftime(TIME_FORMAT, time.localtime(last_report))]
+            for serial, watts, last_report in self
+        }
@@ -0,0 +1,145 @@
+"""Back off between retries and stop polling Envoys that are down."""
+import logging
+import random
+import time
+
+import httpx
+
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 10
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The circuit breaker of a host is open, the request was not sent."""
+
+
+class RetryPolicy:
+    """How often and how long to wait before retrying a transport error.
+
+    The delay before retry ``n`` (counting from 0) is ``backoff * 2 ** n``
+    capped at ``max_backoff``, reduced by a random fraction of up to
+    ``jitter`` so readers that failed together do not retry together.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        attempts=DEFAULT_ATTEMPTS,
+        backoff=DEFAULT_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        multiplier=2,
+        jitter=0.5,
+    ):
+        """Init the RetryPolicy."""
+        if attempts < 1:
+            raise ValueError("A retry policy needs at least one attempt")
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, retry):
+        """Return the seconds to wait before retry number ``retry``."""
+        delay = min(self.max_backoff, self.backoff * self.multiplier**retry)
+        return delay - random.uniform(0, delay * self.jitter)
+
+
+class CircuitBreaker:
+    """Fail fast for a host after repeated transport errors.
+
+    After ``failure_threshold`` consecutive failed requests the breaker opens
+    and requests raise CircuitOpenError without being sent. Once
+    ``reset_timeout`` seconds have passed it is half open: a single request
+    is let through as a probe, closing the breaker if it succeeds and opening
+    it again if it fails. A ``failure_threshold`` of None never opens it.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+    ):
+        """Init the CircuitBreaker."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._probing = False
+
+    @property
+    def state(self):
+        """Return the state of the breaker: closed, open or half_open."""
+        if self.opened_at is None:
+            return STATE_CLOSED
+        if self._probing or time.monotonic() >= self.retry_at:
+            return STATE_HALF_OPEN
+        return STATE_OPEN
+
+    @property
+    def retry_at(self):
+        """Return the monotonic time the next probe is allowed, or None."""
+        if self.opened_at is None:
+            return None
+        return self.opened_at + self.reset_timeout
+
+    @property
+    def is_open(self):
+        """Return True if a request would be rejected right now."""
+        state = self.state
+        return state == STATE_OPEN or (state == STATE_HALF_OPEN and self._probing)
+
+    def as_dict(self):
+        """Return the state of the breaker as a JSON serializable dict."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "retry_in": (
+                max(0.0, self.retry_at - time.monotonic())
+                if self.opened_at is not None
+                else None
+            ),
+        }
+
+    def before_request(self, url=None):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        if self.opened_at is None:
+            return
+        if self.is_open:
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit open, not requesting {url}")
+        _LOGGER.debug("Circuit half open, probing with %s", url)
+        self._probing = True
+
+    def record_success(self):
+        """Close the breaker after a request got an answer."""
+        if self.opened_at is not None:
+            _LOGGER.debug("Circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        """Let another probe through after one ended without an answer."""
+        self._probing = False
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker at the threshold."""
+        self.failures += 1
+        if self._probing or (
+            self.failure_threshold is not None
+            and self.failures >= self.failure_threshold
+        ):
+            _LOGGER.debug("Circuit opened after %s failures", self.failures)
+            self.opened_at = time.monotonic()
+            self._probing = False
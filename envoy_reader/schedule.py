@@ -0,0 +1,29 @@
+"""Run polls at a fixed rate on the event loop's monotonic clock."""
+import asyncio
+
+
+class TickSchedule:
+    """Ticks every ``interval`` seconds from the moment it is created.
+
+    Ticks are counted from the first one rather than from the end of the
+    previous poll, so the cadence does not drift by the poll duration. A
+    poll that overruns its tick skips the missed ticks instead of queueing
+    them. Create it on the running event loop.
+    """
+
+    def __init__(self, interval):
+        """Init the TickSchedule, its first tick being now."""
+        self.interval = interval
+        self._loop = asyncio.get_running_loop()
+        self._next_tick = self._loop.time()
+
+    async def wait(self):
+        """Sleep until the next tick and return the number of ticks skipped."""
+        self._next_tick += self.interval
+        now = self._loop.time()
+        missed = 0
+        if now > self._next_tick:
+            missed = int((now - self._next_tick) // self.interval) + 1
+            self._next_tick += missed * self.interval
+        await asyncio.sleep(self._next_tick - now)
+        return missed
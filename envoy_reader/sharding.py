@@ -0,0 +1,646 @@
+"""Poll a fleet of Envoys from several processes.
+
+A ShardedFleet splits its hosts across worker processes, each running an
+EnvoyFleet on its own event loop with its own connection pool, so decoding
+and TLS use every core. Each round the parent tells every worker to poll and
+gets the results back as one message per worker, holding the readings in the
+binary record format of the spool. Hosts are spread by poll cost, the
+smoothed latency of the successful polls of each host, and moved between workers when the
+shards get out of balance. Workers that exit are restarted with their hosts,
+and workers can be replaced between rounds, all at once or after
+``recycle_after`` rounds; a replacement takes over the detection and tokens
+of the worker it replaces.
+
+Run with ``python -m envoy_reader.sharding HOST [HOST ...]`` to poll hosts
+every ``--interval`` seconds and write the readings as NDJSON.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+import httpx
+
+from .enlighten import EnlightenSession
+from .fleet import (
+    DEFAULT_HOST_TIMEOUT,
+    DEFAULT_MAX_CONCURRENCY,
+    EnvoyFleet,
+    FleetRound,
+    parse_host_spec,
+)
+from .sinks import NdjsonSink
+from .spool import decode_record, encode_record
+
+DEFAULT_INTERVAL = 60
+DEFAULT_REBALANCE_THRESHOLD = 1.25
+DEFAULT_STOP_TIMEOUT = 10
+COST_ALPHA = 0.3
+
+COMMAND_POLL = "poll"
+COMMAND_ADD = "add"
+COMMAND_REMOVE = "remove"
+COMMAND_EXPORT = "export"
+COMMAND_STOP = "stop"
+
+# Seconds the round took in the worker, number of results.
+_ROUND = struct.Struct("<dI")
+# Result kind, poll latency (NaN if the host was not polled), payload length.
+_RESULT = struct.Struct("<BdI")
+_RESULT_OK = 0
+_RESULT_ERROR = 1
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class WorkerError(Exception):
+    """The worker polling the host exited or stopped answering during the round."""
+
+
+class RemotePollError(Exception):
+    """Polling the host raised an exception in its worker.
+
+    ``error_type`` is the name of the class of the original exception.
+    """
+
+    def __init__(self, error_type, message):
+        """Init the RemotePollError."""
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+
+def encode_round(fleet_round):
+    """Return the message carrying the results of a worker's round."""
+    parts = [_ROUND.pack(fleet_round.elapsed, len(fleet_round.results))]
+    for host, result in fleet_round.results.items():
+        if isinstance(result, Exception):
+            kind = _RESULT_ERROR
+            payload = "\0".join((host, type(result).__name__, str(result))).encode()
+        else:
+            kind = _RESULT_OK
+            payload = encode_record(host, result)
+        latency = fleet_round.latencies.get(host, math.nan)
+        parts += [_RESULT.pack(kind, latency, len(payload)), payload]
+    return b"".join(parts)
+
+
+def decode_round(message):
+    """Return the FleetRound of a message built by encode_round()."""
+    view = memoryview(message)
+    elapsed, count = _ROUND.unpack_from(view)
+    pos = _ROUND.size
+    results = {}
+    latencies = {}
+    for _ in range(count):
+        kind, latency, length = _RESULT.unpack_from(view, pos)
+        pos += _RESULT.size
+        payload = view[pos : pos + length]
+        pos += length
+        if kind == _RESULT_OK:
+            host, result = decode_record(payload)
+        else:
+            host, error_type, error = bytes(payload).decode().split("\0", 2)
+            result = RemotePollError(error_type, error)
+        results[host] = result
+        if not math.isnan(latency):
+            latencies[host] = latency
+    return FleetRound(results, latencies, elapsed)
+
+
+def balance_hosts(costs, shard_count):
+    """Split hosts into ``shard_count`` lists of about equal total cost.
+
+    ``costs`` maps each host to its poll cost. Hosts are placed most costly
+    first on the shard with the lowest total so far.
+    """
+    shards = [[] for _ in range(shard_count)]
+    loads = [0.0] * shard_count
+    for host in sorted(costs, key=costs.get, reverse=True):
+        idx = loads.index(min(loads))
+        shards[idx].append(host)
+        loads[idx] += costs[host]
+    return shards
+
+
+def plan_moves(shards, costs, threshold=DEFAULT_REBALANCE_THRESHOLD):
+    """Return the ``(host, from_shard, to_shard)`` moves evening out the shards.
+
+    Nothing moves while the most loaded shard is within ``threshold`` times
+    the mean load. Otherwise hosts move from the most to the least loaded
+    shard, each time the host bringing the two closest to equal, until the
+    shards are within the threshold or no move helps.
+    """
+    shards = [set(shard) for shard in shards]
+    loads = [sum(costs[host] for host in shard) for shard in shards]
+    mean = sum(loads) / len(loads) if loads else 0
+    moves = []
+    while mean and max(loads) > threshold * mean:
+        source = loads.index(max(loads))
+        target = loads.index(min(loads))
+        gap = loads[source] - loads[target]
+        candidates = [host for host in shards[source] if costs[host] < gap]
+        if not candidates:
+            break
+        host = min(candidates, key=lambda host: abs(gap / 2 - costs[host]))
+        shards[source].remove(host)
+        shards[target].add(host)
+        loads[source] -= costs[host]
+        loads[target] += costs[host]
+        moves.append((host, source, target))
+    return moves
+
+
+def _worker_main(conn, configs, fleet_kwargs, transport, states=None):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(_serve_worker(conn, configs, fleet_kwargs, transport, states))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve_worker(  # pylint: disable=too-many-arguments
+    conn, configs, fleet_kwargs, transport, states=None
+):
+    """Run the commands sent by the parent until told to stop.
+
+    ``states`` maps hosts to the reader states to restore before the first
+    command.
+    """
+    loop = asyncio.get_running_loop()
+    fleet_kwargs = dict(fleet_kwargs)
+    reader_kwargs = fleet_kwargs.pop("reader_kwargs")
+    client = None
+    if transport is not None:
+        client = httpx.AsyncClient(transport=transport, verify=False)
+    fleet = EnvoyFleet(configs, async_client=client, **fleet_kwargs, **reader_kwargs)
+    for host, state in (states or {}).items():
+        if state and host in fleet.readers:
+            fleet.readers[host].restore_state(state)
+    try:
+        while True:
+            try:
+                command, argument = await loop.run_in_executor(None, conn.recv)
+            except EOFError:
+                break
+            if command == COMMAND_POLL:
+                conn.send_bytes(encode_round(await fleet.poll()))
+            elif command == COMMAND_ADD:
+                for config, state in argument:
+                    reader = fleet.add_host(config, **reader_kwargs)
+                    if state:
+                        reader.restore_state(state)
+            elif command == COMMAND_REMOVE:
+                states = {}
+                for host in argument:
+                    states[host] = fleet.readers[host].export_state()
+                    await fleet.remove_host(host)
+                conn.send(states)
+            elif command == COMMAND_EXPORT:
+                conn.send(
+                    {
+                        host: reader.export_state()
+                        for host, reader in fleet.readers.items()
+                    }
+                )
+            elif command == COMMAND_STOP:
+                break
+    finally:
+        await fleet.aclose()
+        if client is not None:
+            await client.aclose()
+        conn.close()
+
+
+class _Worker:
+    """A worker process, the pipe to it and the hosts it polls."""
+
+    def __init__(self, index, process, conn, hosts):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.hosts = set(hosts)
+        self.rounds = 0
+
+
+class ShardedFleet:  # pylint: disable=too-many-instance-attributes
+    """Run getData() across many Envoys from ``workers`` processes.
+
+    ``hosts`` is an iterable of host names or dicts of EnvoyReader keyword
+    arguments, as for EnvoyFleet. ``max_concurrency`` and ``timeout`` apply
+    per worker; the reader keyword arguments, and ``transport``, an httpx
+    transport for the connection pool of each worker, are pickled to the
+    workers, so hooks run in the workers. Workers are started by the first
+    poll() and replaced after ``recycle_after`` rounds unless it is None.
+    Hosts are moved between workers once a shard's poll cost exceeds
+    ``rebalance_threshold`` times the mean, unless it is None; a moved host
+    takes its detection and token along to its new worker, as do the hosts
+    of a worker that is replaced without having exited. Workers are
+    spawned, not forked, unless ``mp_context`` says otherwise. A worker
+    whose round takes longer than ``round_timeout`` seconds fails its hosts
+    for the round and is restarted; by default the limit is the time its
+    hosts can take to time out, ``max_concurrency`` at a time, plus
+    DEFAULT_STOP_TIMEOUT, and there is none if ``timeout`` is None.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        hosts,
+        workers=None,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timeout=DEFAULT_HOST_TIMEOUT,
+        recycle_after=None,
+        rebalance_threshold=DEFAULT_REBALANCE_THRESHOLD,
+        transport=None,
+        mp_context=None,
+        round_timeout=None,
+        **reader_kwargs,
+    ):
+        """Init the ShardedFleet."""
+        self.worker_count = workers or os.cpu_count() or 1
+        self.recycle_after = recycle_after
+        self.round_timeout = round_timeout
+        self.rebalance_threshold = rebalance_threshold
+        self.transport = transport
+        self.costs = {}
+        self.restarts = 0
+        self.moves = 0
+        self.last_round = None
+        self._fleet_kwargs = {
+            "max_concurrency": max_concurrency,
+            "timeout": timeout,
+            "reader_kwargs": reader_kwargs,
+        }
+        self._context = mp_context or multiprocessing.get_context("spawn")
+        self._configs = {}
+        for config in hosts:
+            if isinstance(config, str):
+                config = {"host": config}
+            self._configs[config["host"]] = config
+        self._workers = []
+        self._lock = None
+
+    async def __aenter__(self):
+        """Enter the fleet's context."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Stop the workers when leaving the context."""
+        await self.aclose()
+
+    @property
+    def hosts(self):
+        """Return the host names of the fleet."""
+        return list(self._configs)
+
+    @property
+    def shards(self):
+        """Return the hosts of each worker."""
+        return [sorted(worker.hosts) for worker in self._workers]
+
+    @property
+    def pids(self):
+        """Return the process ID of each worker."""
+        return [worker.process.pid for worker in self._workers]
+
+    def _get_lock(self):
+        """Return the lock serializing rounds and worker changes."""
+        # Created on first use, so it binds to the loop running the fleet.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _host_costs(self):
+        """Return the cost of every host, the mean cost for unpolled hosts."""
+        known = [self.costs[host] for host in self._configs if host in self.costs]
+        default = sum(known) / len(known) if known else 1.0
+        return {host: self.costs.get(host, default) for host in self._configs}
+
+    def _spawn(self, index, hosts, states=None):
+        """Start a worker process polling ``hosts``, restoring ``states``."""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                [self._configs[host] for host in hosts],
+                self._fleet_kwargs,
+                self.transport,
+                states,
+            ),
+            name=f"envoy-shard-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(index, process, parent_conn, hosts)
+
+    async def start(self):
+        """Start the workers, if they are not running."""
+        if self._workers:
+            return
+        shards = balance_hosts(self._host_costs(), self.worker_count)
+        self._workers = [
+            self._spawn(index, hosts) for index, hosts in enumerate(shards)
+        ]
+
+    async def _stop(self, worker):
+        """Ask a worker to stop and wait for it, killing it if it hangs."""
+        try:
+            worker.conn.send((COMMAND_STOP, None))
+        except OSError:
+            pass
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, worker.process.join, DEFAULT_STOP_TIMEOUT)
+        if worker.process.is_alive():
+            _LOGGER.warning("Worker %s did not stop, terminating it", worker.index)
+            worker.process.terminate()
+            await loop.run_in_executor(None, worker.process.join)
+        worker.conn.close()
+
+    @staticmethod
+    async def _reply(worker, timeout=DEFAULT_STOP_TIMEOUT, receive_bytes=False):
+        """Return the next message from a worker, waiting at most ``timeout``.
+
+        Raises EOFError or OSError if the worker exited and
+        asyncio.TimeoutError if it did not answer in time, after which its
+        pipe is out of step and the worker must be replaced.
+        """
+        receive = worker.conn.recv_bytes if receive_bytes else worker.conn.recv
+        return await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(None, receive), timeout
+        )
+
+    async def _export_states(self, worker):
+        """Return the reader states of a worker's hosts, or {} if it failed."""
+        try:
+            worker.conn.send((COMMAND_EXPORT, None))
+            return await self._reply(worker)
+        except (EOFError, OSError, asyncio.TimeoutError):
+            return {}
+
+    async def _restart(self, worker, failed=False):
+        """Replace a worker with a new process polling the same hosts.
+
+        Unless the worker failed, the new process restores the reader states
+        of the old one, so it does not detect the models or fetch tokens again.
+        """
+        states = {} if failed else await self._export_states(worker)
+        self._workers[worker.index] = self._spawn(worker.index, worker.hosts, states)
+        self.restarts += 1
+        await self._stop(worker)
+
+    async def restart_worker(self, index):
+        """Replace a worker between rounds, starting the new one first."""
+        async with self._get_lock():
+            await self._restart(self._workers[index])
+
+    async def restart_workers(self):
+        """Replace every worker, one at a time, between rounds."""
+        async with self._get_lock():
+            for worker in list(self._workers):
+                await self._restart(worker)
+
+    def _round_timeout(self, worker):
+        """Return the seconds to wait for a worker's round, or None."""
+        if self.round_timeout is not None:
+            return self.round_timeout
+        default = self._fleet_kwargs["timeout"]
+        timeouts = [
+            self._configs[host].get("timeout", default) for host in worker.hosts
+        ]
+        if not timeouts:
+            return DEFAULT_STOP_TIMEOUT
+        if None in timeouts:
+            return None
+        batches = math.ceil(len(timeouts) / self._fleet_kwargs["max_concurrency"])
+        return batches * max(timeouts) + DEFAULT_STOP_TIMEOUT
+
+    async def _receive(self, worker):
+        """Return the FleetRound of a worker, or the WorkerError it failed with."""
+        try:
+            worker.conn.send((COMMAND_POLL, None))
+            message = await self._reply(
+                worker, self._round_timeout(worker), receive_bytes=True
+            )
+        except asyncio.TimeoutError:
+            # Caught first: it subclasses OSError from Python 3.11 on.
+            return WorkerError(f"Worker {worker.index} did not answer in time")
+        except (EOFError, OSError):
+            return WorkerError(f"Worker {worker.index} exited")
+        worker.rounds += 1
+        return decode_round(message)
+
+    async def poll(self):
+        """Poll every host once and return the merged FleetRound."""
+        async with self._get_lock():
+            await self.start()
+            start = time.monotonic()
+            worker_rounds = await asyncio.gather(
+                *(self._receive(worker) for worker in self._workers)
+            )
+            results = {}
+            latencies = {}
+            for worker, worker_round in zip(list(self._workers), worker_rounds):
+                if isinstance(worker_round, WorkerError):
+                    _LOGGER.warning("%s, restarting it", worker_round)
+                    results.update(dict.fromkeys(worker.hosts, worker_round))
+                    await self._restart(worker, failed=True)
+                    continue
+                results.update(worker_round.results)
+                latencies.update(worker_round.latencies)
+                if self.recycle_after and worker.rounds >= self.recycle_after:
+                    await self._restart(worker)
+            self.last_round = FleetRound(
+                {host: results[host] for host in self._configs if host in results},
+                latencies,
+                time.monotonic() - start,
+            )
+            for host, latency in latencies.items():
+                # A failed poll's latency is the time spent waiting on a
+                # timeout or retry backoff, not work done by the worker.
+                if isinstance(results[host], Exception):
+                    continue
+                cost = self.costs.get(host)
+                self.costs[host] = (
+                    latency if cost is None else cost + COST_ALPHA * (latency - cost)
+                )
+            if self.rebalance_threshold is not None:
+                await self._rebalance()
+            return self.last_round
+
+    async def _remove_hosts(self, worker, hosts):
+        """Remove hosts from a worker, returning their states, None if it failed."""
+        try:
+            worker.conn.send((COMMAND_REMOVE, hosts))
+            return await self._reply(worker)
+        except (EOFError, OSError, asyncio.TimeoutError):
+            return None
+
+    async def _rebalance(self):
+        """Move hosts from the most to the least loaded workers."""
+        moves = plan_moves(
+            [worker.hosts for worker in self._workers],
+            self._host_costs(),
+            self.rebalance_threshold,
+        )
+        if not moves:
+            return
+        removed = [[] for _ in self._workers]
+        added = [[] for _ in self._workers]
+        for host, source, target in moves:
+            self._workers[source].hosts.discard(host)
+            self._workers[target].hosts.add(host)
+            removed[source].append(host)
+            added[target].append(host)
+        sources = [
+            (worker, hosts) for worker, hosts in zip(self._workers, removed) if hosts
+        ]
+        replies = await asyncio.gather(
+            *(self._remove_hosts(worker, hosts) for worker, hosts in sources)
+        )
+        states = {}
+        for (worker, _), reply in zip(sources, replies):
+            if reply is None:
+                _LOGGER.warning("Worker %s failed, restarting it", worker.index)
+                await self._restart(worker, failed=True)
+            else:
+                states.update(reply)
+        for worker, hosts in zip(self._workers, added):
+            if not hosts:
+                continue
+            try:
+                worker.conn.send(
+                    (
+                        COMMAND_ADD,
+                        [(self._configs[host], states.get(host)) for host in hosts],
+                    )
+                )
+            except OSError:
+                pass
+        self.moves += len(moves)
+        _LOGGER.debug("Moved %s hosts between workers", len(moves))
+
+    async def aclose(self):
+        """Stop every worker."""
+        async with self._get_lock():
+            await asyncio.gather(*(self._stop(worker) for worker in self._workers))
+            self._workers = []
+
+
+async def _main(args):
+    reader_kwargs = {
+        "username": args.username,
+        "password": args.password,
+        "inverters": args.inverters,
+        "concurrent_requests": True,
+    }
+    if args.enlighten_user:
+        # Pickled unused, so each worker logs in with its own copy.
+        reader_kwargs.update(
+            enlighten_session=EnlightenSession(
+                args.enlighten_user, args.enlighten_pass
+            ),
+            commissioned=str(args.commissioned),
+            enlighten_site_id=args.site_id,
+            https_flag="s",
+        )
+    fleet = ShardedFleet(
+        [parse_host_spec(spec) for spec in args.hosts],
+        workers=args.workers,
+        max_concurrency=args.max_concurrency,
+        recycle_after=args.recycle_after,
+        **reader_kwargs,
+    )
+    output = sys.stdout if args.output == "-" else args.output
+    loop = asyncio.get_running_loop()
+    async with fleet, NdjsonSink(output) as sink:
+        rounds = 0
+        while True:
+            started = loop.time()
+            fleet_round = await fleet.poll()
+            for host, snapshot in fleet_round.succeeded.items():
+                sink.add(host, snapshot)
+            await sink.flush()
+            _LOGGER.info(
+                "Polled %s hosts in %.2f s, %s errors",
+                len(fleet_round.results),
+                fleet_round.elapsed,
+                len(fleet_round.errors),
+            )
+            rounds += 1
+            if args.rounds and rounds >= args.rounds:
+                break
+            await asyncio.sleep(max(0, started + args.interval - loop.time()))
+
+
+def main(argv=None):
+    """Parse the command line and poll the hosts until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Poll Enphase Envoys from several processes and print NDJSON."
+    )
+    parser.add_argument(
+        "hosts",
+        nargs="+",
+        help="Envoy host names, as HOST, HOST=SERIAL or HOST=SERIAL:SITE",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Worker processes, by default one per core"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help="Seconds between polls",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=0, help="Stop after this many polls"
+    )
+    parser.add_argument(
+        "--output", default="-", help="File to append the NDJSON readings to"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="Concurrent polls per worker",
+    )
+    parser.add_argument(
+        "--recycle-after",
+        type=int,
+        help="Replace each worker after this many polls",
+    )
+    parser.add_argument("--username", default="envoy")
+    parser.add_argument("--password", default="")
+    parser.add_argument(
+        "--no-inverters",
+        dest="inverters",
+        action="store_false",
+        help="Do not poll inverter data",
+    )
+    parser.add_argument("--enlighten-user", help="Enlighten Username")
+    parser.add_argument("--enlighten-pass", help="Enlighten Password")
+    parser.add_argument(
+        "--uncommissioned",
+        dest="commissioned",
+        action="store_false",
+        help="Fetch uncommissioned tokens",
+    )
+    parser.add_argument(
+        "--site-id", help="Enlighten Site ID of hosts given without a SITE"
+    )
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Simulate Envoys locally for load, latency and failure testing.
+
+EnvoySimulator is an httpx transport, so a reader or fleet is pointed at it
+through ``async_client=httpx.AsyncClient(transport=EnvoySimulator(...))``.
+Every host name is answered by the same simulated Envoy, except the ones
+listed as unreachable. Unlike respx mocks, it sleeps for the configured
+latency and honours the read timeout of each request.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+from collections import Counter
+
+import httpx
+
+# Simulated path -> file name in a tests/fixtures/<firmware> directory.
+FIXTURE_FILES = {
+    "/production.json": "production.json",
+    "/api/v1/production": "api_v1_production",
+    "/api/v1/production/inverters": "api_v1_production_inverters",
+    "/production": "production",
+}
+
+INVERTERS_PATH = "/api/v1/production/inverters"
+CHECK_JWT_PATH = "/auth/check_jwt"
+INFO_PATH = "/info.xml"
+
+DIGEST_REALM = "enphaseenergy.com"
+
+
+def synthetic_inverters(count, start=1600000000):
+    """Return an /api/v1/production/inverters body with ``count`` inverters."""
+    return [
+        {
+            "serialNumber": f"12190{idx:07}",
+            "lastReportDate": start + idx % 300,
+            "devType": 1,
+            "lastReportWatts": idx % 350,
+            "maxReportWatts": 350,
+        }
+        for idx in range(count)
+    ]
+
+
+def _md5(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def _parse_digest(header):
+    """Return the fields of a Digest Authorization header as a dict."""
+    fields = {}
+    for item in header[len("Digest ") :].split(","):
+        key, _, value = item.strip().partition("=")
+        fields[key] = value.strip('"')
+    return fields
+
+
+class EnvoySimulator(httpx.AsyncBaseTransport):
+    """Answer HTTP requests like an Envoy serving the files of a fixture directory.
+
+    ``latency``, ``error_rate`` (HTTP 500 responses) and ``failure_rate``
+    (connection errors) are either one value for every path or a dict keyed
+    by path. ``jitter`` adds up to that many seconds to each latency.
+    ``inverter_count`` replaces the inverters fixture with synthetic
+    inverters. ``https_only`` answers plain HTTP with a 301 to HTTPS,
+    ``digest_auth`` is a ``(username, password)`` pair the inverters endpoint
+    challenges for, and ``token`` is the Enphase token every endpoint then
+    requires. Request, error and challenge counts are kept in ``stats``.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        fixture_dir=None,
+        serial_number="121500012345",
+        inverter_count=None,
+        latency=0,
+        jitter=0,
+        error_rate=0,
+        failure_rate=0,
+        https_only=False,
+        digest_auth=None,
+        token=None,
+        unreachable_hosts=(),
+        seed=None,
+    ):
+        """Init the EnvoySimulator."""
+        self.serial_number = serial_number
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.https_only = https_only
+        self.digest_auth = digest_auth
+        self.token = token
+        self.unreachable_hosts = set(unreachable_hosts)
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._nonce = os.urandom(16).hex()
+        self._bodies = {}
+        if fixture_dir is not None:
+            for path, name in FIXTURE_FILES.items():
+                fixture = os.path.join(fixture_dir, name)
+                if os.path.exists(fixture):
+                    with open(fixture, "rb") as read_in:
+                        self._bodies[path] = read_in.read()
+        if inverter_count is not None:
+            self._bodies[INVERTERS_PATH] = json.dumps(
+                synthetic_inverters(inverter_count)
+            ).encode()
+        self._bodies[INFO_PATH] = (
+            "<?xml version='1.0' encoding='UTF-8'?><envoy_info><device>"
+            f"<sn>{serial_number}</sn></device></envoy_info>"
+        ).encode()
+
+    @staticmethod
+    def _setting(value, path):
+        """Return the value of a per-path setting for a path."""
+        if isinstance(value, dict):
+            return value.get(path, 0)
+        return value
+
+    async def handle_async_request(self, request):
+        """Answer a request after the simulated latency."""
+        path = request.url.path
+        self.stats["requests"] += 1
+        self.stats[path] += 1
+
+        if request.url.host in self.unreachable_hosts or (
+            self._random.random() < self._setting(self.failure_rate, path)
+        ):
+            self.stats["failures"] += 1
+            raise httpx.ConnectError("Simulated connection failure", request=request)
+
+        delay = self._setting(self.latency, path)
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        timeout = request.extensions.get("timeout", {}).get("read")
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            self.stats["timeouts"] += 1
+            raise httpx.ReadTimeout("Simulated read timeout", request=request)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        return self._respond(request, path)
+
+    def _respond(self, request, path):
+        """Return the response of the simulated Envoy to a request."""
+        if self.https_only and request.url.scheme == "http":
+            return httpx.Response(
+                301, headers={"Location": str(request.url.copy_with(scheme="https"))}
+            )
+        if self._random.random() < self._setting(self.error_rate, path):
+            self.stats["errors"] += 1
+            return httpx.Response(500)
+        if self.token and path != INFO_PATH:
+            if request.headers.get("Authorization") != f"Bearer {self.token}":
+                return httpx.Response(401)
+        if path == CHECK_JWT_PATH:
+            return httpx.Response(200, text="<!DOCTYPE html><h2>Valid token.</h2>")
+        if (
+            path == INVERTERS_PATH
+            and self.digest_auth
+            and not self._authorized(request)
+        ):
+            self.stats["digest_challenges"] += 1
+            return httpx.Response(
+                401,
+                headers={
+                    "WWW-Authenticate": f'Digest realm="{DIGEST_REALM}", '
+                    f'nonce="{self._nonce}", qop="auth"'
+                },
+            )
+        body = self._bodies.get(path)
+        if body is None:
+            return httpx.Response(404)
+        return httpx.Response(200, content=body)
+
+    def _authorized(self, request):
+        """Return whether a request carries a valid digest response."""
+        header = request.headers.get("Authorization", "")
+        if not header.startswith("Digest "):
+            return False
+        fields = _parse_digest(header)
+        username, password = self.digest_auth
+        if fields.get("username") != username or fields.get("nonce") != self._nonce:
+            return False
+        ha1 = _md5(f"{username}:{DIGEST_REALM}:{password}")
+        ha2 = _md5(f"{request.method}:{fields.get('uri')}")
+        expected = _md5(
+            f"{ha1}:{self._nonce}:{fields.get('nc')}:{fields.get('cnonce')}:"
+            f"{fields.get('qop')}:{ha2}"
+        )
+        return fields.get("response") == expected
+
+    def renew_nonce(self):
+        """Invalidate the digest nonce, so the next request is challenged again."""
+        self._nonce = os.urandom(16).hex()
+        self.stats["nonce_renewals"] += 1
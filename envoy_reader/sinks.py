@@ -0,0 +1,397 @@
+"""Buffer polled readings and write them out in batches.
+
+Every sink takes readings with ``add(host, snapshot)`` from the event loop,
+buffers them and writes a batch once ``max_batch`` rows are waiting or the
+oldest row is ``max_age`` seconds old. Batches are written in an executor
+thread, one at a time and in order, so slow disks or pipes never delay a
+poll. Call ``flush()`` to write the buffer now and ``aclose()`` (or use the
+sink as an async context manager) to write what is left and close it.
+
+A reading becomes one snapshot row plus one row per inverter.
+"""
+import asyncio
+import csv
+import json
+import logging
+import time
+
+from .inverters import TIME_FORMAT
+
+DEFAULT_MAX_BATCH = 5000
+DEFAULT_MAX_AGE = 10
+
+SNAPSHOT_FIELDS = (
+    "production",
+    "consumption",
+    "daily_production",
+    "daily_consumption",
+    "seven_days_production",
+    "seven_days_consumption",
+    "lifetime_production",
+    "lifetime_consumption",
+)
+SNAPSHOT_COLUMNS = ("host", "timestamp", *SNAPSHOT_FIELDS)
+INVERTER_COLUMNS = ("host", "serial", "last_report", "watts")
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _inverter_rows(host, inverters):
+    """Return the inverter rows of an InverterTable or inverters_production() dict."""
+    if isinstance(inverters, dict):
+        return [
+            (host, serial, time.mktime(time.strptime(date, TIME_FORMAT)), watts)
+            for serial, (watts, date) in inverters.items()
+        ]
+    return [
+        (host, serial, last_report, watts) for serial, watts, last_report in inverters
+    ]
+
+
+def _append_rows(host, snapshot, inverters, snapshot_rows, inverter_rows):
+    """Add the rows of a reading to the snapshot and inverter row lists."""
+    if inverters is None:
+        inverters = snapshot.inverters
+    snapshot_rows.append(
+        (host, snapshot.timestamp)
+        + tuple(getattr(snapshot, name) for name in SNAPSHOT_FIELDS)
+    )
+    if inverters:
+        inverter_rows.extend(_inverter_rows(host, inverters))
+
+
+class _Target:
+    """A file path opened on first write, or a file-like object to write to."""
+
+    def __init__(self, target, mode="a", newline=None):
+        self._target = target
+        self._mode = mode
+        self._newline = newline
+        self._file = None
+        self.is_new = True
+
+    def file(self):
+        """Return the file object, opening the path on first use."""
+        if self._file is None:
+            if hasattr(self._target, "write"):
+                self._file = self._target
+            else:
+                # pylint: disable=consider-using-with
+                self._file = open(
+                    self._target, self._mode, encoding="utf-8", newline=self._newline
+                )
+                self.is_new = self._file.tell() == 0
+        return self._file
+
+    def close(self):
+        """Close the file if it was opened from a path."""
+        if self._file is not None and not hasattr(self._target, "write"):
+            self._file.close()
+        elif self._file is not None:
+            self._file.flush()
+
+
+class BatchSink:
+    """Base class buffering rows and writing them in batches off the event loop.
+
+    Subclasses implement ``write_batch(snapshot_rows, inverter_rows)`` and
+    ``close()``, which run in ``executor`` (the loop's default executor if
+    None). Snapshot rows hold SNAPSHOT_COLUMNS and inverter rows
+    INVERTER_COLUMNS, with times in epoch seconds and missing values None.
+    """
+
+    def __init__(
+        self, max_batch=DEFAULT_MAX_BATCH, max_age=DEFAULT_MAX_AGE, executor=None
+    ):
+        """Init the BatchSink."""
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.executor = executor
+        self.rows_written = 0
+        self.batches_written = 0
+        self._snapshot_rows = []
+        self._inverter_rows = []
+        self._timer = None
+        self._lock = None
+        self._tasks = set()
+
+    def __len__(self):
+        """Return the number of rows waiting to be written."""
+        return len(self._snapshot_rows) + len(self._inverter_rows)
+
+    async def __aenter__(self):
+        """Enter the sink's context."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Write the remaining rows and close the sink."""
+        await self.aclose()
+
+    def add(self, host, snapshot, inverters=None):
+        """Buffer a snapshot and its inverter readings.
+
+        ``inverters`` defaults to the snapshot's InverterTable and may also
+        be the dict returned by inverters_production().
+        """
+        _append_rows(
+            host, snapshot, inverters, self._snapshot_rows, self._inverter_rows
+        )
+        if len(self) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_age, self._start_flush
+            )
+
+    def _start_flush(self):
+        """Write the buffer in the background."""
+        task = asyncio.ensure_future(self._background_flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _background_flush(self):
+        try:
+            await self.flush()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Writing a batch to %r failed", self)
+
+    async def flush(self):
+        """Write the buffered rows now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        snapshot_rows, self._snapshot_rows = self._snapshot_rows, []
+        inverter_rows, self._inverter_rows = self._inverter_rows, []
+        await self._write(snapshot_rows, inverter_rows)
+
+    async def write(self, readings):
+        """Write ``(host, snapshot)`` pairs now, as one batch.
+
+        Unlike add(), nothing is buffered and errors are raised to the
+        caller, which keeps the readings to retry, as SnapshotSpool.drain()
+        does.
+        """
+        snapshot_rows = []
+        inverter_rows = []
+        for host, snapshot in readings:
+            _append_rows(host, snapshot, None, snapshot_rows, inverter_rows)
+        await self._write(snapshot_rows, inverter_rows)
+
+    async def _write(self, snapshot_rows, inverter_rows):
+        """Run write_batch in the executor, one batch at a time."""
+        if not snapshot_rows and not inverter_rows:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.write_batch, snapshot_rows, inverter_rows
+            )
+        self.rows_written += len(snapshot_rows) + len(inverter_rows)
+        self.batches_written += 1
+
+    async def aclose(self):
+        """Write the remaining rows and close the sink."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.close)
+
+    def write_batch(self, snapshot_rows, inverter_rows):
+        """Write a batch of rows; runs in the executor."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release files or connections; runs in the executor."""
+
+
+def _escape_key(value):
+    """Escape an InfluxDB measurement, tag key or tag value."""
+    return str(value).replace(",", r"\,").replace("=", r"\=").replace(" ", r"\ ")
+
+
+class LineProtocolSink(BatchSink):
+    """Write InfluxDB line protocol to a file path or a text stream.
+
+    Snapshots become points of ``measurement`` and inverter readings points
+    of ``inverter_measurement``, tagged with the host (and serial number).
+    ``precision`` is the timestamp unit: ``s``, ``ms``, ``us`` or ``ns``.
+    """
+
+    PRECISION = {"s": 1, "ms": 1000, "us": 1000000, "ns": 1000000000}
+
+    def __init__(
+        self,
+        target,
+        measurement="envoy",
+        inverter_measurement="envoy_inverter",
+        precision="s",
+        **kwargs,
+    ):
+        """Init the LineProtocolSink."""
+        super().__init__(**kwargs)
+        self._target = _Target(target)
+        self.measurement = _escape_key(measurement)
+        self.inverter_measurement = _escape_key(inverter_measurement)
+        self._scale = self.PRECISION[precision]
+
+    def write_batch(self, snapshot_rows, inverter_rows):
+        """Write a batch of points."""
+        scale = self._scale
+        lines = []
+        for row in snapshot_rows:
+            fields = ",".join(
+                f"{name}={value}i"
+                for name, value in zip(SNAPSHOT_FIELDS, row[2:])
+                if value is not None
+            )
+            if fields:
+                lines.append(
+                    f"{self.measurement},host={_escape_key(row[0])} {fields} "
+                    f"{int(row[1] * scale)}\n"
+                )
+        for host, serial, last_report, watts in inverter_rows:
+            lines.append(
+                f"{self.inverter_measurement},host={_escape_key(host)},"
+                f"serial={_escape_key(serial)} watts={watts}i "
+                f"{int(last_report * scale)}\n"
+            )
+        target = self._target.file()
+        target.write("".join(lines))
+        target.flush()
+
+    def close(self):
+        """Close the target if it was opened from a path."""
+        self._target.close()
+
+
+class NdjsonSink(BatchSink):
+    """Write one JSON object per row to a file path or a text stream.
+
+    Rows have a ``type`` of ``snapshot`` or ``inverter`` plus their columns.
+    """
+
+    def __init__(self, target, **kwargs):
+        """Init the NdjsonSink."""
+        super().__init__(**kwargs)
+        self._target = _Target(target)
+
+    def write_batch(self, snapshot_rows, inverter_rows):
+        """Write a batch of JSON lines."""
+        lines = [
+            json.dumps({"type": "snapshot", **dict(zip(SNAPSHOT_COLUMNS, row))})
+            for row in snapshot_rows
+        ]
+        lines += [
+            json.dumps({"type": "inverter", **dict(zip(INVERTER_COLUMNS, row))})
+            for row in inverter_rows
+        ]
+        target = self._target.file()
+        target.write("\n".join(lines) + "\n")
+        target.flush()
+
+    def close(self):
+        """Close the target if it was opened from a path."""
+        self._target.close()
+
+
+class CsvSink(BatchSink):
+    """Write snapshot rows, and optionally inverter rows, as CSV.
+
+    Snapshots go to ``target`` and inverter readings to
+    ``inverters_target``; inverter readings are dropped without one. A
+    header is written to new or empty files and to streams.
+    """
+
+    def __init__(self, target, inverters_target=None, **kwargs):
+        """Init the CsvSink."""
+        super().__init__(**kwargs)
+        self._targets = [(_Target(target, newline=""), SNAPSHOT_COLUMNS)]
+        if inverters_target is not None:
+            self._targets.append(
+                (_Target(inverters_target, newline=""), INVERTER_COLUMNS)
+            )
+
+    def write_batch(self, snapshot_rows, inverter_rows):
+        """Write a batch of CSV rows."""
+        for (target, columns), rows in zip(
+            self._targets, (snapshot_rows, inverter_rows)
+        ):
+            if not rows:
+                continue
+            file = target.file()
+            writer = csv.writer(file)
+            if target.is_new:
+                writer.writerow(columns)
+                target.is_new = False
+            writer.writerows(rows)
+            file.flush()
+
+    def close(self):
+        """Close the targets opened from paths."""
+        for target, _ in self._targets:
+            target.close()
+
+
+class ParquetSink(BatchSink):
+    """Write snapshot rows, and optionally inverter rows, to Parquet files.
+
+    Each batch becomes a row group. Needs pyarrow, which is imported when the
+    sink is created. The files are complete once the sink is closed.
+    """
+
+    def __init__(self, path, inverters_path=None, **kwargs):
+        """Init the ParquetSink."""
+        try:
+            import pyarrow  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            raise ImportError("ParquetSink needs pyarrow to be installed") from err
+        super().__init__(**kwargs)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        timestamp = pyarrow.timestamp("ms", tz="UTC")
+        snapshot_schema = pyarrow.schema(
+            [("host", pyarrow.string()), ("timestamp", timestamp)]
+            + [(name, pyarrow.int64()) for name in SNAPSHOT_FIELDS]
+        )
+        inverter_schema = pyarrow.schema(
+            [
+                ("host", pyarrow.string()),
+                ("serial", pyarrow.string()),
+                ("last_report", timestamp),
+                ("watts", pyarrow.int64()),
+            ]
+        )
+        self._outputs = [[path, snapshot_schema, None]]
+        if inverters_path is not None:
+            self._outputs.append([inverters_path, inverter_schema, None])
+
+    def write_batch(self, snapshot_rows, inverter_rows):
+        """Write a batch as one row group per file."""
+        for output, rows in zip(self._outputs, (snapshot_rows, inverter_rows)):
+            if not rows:
+                continue
+            path, schema, writer = output
+            columns = [list(column) for column in zip(*rows)]
+            # Epoch seconds to the milliseconds of the timestamp columns.
+            for idx, field in enumerate(schema):
+                if self._pa.types.is_timestamp(field.type):
+                    columns[idx] = [int(value * 1000) for value in columns[idx]]
+            table = self._pa.Table.from_arrays(
+                [
+                    self._pa.array(column, type=field.type)
+                    for column, field in zip(columns, schema)
+                ],
+                schema=schema,
+            )
+            if writer is None:
+                writer = output[2] = self._pq.ParquetWriter(path, schema)
+            writer.write_table(table)
+
+    def close(self):
+        """Close the Parquet writers, completing the files."""
+        for output in self._outputs:
+            if output[2] is not None:
+                output[2].close()
+                output[2] = None
@@ -0,0 +1,528 @@
+"""Keep polled readings on disk while the place they go to is unavailable.
+
+A SnapshotSpool is a directory of append-only segment files. Readings are
+appended as compact binary records and read back in the order they were
+appended; the position of the reader is committed to disk, so readings are
+replayed after a restart until a sink has accepted them. Segments are
+rotated at ``segment_size`` bytes, consumed segments are deleted and, once
+the spool outgrows ``max_bytes``, the oldest segments are evicted unread.
+
+Each record is framed by its length and CRC-32, so a record torn by a crash
+is detected and cut off when the spool is opened again. Records are written
+to the file as they are appended and fsynced at most ``sync_interval``
+seconds later, so a crash of the process loses nothing and a power cut at
+most the records of the last interval. On an event loop a timer runs the
+fsync when the interval is up; without one it waits for the next append,
+sync() or close().
+"""
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+
+from .envoy_reader import EnvoySnapshot
+from .inverters import InverterTable
+from .sinks import SNAPSHOT_FIELDS
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_SYNC_INTERVAL = 1.0
+DEFAULT_READ_BATCH = 5000
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+_MAGIC = b"EVSP"
+_VERSION = 1
+# Magic, format version, sequence number of the first record.
+_HEADER = struct.Struct("<4sBQ")
+# Payload length, CRC-32 of the payload.
+_FRAME = struct.Struct("<II")
+# Timestamp, value mask, metering (-1 if unknown), host length, endpoint type
+# length (255 if unknown), inverter count (NO_INVERTERS if not retrieved).
+_RECORD = struct.Struct("<dHbHBI")
+_LENGTH = struct.Struct("<I")
+# Segment, offset and sequence number of the next record to read.
+_POSITION = struct.Struct("<QQQ")
+
+_BATTERY_BIT = 1 << len(SNAPSHOT_FIELDS)
+_NO_ENDPOINT_TYPE = 255
+NO_INVERTERS = 0xFFFFFFFF
+_READ_CHUNK = 1024 * 1024
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _values_struct(mask):
+    """Return the struct of the values present in a value mask."""
+    count = bin(mask & (_BATTERY_BIT - 1)).count("1")
+    return struct.Struct("<" + "q" * count)
+
+
+def _int64_bytes(values):
+    """Return a little-endian int64 array as bytes."""
+    values = array("q", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _int64_array(data):
+    """Return the array of little-endian int64 bytes."""
+    values = array("q")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_record(host, snapshot):
+    """Return the binary record of a reading, without its frame.
+
+    Only the values the Envoy reported are stored, as int64. Inverters are
+    stored as their serials followed by the watts and report time arrays.
+    """
+    mask = 0
+    values = []
+    for bit, name in enumerate(SNAPSHOT_FIELDS):
+        value = getattr(snapshot, name)
+        if value is not None:
+            mask |= 1 << bit
+            values.append(value)
+    host_bytes = host.encode()
+    endpoint_type = snapshot.endpoint_type
+    type_bytes = b"" if endpoint_type is None else endpoint_type.encode()
+    metering = snapshot.is_metering_enabled
+    inverters = snapshot.inverters
+    parts = [
+        None,
+        host_bytes,
+        type_bytes,
+        _values_struct(mask).pack(*values),
+    ]
+    if snapshot.battery_storage is not None:
+        mask |= _BATTERY_BIT
+        storage = json.dumps(snapshot.battery_storage).encode()
+        parts += [_LENGTH.pack(len(storage)), storage]
+    if inverters is not None:
+        serials = "\n".join(inverters.serials).encode()
+        parts += [
+            _LENGTH.pack(len(serials)),
+            serials,
+            _int64_bytes(inverters.watts),
+            _int64_bytes(inverters.last_report),
+        ]
+    timestamp = snapshot.timestamp
+    parts[0] = _RECORD.pack(
+        math.nan if timestamp is None else timestamp,
+        mask,
+        -1 if metering is None else int(metering),
+        len(host_bytes),
+        _NO_ENDPOINT_TYPE if endpoint_type is None else len(type_bytes),
+        NO_INVERTERS if inverters is None else len(inverters),
+    )
+    return b"".join(parts)
+
+
+def decode_record(payload):
+    """Return the ``(host, snapshot)`` of a binary record."""
+    timestamp, mask, metering, host_len, type_len, count = _RECORD.unpack_from(payload)
+    pos = _RECORD.size
+    host = bytes(payload[pos : pos + host_len]).decode()
+    pos += host_len
+    values = {
+        "timestamp": None if math.isnan(timestamp) else timestamp,
+        "is_metering_enabled": None if metering < 0 else bool(metering),
+    }
+    if type_len != _NO_ENDPOINT_TYPE:
+        values["endpoint_type"] = bytes(payload[pos : pos + type_len]).decode()
+        pos += type_len
+    values_struct = _values_struct(mask)
+    present = iter(values_struct.unpack_from(payload, pos))
+    pos += values_struct.size
+    for bit, name in enumerate(SNAPSHOT_FIELDS):
+        if mask & (1 << bit):
+            values[name] = next(present)
+    if mask & _BATTERY_BIT:
+        (length,) = _LENGTH.unpack_from(payload, pos)
+        pos += _LENGTH.size
+        values["battery_storage"] = json.loads(bytes(payload[pos : pos + length]))
+        pos += length
+    if count != NO_INVERTERS:
+        (length,) = _LENGTH.unpack_from(payload, pos)
+        pos += _LENGTH.size
+        serials = bytes(payload[pos : pos + length]).decode().split("\n")
+        pos += length
+        size = 8 * count
+        values["inverters"] = InverterTable(
+            serials if count else (),
+            _int64_array(payload[pos : pos + size]),
+            _int64_array(payload[pos + size : pos + 2 * size]),
+        )
+    return host, EnvoySnapshot(**values)
+
+
+def _frame(host, snapshot):
+    payload = encode_record(host, snapshot)
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _fsync_directory(path):
+    """Make the creation or removal of files in a directory durable."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    handle = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+
+
+class SnapshotSpool:  # pylint: disable=too-many-instance-attributes
+    """On-disk FIFO of ``(host, snapshot)`` readings.
+
+    append() or extend() readings while the sink is down, then drain() them
+    into the sink once it is back, or read() and commit() them yourself.
+    Only one SnapshotSpool may use a directory at a time. ``evicted`` counts
+    the readings dropped unread to stay within ``max_bytes``; disk usage can
+    exceed ``max_bytes`` by the size of the segment being written.
+    ``skipped`` counts the readings lost to corrupt records, which make the
+    reader skip the rest of their segment.
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        max_bytes=DEFAULT_MAX_BYTES,
+        sync_interval=DEFAULT_SYNC_INTERVAL,
+    ):
+        """Init the SnapshotSpool, recovering the segments already on disk."""
+        if max_bytes is not None and max_bytes < segment_size:
+            raise ValueError("max_bytes must be at least segment_size")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.appended = 0
+        self.evicted = 0
+        self.skipped = 0
+        self._skipped_through = 0
+        self._sizes = {}
+        self._bases = []
+        self._handle = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self._sync_timer = None
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                base = int(name[: -len(SEGMENT_SUFFIX)])
+                self._bases.append(base)
+                self._sizes[base] = os.path.getsize(self._path(base))
+        self._bases.sort()
+        self._next_seq = self._recover()
+        self._committed = self._load_cursor()
+        self._position = self._committed
+
+    def __len__(self):
+        """Return the number of readings not committed yet."""
+        return self._next_seq - self._committed[2]
+
+    def __enter__(self):
+        """Enter the spool's context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Sync and close the spool."""
+        self.close()
+
+    @property
+    def disk_usage(self):
+        """Return the bytes held by the segment files."""
+        return sum(self._sizes.values())
+
+    def _path(self, base):
+        return os.path.join(self.directory, f"{base:020d}{SEGMENT_SUFFIX}")
+
+    def _recover(self):
+        """Open the last segment, cutting off a torn tail, and return the next seq."""
+        if not self._bases:
+            self._create_segment(0)
+            return 0
+        base = self._bases[-1]
+        path = self._path(base)
+        with open(path, "rb") as read_in:
+            data = read_in.read()
+        seq = base
+        pos = 0
+        if len(data) >= _HEADER.size and data.startswith(_MAGIC):
+            pos = _HEADER.size
+            view = memoryview(data)
+            while pos + _FRAME.size <= len(data):
+                length, crc = _FRAME.unpack_from(data, pos)
+                end = pos + _FRAME.size + length
+                if end > len(data) or zlib.crc32(view[pos + _FRAME.size : end]) != crc:
+                    break
+                pos = end
+                seq += 1
+        if pos < len(data):
+            _LOGGER.warning(
+                "Cutting %s bytes of torn records off %s", len(data) - pos, path
+            )
+        if pos < _HEADER.size:
+            os.unlink(path)
+            self._bases.pop()
+            del self._sizes[base]
+            self._create_segment(base)
+            return base
+        os.truncate(path, pos)
+        self._sizes[base] = pos
+        self._handle = os.open(path, os.O_WRONLY | os.O_APPEND)
+        return seq
+
+    def _create_segment(self, base):
+        """Start a new segment whose first record will have sequence ``base``."""
+        path = self._path(base)
+        self._handle = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._handle, _HEADER.pack(_MAGIC, _VERSION, base))
+        os.fsync(self._handle)
+        _fsync_directory(self.directory)
+        self._bases.append(base)
+        self._sizes[base] = _HEADER.size
+
+    def _load_cursor(self):
+        """Return the committed read position, moved past evicted segments."""
+        first = self._bases[0]
+        cursor = (first, _HEADER.size, first)
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "rb") as read_in:
+                data = read_in.read()
+            (crc,) = _LENGTH.unpack_from(data, _POSITION.size)
+            if zlib.crc32(data[: _POSITION.size]) == crc:
+                cursor = _POSITION.unpack_from(data)
+            else:
+                _LOGGER.warning("Ignoring corrupt spool cursor in %s", self.directory)
+        except FileNotFoundError:
+            pass
+        except struct.error:
+            _LOGGER.warning("Ignoring corrupt spool cursor in %s", self.directory)
+        base, offset, seq = cursor
+        if base < first or seq < first:
+            if seq < first:
+                self.evicted += first - seq
+            return (first, _HEADER.size, first)
+        if base not in self._sizes or seq > self._next_seq:
+            return (first, _HEADER.size, first)
+        return (base, min(offset, self._sizes[base]), seq)
+
+    def _save_cursor(self):
+        """Atomically replace the cursor file with the committed position."""
+        data = _POSITION.pack(*self._committed)
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as write_out:
+            write_out.write(data + _LENGTH.pack(zlib.crc32(data)))
+            write_out.flush()
+            os.fsync(write_out.fileno())
+        os.replace(tmp_path, path)
+
+    def append(self, host, snapshot):
+        """Add a reading to the end of the spool."""
+        self._write(_frame(host, snapshot), 1)
+
+    def extend(self, readings):
+        """Add ``(host, snapshot)`` pairs to the end of the spool in one write."""
+        frames = [_frame(host, snapshot) for host, snapshot in readings]
+        if frames:
+            self._write(b"".join(frames), len(frames))
+
+    def _write(self, data, count):
+        os.write(self._handle, data)
+        active = self._bases[-1]
+        self._sizes[active] += len(data)
+        self._next_seq += count
+        self.appended += count
+        self._dirty = True
+        if self._sizes[active] >= self.segment_size:
+            self._rotate()
+        elif self.sync_interval is not None:
+            remaining = self._last_sync + self.sync_interval - time.monotonic()
+            if remaining <= 0:
+                self.sync()
+            elif self._sync_timer is None:
+                self._schedule_sync(remaining)
+
+    def _schedule_sync(self, delay):
+        """Sync after ``delay`` seconds if running on an event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._sync_timer = loop.call_later(delay, self._timed_sync)
+
+    def _timed_sync(self):
+        self._sync_timer = None
+        if self._handle is not None:
+            self.sync()
+
+    def sync(self):
+        """Make every appended reading durable."""
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+        if self._dirty:
+            os.fsync(self._handle)
+            self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        """Close the active segment and start the next one."""
+        self.sync()
+        os.close(self._handle)
+        self._create_segment(self._next_seq)
+        if self.max_bytes is not None:
+            while len(self._bases) > 1 and self.disk_usage > self.max_bytes:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        """Delete the oldest segment, moving readers past it."""
+        base = self._bases[0]
+        next_base = self._bases[1]
+        start = (next_base, _HEADER.size, next_base)
+        if self._committed[0] == base:
+            lost = next_base - self._committed[2]
+            if lost:
+                self.evicted += lost
+                _LOGGER.warning(
+                    "Spool in %s is full, dropped %s unread readings",
+                    self.directory,
+                    lost,
+                )
+            self._committed = start
+            self._save_cursor()
+        if self._position[0] == base:
+            self._position = start
+        self._remove_segment(base)
+
+    def _remove_segment(self, base):
+        os.unlink(self._path(base))
+        self._bases.remove(base)
+        del self._sizes[base]
+        _fsync_directory(self.directory)
+
+    def read(self, limit=DEFAULT_READ_BATCH):
+        """Return up to ``limit`` of the next unread readings, oldest first.
+
+        Readings count as read until commit(), which makes them consumed, or
+        rewind(), which reads them again.
+        """
+        readings = []
+        base, offset, seq = self._position
+        chunk = _READ_CHUNK
+        while len(readings) < limit:
+            end = self._sizes[base]
+            if offset >= end:
+                idx = bisect_right(self._bases, base)
+                if idx == len(self._bases):
+                    break
+                # Segments are named after the sequence number of their
+                # first record.
+                base = seq = self._bases[idx]
+                offset = _HEADER.size
+                continue
+            with open(self._path(base), "rb") as read_in:
+                read_in.seek(offset)
+                data = read_in.read(min(chunk, end - offset))
+            view = memoryview(data)
+            pos = 0
+            while len(readings) < limit and pos + _FRAME.size <= len(data):
+                length, crc = _FRAME.unpack_from(data, pos)
+                stop = pos + _FRAME.size + length
+                if stop > len(data):
+                    break
+                payload = view[pos + _FRAME.size : stop]
+                if zlib.crc32(payload) != crc:
+                    _LOGGER.error(
+                        "Skipping the rest of corrupt spool segment %s",
+                        self._path(base),
+                    )
+                    pos = end - offset
+                    seq = self._skip_segment(base, seq)
+                    break
+                readings.append(decode_record(payload))
+                pos = stop
+                seq += 1
+            if pos == 0 and len(readings) < limit:
+                length = _LENGTH.unpack_from(data)[0] if len(data) >= 4 else end
+                if offset + _FRAME.size + length > end:
+                    _LOGGER.error("Skipping the torn end of %s", self._path(base))
+                    pos = end - offset
+                    seq = self._skip_segment(base, seq)
+                else:
+                    # A record larger than the chunk, read it whole.
+                    chunk = _FRAME.size + length
+            offset += pos
+        self._position = (base, offset, seq)
+        return readings
+
+    def _skip_segment(self, base, seq):
+        """Return the sequence number after a segment, counting the skipped."""
+        idx = bisect_right(self._bases, base)
+        end_seq = self._bases[idx] if idx < len(self._bases) else self._next_seq
+        # Readings skipped before a rewind() are only counted once.
+        start = max(seq, self._skipped_through)
+        if end_seq > start:
+            self.skipped += end_seq - start
+            self._skipped_through = end_seq
+        return end_seq
+
+    def commit(self):
+        """Mark the readings read so far as consumed, durably."""
+        if self._position == self._committed:
+            return
+        self._committed = self._position
+        self._save_cursor()
+        while self._bases[0] < self._committed[0]:
+            self._remove_segment(self._bases[0])
+
+    def rewind(self):
+        """Read the readings not committed yet again."""
+        self._position = self._committed
+
+    async def drain(self, sink, batch_size=DEFAULT_READ_BATCH):
+        """Write the spooled readings to a sink, oldest first.
+
+        ``sink`` is a BatchSink, or anything with an async ``write(readings)``
+        method. Each batch the sink accepted is committed; when the sink
+        raises, the rest stay spooled and the error is raised. Returns the
+        number of readings written.
+        """
+        written = 0
+        while True:
+            readings = self.read(batch_size)
+            if not readings:
+                return written
+            try:
+                await sink.write(readings)
+            except BaseException:
+                self.rewind()
+                raise
+            self.commit()
+            written += len(readings)
+
+    def close(self):
+        """Sync and close the active segment."""
+        if self._handle is not None:
+            self.sync()
+            os.close(self._handle)
+            self._handle = None
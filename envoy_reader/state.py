@@ -0,0 +1,209 @@
+"""Persist per-host reader state so restarts can skip login and detection."""
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+DEFAULT_WRITE_DELAY = 1.0
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StateStore:
+    """Interface for storing the state of each reader by host.
+
+    The state is a JSON serializable dict holding the detection record, the
+    Enphase token and its expiry and the password derived from the serial.
+    """
+
+    def load(self, host):
+        """Return the stored state for a host, or None if there is none."""
+        raise NotImplementedError
+
+    def save(self, host, state):
+        """Store the state for a host."""
+        raise NotImplementedError
+
+    def delete(self, host):
+        """Forget the state for a host."""
+        raise NotImplementedError
+
+    async def aflush(self):
+        """Write out changes the store holds back; nothing by default."""
+
+
+class MemoryStateStore(StateStore):
+    """State store that only lives as long as the process."""
+
+    def __init__(self):
+        """Init the MemoryStateStore."""
+        self._states = {}
+
+    def load(self, host):
+        """Return the stored state for a host, or None if there is none."""
+        return self._states.get(host)
+
+    def save(self, host, state):
+        """Store the state for a host."""
+        self._states[host] = dict(state)
+
+    def delete(self, host):
+        """Forget the state for a host."""
+        self._states.pop(host, None)
+
+
+class JsonFileStateStore(MemoryStateStore):
+    """State store backed by a single JSON file.
+
+    The file is read once. Changes are collected for ``write_delay`` seconds
+    and written together from an executor thread while an event loop is
+    running, or right away without one; aflush() and flush() write pending
+    changes immediately. Each write merges the changes into the file as it
+    is on disk, under a lock, so processes sharing the file keep each
+    other's hosts, and replaces it atomically (write to a temporary file,
+    then rename). States older than ``max_age`` seconds are treated as
+    missing. The file holds tokens and passwords, so it is created readable
+    by its owner only.
+    """
+
+    def __init__(self, path, max_age=7 * 24 * 3600, write_delay=DEFAULT_WRITE_DELAY):
+        """Init the JsonFileStateStore."""
+        super().__init__()
+        self.path = path
+        self.max_age = max_age
+        self.write_delay = write_delay
+        self.writes = 0
+        # Host -> state to write, or None to remove the host from the file.
+        self._pending = {}
+        self._timer = None
+        self._writing = None
+        self._states = self._read()
+
+    def _read(self):
+        """Return the states in the file, or an empty dict."""
+        try:
+            with open(self.path, "r") as read_in:
+                states = json.load(read_in)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            _LOGGER.warning("Ignoring corrupt state file %s", self.path)
+            return {}
+        return states if isinstance(states, dict) else {}
+
+    def load(self, host):
+        """Return the stored state for a host, or None if missing or stale."""
+        state = super().load(host)
+        if state is None:
+            return None
+        if (
+            self.max_age is not None
+            and time.time() - state.get("saved_at", 0) > self.max_age
+        ):
+            return None
+        return state
+
+    def save(self, host, state):
+        """Store the state for a host and schedule writing the file."""
+        super().save(host, {**state, "saved_at": time.time()})
+        self._pending[host] = self._states[host]
+        self._schedule_write()
+
+    def delete(self, host):
+        """Forget the state for a host and schedule writing the file."""
+        if host in self._states:
+            super().delete(host)
+            self._pending[host] = None
+            self._schedule_write()
+
+    def _schedule_write(self):
+        """Write the pending changes after the delay, or now without a loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._timer is None and self._writing is None:
+            self._timer = loop.call_later(self.write_delay, self._start_write)
+
+    def _start_write(self):
+        """Hand the pending changes to an executor thread."""
+        self._timer = None
+        pending, self._pending = self._pending, {}
+        self._writing = asyncio.get_running_loop().run_in_executor(
+            None, self._write, pending
+        )
+        self._writing.add_done_callback(functools.partial(self._write_done, pending))
+
+    def _write_done(self, pending, future):
+        """Requeue the changes of a failed write, then write what came since."""
+        self._writing = None
+        if not future.cancelled() and future.exception() is not None:
+            _LOGGER.error(
+                "Writing state file %s failed: %r", self.path, future.exception()
+            )
+            self._pending = {**pending, **self._pending}
+        if self._pending:
+            self._schedule_write()
+
+    def flush(self):
+        """Write the pending changes now, blocking until they are durable."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            self._write(pending)
+
+    async def aflush(self):
+        """Write the pending changes now from an executor thread."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._writing is not None:
+            await asyncio.wait([self._writing])
+        pending, self._pending = self._pending, {}
+        if pending:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, pending)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the lock on the state file against other writers."""
+        handle = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(handle)
+
+    def _write(self, pending):
+        """Merge changes into the state file on disk and replace it atomically."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._locked():
+            states = self._read()
+            for host, state in pending.items():
+                if state is None:
+                    states.pop(host, None)
+                else:
+                    states[host] = state
+            handle, tmp_path = tempfile.mkstemp(dir=directory, prefix=".envoy_state")
+            try:
+                with os.fdopen(handle, "w") as write_out:
+                    json.dump(states, write_out)
+                    write_out.flush()
+                    os.fsync(write_out.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        self.writes += 1
@@ -0,0 +1,106 @@
+"""Derive request timeouts from the latency each endpoint has shown."""
+DEFAULT_INITIAL_TIMEOUT = 30
+DEFAULT_MIN_TIMEOUT = 2
+DEFAULT_MAX_TIMEOUT = 30
+DEFAULT_MIN_SAMPLES = 3
+
+
+class LatencyEstimate:
+    """Smoothed latency and latency deviation of one endpoint.
+
+    Uses the estimator TCP uses for its retransmission timeout (RFC 6298):
+    exponentially weighted moving averages of the latency and of its
+    deviation from that average.
+    """
+
+    __slots__ = ("mean", "deviation", "samples", "backoff")
+
+    def __init__(self):
+        """Init the LatencyEstimate."""
+        self.mean = None
+        self.deviation = None
+        self.samples = 0
+        self.backoff = 1
+
+    def observe(self, latency, alpha, beta):
+        """Add the latency of a request that got an answer."""
+        if self.mean is None:
+            self.mean = latency
+            self.deviation = latency / 2
+        else:
+            self.deviation += beta * (abs(latency - self.mean) - self.deviation)
+            self.mean += alpha * (latency - self.mean)
+        self.samples += 1
+        self.backoff = 1
+
+
+class AdaptiveTimeouts:
+    """Per-endpoint timeouts of ``multiplier`` deviations above the mean latency.
+
+    Until an endpoint has answered ``min_samples`` times, and while the
+    Envoy model is being detected, requests get the generous
+    ``initial_timeout``. After that the timeout is the smoothed latency plus
+    ``multiplier`` times its deviation, clamped between ``min_timeout`` and
+    ``max_timeout``. Each timeout doubles the next one, up to
+    ``max_timeout``, until the endpoint answers again.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        initial_timeout=DEFAULT_INITIAL_TIMEOUT,
+        min_timeout=DEFAULT_MIN_TIMEOUT,
+        max_timeout=DEFAULT_MAX_TIMEOUT,
+        min_samples=DEFAULT_MIN_SAMPLES,
+        multiplier=4,
+        alpha=0.125,
+        beta=0.25,
+    ):
+        """Init the AdaptiveTimeouts."""
+        if min_timeout > max_timeout:
+            raise ValueError("min_timeout must not exceed max_timeout")
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.multiplier = multiplier
+        self.alpha = alpha
+        self.beta = beta
+        self._estimates = {}
+
+    def _estimate(self, endpoint):
+        estimate = self._estimates.get(endpoint)
+        if estimate is None:
+            estimate = self._estimates[endpoint] = LatencyEstimate()
+        return estimate
+
+    def timeout(self, endpoint, detecting=False):
+        """Return the timeout in seconds for the next request to an endpoint."""
+        estimate = self._estimates.get(endpoint)
+        if detecting or estimate is None or estimate.samples < self.min_samples:
+            return self.initial_timeout
+        timeout = max(
+            self.min_timeout, estimate.mean + self.multiplier * estimate.deviation
+        )
+        return min(self.max_timeout, timeout * estimate.backoff)
+
+    def observe(self, endpoint, latency):
+        """Record the latency of a request that got an answer."""
+        self._estimate(endpoint).observe(latency, self.alpha, self.beta)
+
+    def record_timeout(self, endpoint):
+        """Double the next timeout of an endpoint after a request timed out."""
+        estimate = self._estimate(endpoint)
+        if self.timeout(endpoint) < self.max_timeout:
+            estimate.backoff *= 2
+
+    def as_dict(self):
+        """Return the latency estimate and timeout of every endpoint."""
+        return {
+            endpoint: {
+                "mean": estimate.mean,
+                "deviation": estimate.deviation,
+                "samples": estimate.samples,
+                "timeout": self.timeout(endpoint),
+            }
+            for endpoint, estimate in self._estimates.items()
+        }
@@ -0,0 +1,152 @@
+"""Keep an Enphase token fresh without blocking polls on Enlighten."""
+import asyncio
+import logging
+import time
+
+DEFAULT_REFRESH_MARGIN = 3600
+DEFAULT_RETRY_BACKOFF = 60
+DEFAULT_MAX_RETRY_BACKOFF = 900
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def decode_token_expiry(token):
+    """Return the expiry of a token in epoch seconds, or None if unknown."""
+    # PyJWT is only needed on the HTTPS token path, import it on first use.
+    import jwt
+
+    try:
+        decode = jwt.decode(
+            token, options={"verify_signature": False}, algorithms="ES256"
+        )
+    except jwt.PyJWTError:
+        return None
+    return decode.get("exp")
+
+
+class TokenManager:
+    """Hold an Enphase token and refresh it ahead of its expiry.
+
+    ``refresh_callback`` is a coroutine function that obtains a new token and
+    stores it with set_token(). The token expiry is decoded once per token
+    and a background refresh is scheduled ``refresh_margin`` seconds before
+    it. Concurrent refresh() calls share a single in-flight refresh.
+
+    A failed background refresh is retried after ``retry_backoff`` seconds,
+    doubling up to ``max_retry_backoff``, for as long as the token is still
+    valid at the time of the retry.
+    """
+
+    def __init__(
+        self,
+        refresh_callback,
+        refresh_margin=DEFAULT_REFRESH_MARGIN,
+        retry_backoff=DEFAULT_RETRY_BACKOFF,
+        max_retry_backoff=DEFAULT_MAX_RETRY_BACKOFF,
+    ):
+        """Init the TokenManager."""
+        self._refresh_callback = refresh_callback
+        self.refresh_margin = refresh_margin
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.token = ""
+        self.expires_at = None
+        self.refresh_count = 0
+        self.failed_refreshes = 0
+        self._refresh_task = None
+        self._scheduled_refresh = None
+
+    @property
+    def expired(self):
+        """Return True if there is no token or it has expired."""
+        if not self.token:
+            return True
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def set_token(self, token, expires_at=None):
+        """Store a token and schedule its background refresh."""
+        self.token = token
+        self.expires_at = expires_at if expires_at else decode_token_expiry(token)
+        self.failed_refreshes = 0
+        _LOGGER.debug("Token expires at: %s", self.expires_at)
+        self._schedule_refresh()
+
+    def clear(self):
+        """Forget the token and cancel any pending refresh."""
+        self.token = ""
+        self.expires_at = None
+        self.close()
+
+    def close(self):
+        """Cancel the scheduled and in-flight refreshes."""
+        if self._scheduled_refresh is not None:
+            self._scheduled_refresh.cancel()
+            self._scheduled_refresh = None
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = None
+
+    async def async_get_token(self):
+        """Return a valid token, refreshing inline only if it has expired."""
+        if self.expired:
+            await self.refresh()
+        return self.token
+
+    async def refresh(self):
+        """Refresh the token, joining a refresh that is already running."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._async_refresh())
+        await asyncio.shield(self._refresh_task)
+
+    async def _async_refresh(self):
+        """Run the refresh callback."""
+        self.refresh_count += 1
+        await self._refresh_callback()
+
+    def _schedule_refresh(self):
+        """Schedule a background refresh ahead of the token expiry."""
+        if self._scheduled_refresh is not None:
+            self._scheduled_refresh.cancel()
+            self._scheduled_refresh = None
+        if self.expires_at is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        delay = self.expires_at - self.refresh_margin - time.time()
+        if delay <= 0:
+            # Too close to expiry to refresh ahead of time; the next poll
+            # refreshes inline once the token has actually expired.
+            return
+        self._scheduled_refresh = loop.call_later(delay, self._start_background_refresh)
+
+    def _start_background_refresh(self):
+        """Start a background refresh from the event loop timer."""
+        self._scheduled_refresh = None
+        asyncio.ensure_future(self._async_background_refresh())
+
+    async def _async_background_refresh(self):
+        """Refresh in the background, retrying failures with a backoff."""
+        try:
+            await self.refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.warning("Background token refresh failed: %r", err)
+            self._schedule_retry()
+
+    def _schedule_retry(self):
+        """Schedule another background refresh after a failed one."""
+        if self._scheduled_refresh is not None or self.expires_at is None:
+            return
+        delay = min(
+            self.max_retry_backoff, self.retry_backoff * 2**self.failed_refreshes
+        )
+        self.failed_refreshes += 1
+        if time.time() + delay >= self.expires_at:
+            # The token expires first; the next poll refreshes inline.
+            return
+        self._scheduled_refresh = asyncio.get_running_loop().call_later(
+            delay, self._start_background_refresh
+        )
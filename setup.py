@@ -14,6 +14,7 @@ test_requirements = [
     "codecov>=2.1.4",
     "flake8>=3.8.3",
     "flake8-debugger>=3.2.1",
+    "prometheus_client>=0.12",
     "pytest>=5.4.3",
     "pytest-cov>=2.9.0",
     "pytest-raises>=0.11",
@@ -36,14 +37,23 @@ dev_requirements = [
 ]
 
 requirements = [
-    "httpx>=0.20",
+    "httpx>=0.23.2",
     "envoy-utils>=0.0.1",
-    "beautifulsoup4>=4.10.0",
     "pyjwt==2.1.0",
 ]
 
+speedup_requirements = [
+    "orjson>=3.6",
+]
+
+parquet_requirements = [
+    "pyarrow>=6.0",
+]
+
 extra_requirements = {
     "setup": setup_requirements,
+    "speedups": speedup_requirements,
+    "parquet": parquet_requirements,
     "test": test_requirements,
     "dev": dev_requirements,
     "all": [
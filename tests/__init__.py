@@ -1,3 +1,27 @@
 # -*- coding: utf-8 -*-
 
 """Unit test package for envoy_reader."""
+import json
+from pathlib import Path
+
+from envoy_reader.envoy_reader import EnvoySnapshot
+
+
+def fixtures_dir(version=None) -> Path:
+    """Return the fixtures directory, or the one of a firmware version."""
+    path = Path(__file__).parent / "fixtures"
+    return path if version is None else path / version
+
+
+def load_json_fixture(version, name) -> dict:
+    """Load a JSON fixture of a firmware version."""
+    with open(fixtures_dir(version) / name, "r") as read_in:
+        return json.load(read_in)
+
+
+def make_snapshot(production=5891, timestamp=1600000000.5, inverters=None, **fields):
+    """Build a snapshot with the daily production of the 4.2.27 fixture."""
+    fields.setdefault("daily_production", 17920)
+    return EnvoySnapshot(
+        production=production, timestamp=timestamp, inverters=inverters, **fields
+    )
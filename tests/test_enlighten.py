@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Tests for enlighten.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader.enlighten import (
+    LOGIN_URL,
+    TOKEN_URL,
+    EnlightenAuthError,
+    EnlightenSession,
+    parse_token_html,
+    tag_text,
+)
+from envoy_reader.envoy_reader import EnvoyReader
+
+from . import load_json_fixture
+
+
+def _token_for_request(request):
+    serial = dict(pair.split("=") for pair in request.content.decode().split("&")).get(
+        "serialNum"
+    )
+    return Response(200, text=f"<html><body><textarea>token-{serial}</textarea>")
+
+
+def test_parse_token_html():
+    """Verify the token is read from the entrez token page."""
+    assert parse_token_html("<body><textarea> abc </textarea></body>") == "abc"
+    assert parse_token_html("<body><p>Please log in</p></body>") is None
+    assert parse_token_html('<TEXTAREA id="t" rows=4>\n a&amp;b\n</TEXTAREA>') == "a&b"
+    assert tag_text("<h1>Envoy</h1><h2>Valid token.</h2>", "h2") == "Valid token."
+    assert tag_text("<h2><b>Valid</b> token.</h2 >", "h2") == "Valid token."
+    assert tag_text("<h20>x</h20>", "h2") is None
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_session_logs_in_once_for_many_tokens():
+    """Verify many tokens are fetched with a single login and bounded concurrency."""
+    in_flight = {"now": 0, "max": 0}
+
+    async def _token(request):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        return _token_for_request(request)
+
+    login_route = respx.post(LOGIN_URL).mock(
+        return_value=Response(200, headers={"Set-Cookie": "session=abc"})
+    )
+    token_route = respx.post(TOKEN_URL).mock(side_effect=_token)
+
+    async with EnlightenSession(
+        "user", "pass", max_concurrency=3, rate_limit=None
+    ) as session:
+        tokens = await session.async_get_tokens(
+            [f"1215000{idx:05}" for idx in range(20)], site_id="42"
+        )
+
+    assert login_route.call_count == 1
+    assert token_route.call_count == 20
+    assert in_flight["max"] == 3
+    assert tokens["121500000007"] == "token-121500000007"
+    assert token_route.calls.last.request.headers["cookie"] == "session=abc"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_session_sends_the_site_of_each_serial():
+    """Verify each serial number is sent with the site it is commissioned on."""
+    sites = {}
+
+    def _token(request):
+        form = dict(pair.split("=") for pair in request.content.decode().split("&"))
+        sites[form["serialNum"]] = form["Site"]
+        return _token_for_request(request)
+
+    respx.post(LOGIN_URL).mock(return_value=Response(200))
+    respx.post(TOKEN_URL).mock(side_effect=_token)
+
+    async with EnlightenSession("user", "pass", rate_limit=None) as session:
+        tokens = await session.async_get_tokens({"1215001": "11", "1215002": "12"})
+        assert tokens == {"1215001": "token-1215001", "1215002": "token-1215002"}
+        await session.async_get_tokens([("1215003", "13"), "1215004"], site_id="42")
+
+    assert sites == {"1215001": "11", "1215002": "12", "1215003": "13", "1215004": "42"}
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_session_logs_in_again_when_rejected():
+    """Verify an expired login is renewed once before giving up."""
+    login_route = respx.post(LOGIN_URL).mock(return_value=Response(200))
+    respx.post(TOKEN_URL).mock(
+        side_effect=[
+            Response(200, text="<p>Please log in</p>"),
+            Response(200, text="<textarea>fresh</textarea>"),
+            Response(302),
+            Response(302),
+        ]
+    )
+    session = EnlightenSession("user", "pass", rate_limit=None)
+
+    assert await session.async_get_token("1", "2") == "fresh"
+    assert login_route.call_count == 2
+    with pytest.raises(EnlightenAuthError):
+        await session.async_get_token("1", "2")
+    await session.aclose()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_readers_share_session():
+    """Verify readers sharing a session only log in once."""
+    version = "3.17.3"
+    login_route = respx.post(LOGIN_URL).mock(return_value=Response(200))
+    respx.post(TOKEN_URL).mock(side_effect=_token_for_request)
+    respx.get(path="/auth/check_jwt").mock(
+        return_value=Response(200, text="<h2>Valid token.</h2>")
+    )
+    respx.get(path="/info.xml").mock(return_value=Response(200, text=""))
+    respx.get(path="/production.json").mock(return_value=Response(404))
+    respx.get(path="/production").mock(return_value=Response(404))
+    respx.get(path="/api/v1/production").mock(
+        return_value=Response(200, json=load_json_fixture(version, "api_v1_production"))
+    )
+
+    session = EnlightenSession("user", "pass", rate_limit=None)
+    readers = [
+        EnvoyReader(
+            f"10.0.0.{idx}",
+            inverters=False,
+            commissioned="True",
+            enlighten_site_id="42",
+            enlighten_serial_num=str(idx),
+            enlighten_session=session,
+            https_flag="s",
+        )
+        for idx in range(5)
+    ]
+    await asyncio.gather(*(reader.getData() for reader in readers))
+
+    assert login_route.call_count == 1
+    assert [reader._token for reader in readers] == [f"token-{idx}" for idx in range(5)]
+    for reader in readers:
+        await reader.aclose()
+    await session.aclose()
@@ -1,23 +1,27 @@
 #!/usr/bin/env python
 """Tests for envoy_reader.py."""
 # -*- coding: utf-8 -*-
+import asyncio
 import json
-from pathlib import Path
+import re
+import subprocess
+import sys
 
+import httpx
 import pytest
 import respx
 from httpx import Response
 
-from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.envoy_reader import (
+    EnvoyReader,
+    EnvoySnapshot,
+    decode_json_orjson,
+    decode_json_stdlib,
+    parse_legacy_production,
+)
+from envoy_reader.retry import RetryPolicy
 
-
-def _fixtures_dir() -> Path:
-    return Path(__file__).parent / "fixtures"
-
-
-def _load_json_fixture(version, name) -> dict:
-    with open(_fixtures_dir() / version / name, "r") as read_in:
-        return json.load(read_in)
+from . import fixtures_dir, load_json_fixture
 
 
 @pytest.mark.asyncio
@@ -27,11 +31,11 @@ async def test_with_4_2_27_firmware():
     version = "4.2.27"
     respx.get("/info.xml").mock(return_value=Response(200, text=""))
     respx.get("/production.json").mock(
-        return_value=Response(200, json=_load_json_fixture(version, "production.json"))
+        return_value=Response(200, json=load_json_fixture(version, "production.json"))
     )
     respx.get("/api/v1/production").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production")
+            200, json=load_json_fixture(version, "api_v1_production")
         )
     )
 
@@ -57,16 +61,16 @@ async def test_with_5_0_49_firmware():
 
     respx.get("/info.xml").mock(return_value=Response(200, text=""))
     respx.get("/production.json").mock(
-        return_value=Response(200, json=_load_json_fixture(version, "production.json"))
+        return_value=Response(200, json=load_json_fixture(version, "production.json"))
     )
     respx.get("/api/v1/production").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production")
+            200, json=load_json_fixture(version, "api_v1_production")
         )
     )
     respx.get("/api/v1/production/inverters").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production_inverters")
+            200, json=load_json_fixture(version, "api_v1_production_inverters")
         )
     )
     reader = EnvoyReader("127.0.0.1", inverters=True)
@@ -105,12 +109,12 @@ async def test_with_3_9_36_firmware():
     respx.get("/production.json").mock(return_value=Response(404))
     respx.get("/api/v1/production").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production")
+            200, json=load_json_fixture(version, "api_v1_production")
         )
     )
     respx.get("/api/v1/production/inverters").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production_inverters")
+            200, json=load_json_fixture(version, "api_v1_production_inverters")
         )
     )
     reader = EnvoyReader("127.0.0.1", inverters=True)
@@ -149,12 +153,12 @@ async def test_with_3_17_3_firmware():
     respx.get("/production.json").mock(return_value=Response(404))
     respx.get("/api/v1/production").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production")
+            200, json=load_json_fixture(version, "api_v1_production")
         )
     )
     respx.get("/api/v1/production/inverters").mock(
         return_value=Response(
-            200, json=_load_json_fixture(version, "api_v1_production_inverters")
+            200, json=load_json_fixture(version, "api_v1_production_inverters")
         )
     )
     reader = EnvoyReader("127.0.0.1", inverters=True)
@@ -181,3 +185,459 @@ async def test_with_3_17_3_firmware():
     )
     assert await reader.lifetime_production() == 93706280
     assert isinstance(await reader.inverters_production(), dict)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_snapshot_decodes_each_body_once():
+    """Verify a poll decodes each endpoint once and accessors reuse the snapshot."""
+    version = "5.0.49"
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(
+        return_value=Response(200, json=load_json_fixture(version, "production.json"))
+    )
+    respx.get("/api/v1/production").mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production")
+        )
+    )
+    respx.get("/api/v1/production/inverters").mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production_inverters")
+        )
+    )
+    decoded = []
+
+    def _counting_decoder(content):
+        assert isinstance(content, bytes)
+        decoded.append(json.loads(content))
+        return decoded[-1]
+
+    reader = EnvoyReader("127.0.0.1", inverters=True, json_decoder=_counting_decoder)
+    await reader.getData()
+
+    decoded.clear()
+    snapshot = await reader.getData()
+    assert decoded == [
+        load_json_fixture(version, "api_v1_production"),
+        load_json_fixture(version, "api_v1_production_inverters"),
+    ]
+
+    decoded.clear()
+    assert await reader.production() == snapshot.production == 4859
+    assert await reader.daily_production() == 5046
+    assert await reader.lifetime_production() == 88742152
+    assert len(await reader.inverters_production()) == len(snapshot.inverters)
+    assert decoded == []
+    assert not any(isinstance(value, Response) for value in vars(reader).values())
+
+    with pytest.raises(AttributeError):
+        snapshot.production = 0
+    assert not hasattr(snapshot, "__dict__")
+    assert EnvoySnapshot(**snapshot.as_dict()) == snapshot
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_requests_isolate_inverter_errors():
+    """Verify endpoints are fetched concurrently, capped and fail independently."""
+    version = "3.9.36"
+    in_flight = {"now": 0, "max": 0}
+
+    def _tracked(response):
+        async def _side_effect(request):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            return response
+
+        return _side_effect
+
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(
+        side_effect=_tracked(
+            Response(200, json=load_json_fixture(version, "api_v1_production"))
+        )
+    )
+    inverters_route = respx.get("/api/v1/production/inverters").mock(
+        side_effect=_tracked(Response(401))
+    )
+
+    reader = EnvoyReader("127.0.0.1", inverters=True, concurrent_requests=True)
+    await reader.getData()
+    snapshot = await reader.getData()
+
+    assert in_flight["max"] == 2
+    assert snapshot.production == 1271
+    assert snapshot.inverters is None
+    assert isinstance(reader.endpoint_errors["inverters"], httpx.HTTPStatusError)
+
+    inverters_route.mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production_inverters")
+        )
+    )
+    await reader.getData()
+    assert reader.endpoint_errors == {}
+    assert isinstance(await reader.inverters_production(), dict)
+
+    # The limit is per Envoy, whichever endpoints are requested.
+    in_flight["max"] = 0
+    reader = EnvoyReader(
+        "127.0.0.1",
+        inverters=True,
+        concurrent_requests=True,
+        max_concurrent_requests=1,
+    )
+    await reader.getData()
+    await reader.getData()
+    assert in_flight["max"] == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_inverter_401_keeps_production_data():
+    """Verify an inverter 401 still raises but keeps the production values."""
+    version = "3.9.36"
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production")
+        )
+    )
+    respx.get("/api/v1/production/inverters").mock(return_value=Response(401))
+
+    reader = EnvoyReader("127.0.0.1", inverters=True)
+    with pytest.raises(httpx.HTTPStatusError):
+        await reader.getData()
+    assert await reader.production() == 1271
+    assert "inverters" in reader.endpoint_errors
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_detection_probes_run_concurrently():
+    """Verify detection probes endpoints at once and can be skipped on restart."""
+    version = "3.17.3"
+
+    def _slow(response):
+        async def _side_effect(request):
+            await asyncio.sleep(0.2)
+            return response
+
+        return _side_effect
+
+    info_route = respx.get("/info.xml").mock(
+        return_value=Response(200, text="<sn>121547060495</sn>")
+    )
+    json_route = respx.get("/production.json").mock(side_effect=_slow(Response(404)))
+    respx.get("/api/v1/production").mock(
+        side_effect=_slow(
+            Response(200, json=load_json_fixture(version, "api_v1_production"))
+        )
+    )
+    legacy_route = respx.get("/production").mock(
+        side_effect=_slow(Response(200, text=""))
+    )
+
+    reader = EnvoyReader("127.0.0.1", inverters=False)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await reader.getData()
+    assert loop.time() - start < 0.4
+    assert reader.endpoint_type == "P"
+    assert reader.password == "060495"
+
+    record = json.loads(json.dumps(reader.detection_record()))
+    assert record == {
+        "host": "127.0.0.1",
+        "endpoint_type": "P",
+        "is_metering_enabled": False,
+        "https": False,
+        "serial_number": "121547060495",
+    }
+
+    info_route.reset()
+    json_route.reset()
+    legacy_route.reset()
+    restored = EnvoyReader("127.0.0.1", inverters=False, detection_record=record)
+    assert restored.password == "060495"
+    snapshot = await restored.getData()
+    assert snapshot.production == 5463
+    assert not info_route.called
+    assert not json_route.called
+    assert not legacy_route.called
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_digest_auth_is_reused_across_polls():
+    """Verify only the first inverter poll pays the digest challenge."""
+    version = "3.9.36"
+    inverters = load_json_fixture(version, "api_v1_production_inverters")
+    challenge = 'Digest realm="enphaseenergy.com", nonce="abc123", qop="auth"'
+    nonce_counts = []
+
+    def _digest(request):
+        if "authorization" not in request.headers:
+            return Response(401, headers={"WWW-Authenticate": challenge})
+        nonce_counts.append(
+            re.search(r"nc=(\w+)", request.headers["authorization"]).group(1)
+        )
+        return Response(200, json=inverters)
+
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production")
+        )
+    )
+    inverters_route = respx.get("/api/v1/production/inverters").mock(
+        side_effect=_digest
+    )
+
+    reader = EnvoyReader("127.0.0.1", password="secret", inverters=True)
+    for _ in range(5):
+        await reader.getData()
+
+    assert inverters_route.call_count == 6
+    assert reader.digest_auth_stats == {"challenges": 1, "challenges_avoided": 4}
+    assert nonce_counts == [f"{count:08x}" for count in range(1, 6)]
+    assert isinstance(await reader.inverters_production(), dict)
+
+
+def _mock_timed_production(version, duration, starts):
+    """Mock a 3.9.36-style Envoy whose production endpoint takes ``duration``."""
+    production = load_json_fixture(version, "api_v1_production")
+
+    async def _production(request):
+        starts.append(asyncio.get_running_loop().time())
+        await asyncio.sleep(duration)
+        return Response(200, json=production)
+
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/production").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(side_effect=_production)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_stream_keeps_a_fixed_cadence():
+    """Verify stream() polls on fixed ticks regardless of poll duration."""
+    starts = []
+    _mock_timed_production("3.9.36", 0.02, starts)
+    reader = EnvoyReader("127.0.0.1", inverters=False)
+
+    snapshots = []
+    async for snapshot in reader.stream(0.1):
+        snapshots.append(snapshot)
+        if len(snapshots) == 4:
+            break
+
+    assert [snapshot.production for snapshot in snapshots] == [1271] * 4
+    # Skip the detection probe; every later poll starts on a 0.1 s tick.
+    ticks = [start - starts[1] for start in starts[1:]]
+    for idx, tick in enumerate(ticks):
+        assert tick == pytest.approx(idx * 0.1, abs=0.03)
+    assert reader.skipped_ticks == 0
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_stream_skips_overrun_ticks():
+    """Verify an overrunning poll skips ticks instead of queueing them."""
+    starts = []
+    _mock_timed_production("3.9.36", 0.13, starts)
+    reader = EnvoyReader("127.0.0.1", inverters=False)
+
+    stream = reader.stream(0.05)
+    await stream.__anext__()
+    await stream.__anext__()
+    await stream.aclose()
+
+    assert reader.skipped_ticks >= 2
+    gap = starts[-1] - starts[-2]
+    assert gap == pytest.approx(0.15, abs=0.03)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_stream_returns_exceptions():
+    """Verify failed polls can be yielded instead of ending the stream."""
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get(host="127.0.0.1").mock(side_effect=httpx.ConnectError("down"))
+    reader = EnvoyReader(
+        "127.0.0.1", inverters=False, retry_policy=RetryPolicy(backoff=0.001)
+    )
+
+    results = []
+    async for result in reader.stream(0.01, return_exceptions=True):
+        results.append(result)
+        if len(results) == 2:
+            break
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    with pytest.raises(RuntimeError):
+        async for result in reader.stream(0.01):
+            pass
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        path
+        for path in sorted(fixtures_dir().glob("*/*"))
+        if path.parent.name != "legacy"
+    ],
+    ids=lambda path: f"{path.parent.name}/{path.name}",
+)
+def test_json_decoders_agree(path):
+    """Verify the bytes decoders match stdlib json on every fixture."""
+    pytest.importorskip("orjson")
+    content = path.read_bytes()
+    expected = json.loads(content.decode())
+
+    assert decode_json_stdlib(content) == expected
+    assert decode_json_orjson(content) == expected
+
+
+def _load_text_fixture(version, name) -> str:
+    with open(fixtures_dir() / version / name, "r") as read_in:
+        return read_in.read()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_with_legacy_firmware():
+    """Verify with the HTML /production page of pre-R3.9 firmware."""
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(return_value=Response(404))
+    respx.get("/api/v1/production/inverters").mock(return_value=Response(404))
+    respx.get("/production").mock(
+        return_value=Response(200, text=_load_text_fixture("legacy", "production"))
+    )
+    reader = EnvoyReader("127.0.0.1", inverters=True)
+    await reader.getData()
+
+    assert reader.endpoint_type == "P0"
+    assert await reader.production() == 6630
+    assert await reader.daily_production() == 35400
+    assert await reader.seven_days_production() == 303000
+    assert await reader.lifetime_production() == 28300000
+    assert (
+        await reader.consumption()
+        == "Consumption data not available for your Envoy device."
+    )
+    assert await reader.inverters_production() is None
+
+
+def test_legacy_parser_units():
+    """Verify W/Wh and MW/MWh are normalized, including megawatts."""
+    text = _load_text_fixture("legacy", "production_large_site")
+    assert parse_legacy_production(text) == (1250000, 850, 41700000, 1204000000)
+    assert parse_legacy_production("<html></html>") == (None, None, None, None)
+
+
+async def _start_counting_server(routes):
+    """Start a keep-alive HTTP/1.1 server that counts accepted connections."""
+    stats = {"connections": 0, "requests": 0}
+
+    async def handle(reader, writer):
+        stats["connections"] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                stats["requests"] += 1
+                path = request_line.split()[1].decode()
+                status, body = routes.get(path, (404, b""))
+                writer.write(
+                    b"HTTP/1.1 %d X\r\nContent-Length: %d\r\n\r\n%s"
+                    % (status, len(body), body)
+                )
+                await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], stats
+
+
+@pytest.mark.asyncio
+async def test_poll_loop_reuses_one_connection():
+    """Verify repeated polls share a single keep-alive connection."""
+    version = "4.2.27"
+    routes = {
+        "/info.xml": (200, b""),
+        "/production.json": (
+            200,
+            json.dumps(load_json_fixture(version, "production.json")).encode(),
+        ),
+        "/api/v1/production": (
+            200,
+            json.dumps(load_json_fixture(version, "api_v1_production")).encode(),
+        ),
+    }
+    server, port, stats = await _start_counting_server(routes)
+    async with server:
+        async with EnvoyReader(f"127.0.0.1:{port}", inverters=False) as reader:
+            # Detection probes the candidate endpoints concurrently, which
+            # may open one connection per probe.
+            await reader.getData()
+            detection_connections = stats["connections"]
+            for _ in range(5):
+                await reader.getData()
+                assert await reader.production() == 5891
+
+        assert stats["requests"] >= 12
+        assert detection_connections <= 4
+        assert stats["connections"] == detection_connections
+        assert reader._async_client is None
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_injected_client_is_left_open():
+    """Verify a caller-provided client is not closed by the reader."""
+    version = "4.2.27"
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(
+        return_value=Response(200, json=load_json_fixture(version, "production.json"))
+    )
+    respx.get("/api/v1/production").mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production")
+        )
+    )
+
+    async with httpx.AsyncClient() as client:
+        async with EnvoyReader(
+            "127.0.0.1", inverters=False, async_client=client
+        ) as reader:
+            await reader.getData()
+            await reader.getData()
+        assert not client.is_closed
+        assert reader.async_client is client
+
+
+def test_optional_dependencies_are_imported_lazily():
+    """Verify importing the reader does not load token or password helpers."""
+    code = (
+        "import json, sys, envoy_reader.envoy_reader; "
+        "print(json.dumps([m for m in ('bs4', 'jwt', 'envoy_utils') "
+        "if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    assert json.loads(result.stdout) == []
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Tests for exporter.py."""
+# -*- coding: utf-8 -*-
+import httpx
+import pytest
+
+from envoy_reader.exporter import CONTENT_TYPE, EnvoyExporter
+from envoy_reader.fleet import EnvoyFleet
+from envoy_reader.instrumentation import PerfStats
+from envoy_reader.retry import RetryPolicy
+from envoy_reader.simulator import EnvoySimulator
+
+from . import fixtures_dir
+
+
+@pytest.mark.asyncio
+async def test_scrapes_are_served_from_memory():
+    """Verify polls render the metrics once and scrapes never reach the Envoys."""
+    stats = PerfStats()
+    simulator = EnvoySimulator(
+        fixtures_dir("5.0.49"),
+        inverter_count=3,
+        unreachable_hosts=["10.0.0.9"],
+    )
+    async with httpx.AsyncClient(transport=simulator) as client:
+        async with EnvoyFleet(
+            ["10.0.0.1", "10.0.0.9"],
+            async_client=client,
+            inverters=True,
+            retry_policy=RetryPolicy(attempts=1),
+            hooks=[stats],
+        ) as fleet:
+            exporter = EnvoyExporter(fleet, interval=60, stats=stats)
+            await exporter.poll()
+            requests = simulator.stats["requests"]
+
+            server = await exporter.serve("127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                async with httpx.AsyncClient() as scraper:
+                    for _ in range(3):
+                        response = await scraper.get(f"http://127.0.0.1:{port}/metrics")
+                    missing = await scraper.get(f"http://127.0.0.1:{port}/")
+
+    assert simulator.stats["requests"] == requests
+    assert exporter.scrapes == 3
+    assert missing.status_code == 404
+    assert response.headers["content-type"] == CONTENT_TYPE
+    text = response.text
+    assert text.endswith("# EOF\n")
+    lines = text.splitlines()
+    assert 'envoy_up{host="10.0.0.1"} 1' in lines
+    assert 'envoy_up{host="10.0.0.9"} 0' in lines
+    assert 'envoy_production_watts{host="10.0.0.1"} 4859' in lines
+    assert 'envoy_inverter_watts{host="10.0.0.1",serial="121900000002"} 2' in lines
+    assert 'envoy_polls_total{host="10.0.0.9",outcome="error"} 1' in lines
+    assert 'envoy_circuit_open{host="10.0.0.1"} 0' in lines
+    assert "# TYPE envoy_request_duration_seconds histogram" in lines
+    assert any(
+        line.startswith(
+            'envoy_request_duration_seconds_count{endpoint="/api/v1/production"}'
+        )
+        for line in lines
+    )
+    assert not any(line.startswith("envoy_consumption_watts{") for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_rendered_text_parses_as_openmetrics():
+    """Verify the exposition is accepted by an OpenMetrics parser."""
+    parser = pytest.importorskip("prometheus_client.openmetrics.parser")
+    stats = PerfStats()
+    simulator = EnvoySimulator(fixtures_dir("5.0.49"), inverter_count=3)
+    async with httpx.AsyncClient(transport=simulator) as client:
+        async with EnvoyFleet(
+            ["10.0.0.1", "10.0.0.2"], async_client=client, inverters=True, hooks=[stats]
+        ) as fleet:
+            exporter = EnvoyExporter(fleet, interval=60, stats=stats)
+            await exporter.poll()
+
+    families = {
+        family.name: family
+        for family in parser.text_string_to_metric_families(exporter.body.decode())
+    }
+    assert len(families["envoy_inverter_watts"].samples) == 6
+    assert len(families["envoy_inverter_last_report_timestamp_seconds"].samples) == 6
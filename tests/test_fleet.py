@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Tests for fleet.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+
+import httpx
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.fleet import EnvoyFleet, _percentile, parse_host_spec
+from envoy_reader.retry import RetryPolicy
+
+from . import load_json_fixture
+
+
+def _mock_envoy(host, version="3.9.36"):
+    respx.get(f"http://{host}/info.xml").mock(return_value=Response(200, text=""))
+    respx.get(f"http://{host}/production.json").mock(return_value=Response(404))
+    respx.get(f"http://{host}/api/v1/production").mock(
+        return_value=Response(200, json=load_json_fixture(version, "api_v1_production"))
+    )
+
+
+def test_percentile():
+    """Verify interpolated percentiles."""
+    assert _percentile([], 50) is None
+    assert _percentile([3.0], 95) == 3.0
+    assert _percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert _percentile(list(range(101)), 95) == 95
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_fleet_isolates_host_errors():
+    """Verify a dead or hung Envoy does not affect the rest of the round."""
+    for idx in range(5):
+        _mock_envoy(f"10.0.0.{idx}")
+    respx.get(host="10.0.1.1").mock(side_effect=httpx.ConnectError("down"))
+
+    async def _hang(request):
+        await asyncio.sleep(10)
+
+    respx.get(host="10.0.1.2").mock(side_effect=_hang)
+
+    hosts = [f"10.0.0.{idx}" for idx in range(5)]
+    hosts += ["10.0.1.1", {"host": "10.0.1.2", "timeout": 0.1}]
+    async with EnvoyFleet(
+        hosts,
+        max_concurrency=3,
+        inverters=False,
+        retry_policy=RetryPolicy(backoff=0.001),
+    ) as fleet:
+        fleet_round = await fleet.poll()
+
+    assert list(fleet_round.results) == [
+        "10.0.0.0",
+        "10.0.0.1",
+        "10.0.0.2",
+        "10.0.0.3",
+        "10.0.0.4",
+        "10.0.1.1",
+        "10.0.1.2",
+    ]
+    assert len(fleet_round.succeeded) == 5
+    assert isinstance(fleet_round.errors["10.0.1.1"], httpx.ConnectError)
+    assert isinstance(fleet_round.errors["10.0.1.2"], asyncio.TimeoutError)
+    assert fleet_round.results["10.0.0.3"].production == 1271
+    assert fleet_round.hosts_per_second > 0
+    assert fleet_round.latency_p50 <= fleet_round.latency_p95
+    assert fleet.last_round is fleet_round
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_fleet_shares_one_client():
+    """Verify readers created by the fleet share its connection pool."""
+    _mock_envoy("10.0.0.1")
+    existing = EnvoyReader("10.0.0.2")
+    fleet = EnvoyFleet(["10.0.0.1", existing], inverters=False)
+
+    assert fleet.readers["10.0.0.1"].async_client is fleet._async_client
+    assert fleet.readers["10.0.0.2"] is existing
+    await fleet.remove_host("10.0.0.2")
+    assert list(fleet.readers) == ["10.0.0.1"]
+    await fleet.aclose()
+    assert fleet._async_client.is_closed
+
+
+def test_parse_host_spec():
+    """Verify host arguments may carry the serial number and site for tokens."""
+    assert parse_host_spec("envoy") == {"host": "envoy"}
+    assert parse_host_spec("10.0.0.2=1215") == {
+        "host": "10.0.0.2",
+        "enlighten_serial_num": "1215",
+    }
+    assert parse_host_spec("10.0.0.3=1216:4242") == {
+        "host": "10.0.0.3",
+        "enlighten_serial_num": "1216",
+        "enlighten_site_id": "4242",
+    }
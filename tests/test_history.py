@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Tests for history.py."""
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.history import MISSING, SnapshotHistory
+
+from . import load_json_fixture, make_snapshot
+
+
+def test_rolling_stats_match_brute_force():
+    """Verify the O(1) rolling statistics against recomputing each window."""
+    rng = random.Random(1)
+    history = SnapshotHistory(50, windows=(1, 7, 50))
+    values = []
+    for idx in range(500):
+        value = rng.randint(0, 8000)
+        values.append(value)
+        history.append(make_snapshot(value), timestamp=float(idx))
+        for window in (1, 7, 50):
+            recent = values[-window:]
+            assert history.mean("production", window) == pytest.approx(
+                sum(recent) / len(recent)
+            )
+            assert history.min("production", window) == min(recent)
+            assert history.max("production", window) == max(recent)
+
+
+def test_missing_values_are_skipped():
+    """Verify values the Envoy did not report do not affect statistics."""
+    history = SnapshotHistory(4, windows=(4,))
+    history.append(make_snapshot(100, consumption=None))
+    history.append(make_snapshot(200, consumption=50))
+
+    assert history.mean("consumption", 4) == 50
+    assert history.min("consumption", 4) == 50
+    assert list(history.to_array("consumption")) == [MISSING["i"], 50]
+    assert history.mean("daily_consumption", 4) is None
+
+
+def test_export_is_zero_copy_and_ordered():
+    """Verify export() returns views over the ring in chronological order."""
+    history = SnapshotHistory(4)
+    for idx in range(6):
+        history.append(make_snapshot(idx, daily_production=idx * 10), timestamp=idx)
+
+    segments = history.export("production")
+    assert [list(segment) for segment in segments] == [[2, 3], [4, 5]]
+    assert segments[0].obj is history._columns["production"]
+    assert list(history.to_array("daily_production")) == [20, 30, 40, 50]
+    assert list(history.to_array()) == [2.0, 3.0, 4.0, 5.0]
+    assert len(history) == 4
+    assert history._columns["production"].itemsize == 4
+
+
+def test_invalid_windows():
+    """Verify windows must fit the history and be registered."""
+    with pytest.raises(ValueError):
+        SnapshotHistory(4, windows=(5,))
+    with pytest.raises(ValueError):
+        SnapshotHistory(4).mean("production", 2)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_appends_each_poll():
+    """Verify a reader with a history records every poll."""
+    version = "4.2.27"
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(
+        return_value=Response(200, json=load_json_fixture(version, "production.json"))
+    )
+    respx.get("/api/v1/production").mock(
+        return_value=Response(200, json=load_json_fixture(version, "api_v1_production"))
+    )
+    history = SnapshotHistory(10, windows=(3,))
+    reader = EnvoyReader("127.0.0.1", inverters=False, history=history)
+    for _ in range(3):
+        await reader.getData()
+
+    assert len(history) == 3
+    assert history.mean("consumption", 3) == 5811
+    assert history.max("daily_production", 3) == 17920
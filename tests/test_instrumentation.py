@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Tests for instrumentation.py."""
+# -*- coding: utf-8 -*-
+import httpx
+import pytest
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.instrumentation import Histogram, PerfStats
+from envoy_reader.simulator import EnvoySimulator
+
+from . import fixtures_dir
+from .test_envoy_reader import _start_counting_server
+
+
+def test_histogram():
+    """Verify bucket counts, quantiles and the summary."""
+    histogram = Histogram(buckets=(0.01, 0.1, 1))
+    for value in (0.005, 0.05, 0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.1) == 0.01
+    assert histogram.quantile(1) == 5
+    assert histogram.as_dict()["mean"] == pytest.approx(1.121)
+    assert Histogram().as_dict()["p95"] is None
+
+
+@pytest.mark.asyncio
+async def test_hooks_receive_every_event():
+    """Verify requests, probes, parsing and accessors are reported."""
+    events = []
+    stats = PerfStats()
+    simulator = EnvoySimulator(
+        fixtures_dir("5.0.49"),
+        serial_number="121500054321",
+        digest_auth=("envoy", "054321"),
+    )
+    async with httpx.AsyncClient(transport=simulator) as client:
+        reader = EnvoyReader(
+            "10.0.0.1",
+            inverters=True,
+            async_client=client,
+            hooks=[lambda event, fields: events.append((event, dict(fields))), stats],
+        )
+        await reader.getData()
+        await reader.getData()
+        await reader.production()
+        await reader.inverters_production()
+
+    kinds = {event for event, _ in events}
+    assert kinds == {"request", "detection_probe", "parse", "accessor"}
+    probes = [fields for event, fields in events if event == "detection_probe"]
+    assert {(probe["endpoint"], probe["status"]) for probe in probes} == {
+        ("/production.json", 200),
+        ("/api/v1/production", 200),
+        ("/production", 404),
+    }
+    request = next(
+        fields
+        for event, fields in events
+        if event == "request" and fields["endpoint"] == "/api/v1/production"
+    )
+    assert request["host"] == "10.0.0.1"
+    assert request["attempt"] == 1
+    assert request["bytes"] > 0
+    assert request["connect"] is None
+    assert events[-1][1]["model"] == "P"
+
+    assert stats.counters["request", "/api/v1/production/inverters", None, 200] == 2
+    assert stats.timings["parse", "/api/v1/production", None].count == 2
+    assert stats.timings["accessor", None, "inverters_production"].count == 1
+    assert stats.bytes["request", "/production.json", None] > 0
+    assert stats.summary()[0]["sum"] >= stats.summary()[-1]["sum"]
+
+
+@pytest.mark.asyncio
+async def test_connect_time_and_failures():
+    """Verify connect time is traced and failed requests are reported."""
+    events = []
+    server, port, _ = await _start_counting_server({"/api/v1/production": (200, b"{}")})
+    async with server:
+        async with EnvoyReader(
+            f"127.0.0.1:{port}",
+            password="123456",
+            detection_record={"endpoint_type": "P"},
+            hooks=[lambda event, fields: events.append(fields)],
+        ) as reader:
+            for _ in range(2):
+                await reader._update_endpoint("http{}://{}/api/v1/production")
+
+    assert events[0]["connect"] > 0
+    assert events[1]["connect"] == 0
+
+
+def test_failing_hook_does_not_break_polling(caplog):
+    """Verify an exception in a hook is logged and ignored."""
+
+    def _broken(event, fields):
+        raise ValueError
+
+    reader = EnvoyReader("10.0.0.1", hooks=[_broken])
+    reader._emit("accessor", name="production", elapsed=0)
+    assert "failed on accessor" in caplog.text
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Tests for inverters.py."""
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.inverters import InverterTable
+
+from . import load_json_fixture
+
+
+@pytest.mark.parametrize("version", ["3.9.36", "3.17.3", "5.0.49"])
+def test_table_matches_fixture(version):
+    """Verify the columns and aggregates against the raw inverter list."""
+    items = load_json_fixture(version, "api_v1_production_inverters")
+    table = InverterTable.from_json(items)
+    watts = [item["lastReportWatts"] for item in items]
+
+    assert len(table) == len(items)
+    assert table.total() == sum(watts)
+    assert table.mean() == pytest.approx(sum(watts) / len(watts))
+    assert table.min() == min(watts)
+    assert table.max() == max(watts)
+
+    first = items[0]
+    assert table.get(first["serialNumber"]) == (
+        first["lastReportWatts"],
+        first["lastReportDate"],
+    )
+    assert table.get("missing") is None
+    assert table.as_dict()[first["serialNumber"]] == [
+        first["lastReportWatts"],
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(first["lastReportDate"])),
+    ]
+    assert table.formatted_last_report(first["serialNumber"]) == (
+        table.as_dict()[first["serialNumber"]][1]
+    )
+
+
+def test_count_stale():
+    """Verify inverters that stopped reporting are counted."""
+    table = InverterTable(["a", "b", "c"], [10, 20, 30], [1000, 1500, 1900])
+
+    assert table.count_stale(600, now=2000) == 1
+    assert table.count_stale(100, now=2000) == 2
+    assert list(table) == [("a", 10, 1000), ("b", 20, 1500), ("c", 30, 1900)]
+
+
+def test_empty_table():
+    """Verify aggregates of a site without inverters."""
+    table = InverterTable.from_json([])
+
+    assert table.total() == 0
+    assert table.mean() is None
+    assert table.max() is None
+    assert table.as_dict() == {}
+
+
+def test_changes_since():
+    """Verify only new reports and appearing/disappearing inverters are listed."""
+    previous = InverterTable(["a", "b", "c"], [10, 20, 30], [1000, 1000, 1000])
+    current = InverterTable(["a", "b", "d"], [10, 25, 40], [1000, 1300, 1300])
+
+    changes = current.changes_since(previous)
+    assert list(changes.updated) == [("b", 25, 1300), ("d", 40, 1300)]
+    assert changes.added == ("d",)
+    assert changes.removed == ("c",)
+    assert changes
+
+    assert not current.changes_since(current)
+    first = current.changes_since(None)
+    assert first.added == current.serials
+    assert len(first.updated) == 3
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_reports_inverter_changes():
+    """Verify the reader exposes the inverter changes of each poll."""
+    version = "5.0.49"
+    items = load_json_fixture(version, "api_v1_production_inverters")
+    moved = [dict(item) for item in items]
+    moved[0]["lastReportDate"] += 300
+    moved[0]["lastReportWatts"] = 1
+
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(
+        return_value=Response(200, json=load_json_fixture(version, "api_v1_production"))
+    )
+    respx.get("/api/v1/production/inverters").mock(
+        side_effect=[
+            Response(200, json=items),
+            Response(200, json=items),
+            Response(200, json=moved[:-1]),
+        ]
+    )
+    reader = EnvoyReader("127.0.0.1", inverters=True)
+
+    await reader.getData()
+    assert len((await reader.inverters_changes()).added) == len(items)
+    await reader.getData()
+    assert not await reader.inverters_changes()
+    await reader.getData()
+    changes = await reader.inverters_changes()
+    assert list(changes.updated) == [
+        (moved[0]["serialNumber"], 1, moved[0]["lastReportDate"])
+    ]
+    assert changes.removed == (items[-1]["serialNumber"],)
+    await reader.getData(getInverters=False)
+    assert await reader.inverters_changes() is None
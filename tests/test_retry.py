@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""Tests for retry.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+
+import httpx
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader import retry
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.fleet import EnvoyFleet
+from envoy_reader.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_backoff_grows_with_jitter():
+    """Verify delays double up to the cap and jitter only shortens them."""
+    policy = RetryPolicy(backoff=1, max_backoff=5, jitter=0.5)
+    for _ in range(100):
+        assert 0.5 <= policy.delay(0) <= 1
+        assert 1 <= policy.delay(1) <= 2
+        assert 2.5 <= policy.delay(5) <= 5
+    assert RetryPolicy(backoff=1, jitter=0).delay(2) == 4
+    with pytest.raises(ValueError):
+        RetryPolicy(attempts=0)
+
+
+def test_breaker_opens_and_probes_once(monkeypatch):
+    """Verify the closed -> open -> half open -> closed cycle."""
+    clock = _Clock()
+    monkeypatch.setattr(retry.time, "monotonic", clock)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    assert breaker.as_dict() == {
+        "state": "open",
+        "failures": 2,
+        "rejected": 1,
+        "retry_in": 30,
+    }
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now += 30
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_breaker_without_threshold_stays_closed():
+    """Verify a breaker without a threshold never opens."""
+    breaker = CircuitBreaker(failure_threshold=None)
+    for _ in range(100):
+        breaker.record_failure()
+    assert not breaker.is_open
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_fails_fast_once_open(monkeypatch):
+    """Verify a dead Envoy is retried with backoff, then no longer requested."""
+    clock = _Clock()
+    monkeypatch.setattr(retry.time, "monotonic", clock)
+    route = respx.get(host="10.0.0.1").mock(side_effect=httpx.ConnectError("down"))
+    delays = []
+
+    async def _sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr("envoy_reader.envoy_reader.asyncio.sleep", _sleep)
+    reader = EnvoyReader(
+        "10.0.0.1",
+        password="123456",
+        retry_policy=RetryPolicy(attempts=3, backoff=1, jitter=0),
+        circuit_breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60),
+    )
+
+    with pytest.raises(RuntimeError):
+        await reader.getData()
+    assert route.call_count == 9
+    assert sorted(delays) == [1, 1, 1, 2, 2, 2]
+    assert reader.circuit_breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        await reader.getData()
+    assert route.call_count == 9
+
+    clock.now += 60
+    route.side_effect = lambda request: (
+        Response(200, json={"wattsNow": 1, "wattHoursToday": 2})
+        if request.url.path == "/api/v1/production"
+        else Response(404)
+    )
+    assert reader.circuit_breaker.state == "half_open"
+    snapshot = await reader.getData()
+    assert snapshot.production == 1
+    assert reader.circuit_breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+@respx.mock
+@pytest.mark.parametrize("password", ["", "123456"])
+async def test_slow_recovery_poll_closes_breaker(password):
+    """Verify detection waits for the half open probe instead of failing."""
+
+    async def _slow(request):
+        await asyncio.sleep(0.05)
+        if request.url.path == "/info.xml":
+            return Response(200, text="<sn>121547060495</sn>")
+        if request.url.path == "/api/v1/production":
+            return Response(200, json={"wattsNow": 1, "wattHoursToday": 2})
+        return Response(404)
+
+    respx.get(host="10.0.0.1").mock(side_effect=_slow)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    reader = EnvoyReader(
+        "10.0.0.1", password=password, inverters=False, circuit_breaker=breaker
+    )
+
+    snapshot = await reader.getData()
+    assert snapshot.production == 1
+    assert breaker.state == "closed"
+    assert breaker.rejected == 0
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_fleet_skips_open_hosts():
+    """Verify hosts with an open breaker fail without being polled."""
+    route = respx.get(host="10.0.1.1").mock(side_effect=httpx.ConnectError("down"))
+    async with EnvoyFleet(
+        ["10.0.1.1"],
+        inverters=False,
+        password="123456",
+        retry_policy=RetryPolicy(attempts=1),
+        circuit_breaker=CircuitBreaker(failure_threshold=1),
+    ) as fleet:
+        await fleet.poll()
+        calls = route.call_count
+        fleet_round = await fleet.poll()
+
+    assert route.call_count == calls
+    assert isinstance(fleet_round.errors["10.0.1.1"], CircuitOpenError)
+    assert fleet.circuit_states() == {"10.0.1.1": "open"}
+    assert fleet_round.latencies == {}
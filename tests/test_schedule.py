@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+"""Tests for schedule.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from envoy_reader.schedule import TickSchedule
+
+
+@pytest.mark.asyncio
+async def test_ticks_keep_their_cadence_and_skip_overruns():
+    """Verify ticks do not drift and an overrun skips the missed ticks."""
+    loop = asyncio.get_running_loop()
+    ticks = TickSchedule(0.1)
+    start = loop.time()
+
+    await asyncio.sleep(0.03)
+    assert await ticks.wait() == 0
+    assert loop.time() - start == pytest.approx(0.1, abs=0.03)
+
+    await asyncio.sleep(0.25)
+    assert await ticks.wait() == 2
+    assert loop.time() - start == pytest.approx(0.4, abs=0.03)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""Tests for sharding.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+from multiprocessing.connection import Connection
+
+import jwt
+import pytest
+
+from envoy_reader.envoy_reader import EnvoySnapshot
+from envoy_reader.fleet import FleetRound
+from envoy_reader.retry import RetryPolicy
+from envoy_reader.sharding import (
+    COMMAND_ADD,
+    COMMAND_POLL,
+    COMMAND_REMOVE,
+    COMMAND_STOP,
+    RemotePollError,
+    ShardedFleet,
+    WorkerError,
+    _serve_worker,
+    balance_hosts,
+    decode_round,
+    encode_round,
+    plan_moves,
+)
+from envoy_reader.simulator import EnvoySimulator
+
+from . import fixtures_dir
+
+FIXTURE_DIR = fixtures_dir("5.0.49")
+
+
+class _ThreadProcess(threading.Thread):
+    """A worker thread standing in for a worker process."""
+
+    pid = None
+
+
+class _ThreadContext:
+    """Run workers as threads, so a test sees their transport and session."""
+
+    Pipe = staticmethod(multiprocessing.Pipe)
+
+    @staticmethod
+    def Process(target, args, name, daemon):  # pylint: disable=invalid-name
+        # The parent closes its copy of the child's end, as after a spawn.
+        conn = Connection(os.dup(args[0].fileno()))
+        return _ThreadProcess(
+            target=target, args=(conn, *args[1:]), name=name, daemon=daemon
+        )
+
+
+class _CountingSession:
+    """Enlighten session handing out one token and counting the requests."""
+
+    def __init__(self, token):
+        self.token = token
+        self.calls = 0
+
+    async def async_get_token(self, serial_num, site_id=None, commissioned=False):
+        self.calls += 1
+        return self.token
+
+
+def test_round_message_round_trip():
+    """Verify readings, errors and latencies survive the trip to the parent."""
+    snapshot = EnvoySnapshot(timestamp=1600000000.5, production=5891)
+    fleet_round = decode_round(
+        encode_round(
+            FleetRound(
+                {"a": snapshot, "b": ConnectionError("refused\0 twice"), "c": snapshot},
+                {"a": 0.25, "b": 1.5},
+                2.0,
+            )
+        )
+    )
+    assert list(fleet_round.results) == ["a", "b", "c"]
+    assert fleet_round.results["a"] == snapshot
+    error = fleet_round.results["b"]
+    assert isinstance(error, RemotePollError)
+    assert error.error_type == "ConnectionError"
+    assert str(error) == "ConnectionError: refused\0 twice"
+    assert fleet_round.latencies == {"a": 0.25, "b": 1.5}
+    assert fleet_round.elapsed == 2.0
+
+
+def test_balance_by_cost():
+    """Verify hosts are spread by cost and only moved when out of balance."""
+    costs = {"a": 8, "b": 4, "c": 3, "d": 3, "e": 1, "f": 1}
+    shards = balance_hosts(costs, 2)
+    assert [sum(costs[host] for host in shard) for shard in shards] == [10, 10]
+    assert plan_moves(shards, costs) == []
+
+    moves = plan_moves([["a", "b", "c", "d"], ["e", "f"]], costs)
+    shards = [{"a", "b", "c", "d"}, {"e", "f"}]
+    for host, source, target in moves:
+        shards[source].remove(host)
+        shards[target].add(host)
+    loads = [sum(costs[host] for host in shard) for shard in shards]
+    assert max(loads) <= 1.25 * 10
+    assert len(moves) <= 2
+
+
+@pytest.mark.asyncio
+async def test_sharded_fleet_restarts_and_rebalances():
+    """Verify workers poll their shards, are restarted and share the load."""
+    hosts = [f"10.0.0.{idx}" for idx in range(1, 7)]
+    fleet = ShardedFleet(
+        hosts + ["10.0.0.99"],
+        workers=2,
+        transport=EnvoySimulator(FIXTURE_DIR, unreachable_hosts=["10.0.0.99"]),
+        retry_policy=RetryPolicy(attempts=1),
+        inverters=False,
+    )
+    async with fleet:
+        fleet_round = await fleet.poll()
+        assert set(fleet_round.succeeded) == set(hosts)
+        assert fleet_round.succeeded["10.0.0.1"].production == 4859
+        assert isinstance(fleet_round.results["10.0.0.99"], RemotePollError)
+        assert sorted(sum(fleet.shards, [])) == sorted(fleet.hosts)
+
+        # A worker that died fails its hosts for one round and is restarted.
+        killed = fleet._workers[0]
+        killed.process.kill()
+        killed.process.join()
+        fleet_round = await fleet.poll()
+        assert all(
+            isinstance(fleet_round.results[host], WorkerError) for host in killed.hosts
+        )
+        assert fleet.restarts == 1
+        assert set((await fleet.poll()).succeeded) == set(hosts)
+
+        pid = fleet.pids[1]
+        await fleet.restart_worker(1)
+        assert fleet.pids[1] != pid
+        assert set((await fleet.poll()).succeeded) == set(hosts)
+
+        # Make the first shard far more costly than the second.
+        for host in fleet.shards[0]:
+            fleet.costs[host] = 100.0
+        before = fleet.shards
+        await fleet.poll()
+        assert fleet.moves > 0
+        assert fleet.shards != before
+        assert set((await fleet.poll()).succeeded) == set(hosts)
+
+
+@pytest.mark.asyncio
+async def test_moved_host_keeps_its_detection():
+    """Verify a host removed from one worker is added to another as detected."""
+    simulator = EnvoySimulator(FIXTURE_DIR, serial_number="121500054321")
+    loop = asyncio.get_running_loop()
+    fleet_kwargs = {
+        "max_concurrency": 5,
+        "timeout": 10,
+        "reader_kwargs": {"inverters": False},
+    }
+    parent_conn, child_conn = multiprocessing.Pipe()
+    worker = asyncio.ensure_future(
+        _serve_worker(child_conn, ["10.0.0.1"], fleet_kwargs, simulator)
+    )
+
+    async def _command(command, argument=None, reply=None):
+        parent_conn.send((command, argument))
+        if reply is not None:
+            return await loop.run_in_executor(None, reply)
+
+    try:
+        await _command(COMMAND_POLL, reply=parent_conn.recv_bytes)
+        states = await _command(COMMAND_REMOVE, ["10.0.0.1"], reply=parent_conn.recv)
+        await _command(COMMAND_ADD, [({"host": "10.0.0.1"}, states["10.0.0.1"])])
+        requests = simulator.stats["requests"]
+        fleet_round = decode_round(
+            await _command(COMMAND_POLL, reply=parent_conn.recv_bytes)
+        )
+    finally:
+        await _command(COMMAND_STOP)
+        await worker
+
+    assert states["10.0.0.1"]["detection"]["endpoint_type"] == "P"
+    assert states["10.0.0.1"]["password"] == "054321"
+    assert fleet_round.succeeded["10.0.0.1"].production == 4859
+    assert simulator.stats["requests"] - requests == 1
+
+
+@pytest.mark.asyncio
+async def test_recycled_worker_keeps_detection_and_token():
+    """Verify a replaced worker neither detects the model nor logs in again."""
+    token = jwt.encode({"exp": int(time.time() + 3600)}, "sharding-test-signing-key-000000")
+    simulator = EnvoySimulator(FIXTURE_DIR, token=token)
+    session = _CountingSession(token)
+    fleet = ShardedFleet(
+        ["10.0.0.1"],
+        workers=1,
+        recycle_after=1,
+        transport=simulator,
+        mp_context=_ThreadContext(),
+        inverters=False,
+        https_flag="s",
+        enlighten_session=session,
+    )
+    async with fleet:
+        assert set((await fleet.poll()).succeeded) == {"10.0.0.1"}
+        assert fleet.restarts == 1
+        requests = dict(simulator.stats)
+
+        assert set((await fleet.poll()).succeeded) == {"10.0.0.1"}
+        assert fleet.restarts == 2
+
+    assert session.calls == 1
+    for path in ("/info.xml", "/production.json", "/auth/check_jwt"):
+        assert simulator.stats[path] == requests.get(path, 0)
+
+
+@pytest.mark.asyncio
+async def test_failed_polls_do_not_count_as_cost():
+    """Verify an unreachable host's polls leave its cost unknown."""
+    fleet = ShardedFleet(
+        ["10.0.0.1", "10.0.0.99"],
+        workers=1,
+        transport=EnvoySimulator(FIXTURE_DIR, unreachable_hosts=["10.0.0.99"]),
+        mp_context=_ThreadContext(),
+        retry_policy=RetryPolicy(attempts=2, backoff=0.2, jitter=0),
+        inverters=False,
+    )
+    async with fleet:
+        fleet_round = await fleet.poll()
+
+    assert isinstance(fleet_round.results["10.0.0.99"], RemotePollError)
+    assert fleet_round.latencies["10.0.0.99"] >= 0.2
+    assert set(fleet.costs) == {"10.0.0.1"}
+
+
+@pytest.mark.asyncio
+async def test_worker_that_does_not_answer_is_restarted():
+    """Verify a worker stuck past the round timeout fails its round."""
+    simulator = EnvoySimulator(FIXTURE_DIR, latency=1.0)
+    fleet = ShardedFleet(
+        ["10.0.0.1"],
+        workers=1,
+        transport=simulator,
+        mp_context=_ThreadContext(),
+        round_timeout=0.3,
+        inverters=False,
+    )
+    async with fleet:
+        fleet_round = await fleet.poll()
+        error = fleet_round.results["10.0.0.1"]
+        assert isinstance(error, WorkerError)
+        assert str(error) == "Worker 0 did not answer in time"
+        assert fleet.restarts == 1
+
+        simulator.latency = 0
+        assert set((await fleet.poll()).succeeded) == {"10.0.0.1"}
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Tests for simulator.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+
+import httpx
+import pytest
+
+from envoy_reader.envoy_reader import EnvoyReader, SwitchToHTTPS
+from envoy_reader.fleet import EnvoyFleet
+from envoy_reader.retry import RetryPolicy
+from envoy_reader.simulator import EnvoySimulator
+
+from . import fixtures_dir
+
+
+@pytest.mark.asyncio
+async def test_reader_polls_simulated_envoy():
+    """Verify a reader detects and polls the simulator, digest auth included."""
+    simulator = EnvoySimulator(
+        fixtures_dir("5.0.49"),
+        serial_number="121500054321",
+        inverter_count=1500,
+        digest_auth=("envoy", "054321"),
+    )
+    async with httpx.AsyncClient(transport=simulator) as client:
+        reader = EnvoyReader("192.168.1.2", inverters=True, async_client=client)
+        await reader.getData()
+        await reader.getData()
+
+    assert await reader.production() == 4859
+    assert len(await reader.inverters_production()) == 1500
+    assert simulator.stats["digest_challenges"] == 1
+    assert reader.digest_auth_stats == {"challenges": 1, "challenges_avoided": 1}
+
+
+@pytest.mark.asyncio
+async def test_wrong_digest_password_is_rejected():
+    """Verify the inverters endpoint only accepts the configured credentials."""
+    simulator = EnvoySimulator(fixtures_dir("5.0.49"), digest_auth=("envoy", "nope"))
+    async with httpx.AsyncClient(transport=simulator) as client:
+        reader = EnvoyReader("192.168.1.2", inverters=True, async_client=client)
+        with pytest.raises(httpx.HTTPStatusError):
+            await reader.getData()
+
+
+@pytest.mark.asyncio
+async def test_latency_timeouts_and_errors():
+    """Verify latency is simulated and slower answers time out."""
+    simulator = EnvoySimulator(
+        fixtures_dir("3.17.3"),
+        latency={"/api/v1/production": 0.05, "/production": 1},
+        error_rate={"/production.json": 1},
+    )
+    async with httpx.AsyncClient(transport=simulator) as client:
+        start = asyncio.get_running_loop().time()
+        response = await client.get("http://envoy/api/v1/production")
+        assert asyncio.get_running_loop().time() - start >= 0.05
+        assert response.status_code == 200
+
+        with pytest.raises(httpx.ReadTimeout):
+            await client.get("http://envoy/production", timeout=0.01)
+        assert (await client.get("http://envoy/production.json")).status_code == 500
+
+    assert simulator.stats["timeouts"] == 1
+    assert simulator.stats["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_https_only_redirects():
+    """Verify plain HTTP is redirected, as on firmware that requires HTTPS."""
+    simulator = EnvoySimulator(fixtures_dir("5.0.49"), https_only=True, token="abc")
+    async with httpx.AsyncClient(transport=simulator) as client:
+        reader = EnvoyReader("192.168.1.2", async_client=client)
+        with pytest.raises(SwitchToHTTPS):
+            await reader.check_connection()
+
+        response = await client.get("https://envoy/auth/check_jwt")
+        assert response.status_code == 401
+        response = await client.get(
+            "https://envoy/auth/check_jwt", headers={"Authorization": "Bearer abc"}
+        )
+        assert "Valid token." in response.text
+
+
+@pytest.mark.asyncio
+async def test_fleet_with_unreachable_hosts():
+    """Verify unreachable hosts fail while the rest of the fleet is polled."""
+    hosts = [f"10.0.0.{idx}" for idx in range(20)]
+    simulator = EnvoySimulator(
+        fixtures_dir("3.9.36"), latency=0.01, unreachable_hosts=hosts[:2]
+    )
+    async with httpx.AsyncClient(transport=simulator) as client:
+        async with EnvoyFleet(
+            hosts,
+            async_client=client,
+            inverters=False,
+            retry_policy=RetryPolicy(backoff=0.001),
+        ) as fleet:
+            fleet_round = await fleet.poll()
+
+    assert len(fleet_round.succeeded) == 18
+    assert set(fleet_round.errors) == set(hosts[:2])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Tests for sinks.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+import csv
+import io
+import json
+import threading
+
+import pytest
+
+from envoy_reader.inverters import InverterTable
+from envoy_reader.sinks import (
+    BatchSink,
+    CsvSink,
+    LineProtocolSink,
+    NdjsonSink,
+    ParquetSink,
+)
+
+from . import make_snapshot
+
+
+def _inverters():
+    return InverterTable(
+        ["121900000001", "121900000002"], [250, 0], [1600000000, 1599990000]
+    )
+
+
+class _RecordingSink(BatchSink):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.threads = set()
+
+    def write_batch(self, snapshot_rows, inverter_rows):
+        self.threads.add(threading.get_ident())
+        self.batches.append((snapshot_rows, inverter_rows))
+
+
+@pytest.mark.asyncio
+async def test_line_protocol():
+    """Verify snapshots and inverters are written as escaped points."""
+    stream = io.StringIO()
+    async with LineProtocolSink(stream) as sink:
+        sink.add("envoy 1", make_snapshot(inverters=_inverters()))
+        sink.add("envoy,2", make_snapshot(production=None))
+
+    assert stream.getvalue().splitlines() == [
+        r"envoy,host=envoy\ 1 production=5891i,daily_production=17920i 1600000000",
+        r"envoy,host=envoy\,2 daily_production=17920i 1600000000",
+        r"envoy_inverter,host=envoy\ 1,serial=121900000001 watts=250i 1600000000",
+        r"envoy_inverter,host=envoy\ 1,serial=121900000002 watts=0i 1599990000",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batches_by_size_and_age_off_the_loop():
+    """Verify batches are written when full or old, in an executor thread."""
+    sink = _RecordingSink(max_batch=3, max_age=0.05)
+    sink.add("a", make_snapshot(inverters=_inverters()))
+    assert len(sink) == 3
+    await asyncio.sleep(0.01)
+    assert len(sink.batches) == 1
+    assert len(sink) == 0
+
+    sink.add("b", make_snapshot())
+    await asyncio.sleep(0.01)
+    assert len(sink.batches) == 1
+    await asyncio.sleep(0.1)
+    assert len(sink.batches) == 2
+    assert sink.batches[1][0][0][:3] == ("b", 1600000000.5, 5891)
+
+    await sink.aclose()
+    assert threading.get_ident() not in sink.threads
+    assert sink.rows_written == 4
+
+
+@pytest.mark.asyncio
+async def test_write_is_immediate_and_raises():
+    """Verify write() sends one batch now and reports a failed write."""
+    sink = _RecordingSink()
+    await sink.write([("a", make_snapshot(inverters=_inverters())), ("b", make_snapshot())])
+    assert len(sink.batches) == 1
+    assert [row[0] for row in sink.batches[0][0]] == ["a", "b"]
+    assert len(sink.batches[0][1]) == 2
+    assert len(sink) == 0
+
+    sink.write_batch = None
+    with pytest.raises(TypeError):
+        await sink.write([("c", make_snapshot())])
+    assert sink.rows_written == 4
+
+
+@pytest.mark.asyncio
+async def test_ndjson_from_inverters_production():
+    """Verify the dict of inverters_production() is accepted."""
+    table = _inverters()
+    stream = io.StringIO()
+    async with NdjsonSink(stream) as sink:
+        sink.add("envoy", make_snapshot(), inverters=table.as_dict())
+
+    rows = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert rows[0]["type"] == "snapshot"
+    assert rows[0]["production"] == 5891
+    assert rows[0]["consumption"] is None
+    assert rows[1] == {
+        "type": "inverter",
+        "host": "envoy",
+        "serial": "121900000001",
+        "last_report": 1600000000,
+        "watts": 250,
+    }
+
+
+@pytest.mark.asyncio
+async def test_csv_appends_with_one_header(tmp_path):
+    """Verify reopened CSV files are appended to without a second header."""
+    for _ in range(2):
+        async with CsvSink(
+            tmp_path / "snapshots.csv", inverters_target=tmp_path / "inverters.csv"
+        ) as sink:
+            sink.add("envoy", make_snapshot(inverters=_inverters()))
+
+    with open(tmp_path / "snapshots.csv", newline="") as read_in:
+        rows = list(csv.reader(read_in))
+    assert rows[0][:3] == ["host", "timestamp", "production"]
+    assert len(rows) == 3
+    with open(tmp_path / "inverters.csv", newline="") as read_in:
+        assert len(list(csv.reader(read_in))) == 5
+
+
+@pytest.mark.asyncio
+async def test_parquet(tmp_path):
+    """Verify each batch becomes a row group of a Parquet file."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    async with ParquetSink(
+        tmp_path / "snapshots.parquet",
+        inverters_path=tmp_path / "inverters.parquet",
+        max_batch=1,
+    ) as sink:
+        sink.add("envoy", make_snapshot(inverters=_inverters()))
+        await sink.flush()
+        sink.add("envoy", make_snapshot(production=None))
+
+    table = pq.read_table(tmp_path / "snapshots.parquet")
+    assert table.column("production").to_pylist() == [5891, None]
+    assert pq.read_table(tmp_path / "inverters.parquet").num_rows == 2
+
+
+def test_parquet_needs_pyarrow():
+    """Verify a missing pyarrow is reported when the sink is created."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        with pytest.raises(ImportError, match="pyarrow"):
+            ParquetSink("out.parquet")
+    else:
+        pytest.skip("pyarrow is installed")
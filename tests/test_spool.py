@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""Tests for spool.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+
+import pytest
+
+from envoy_reader.envoy_reader import EnvoySnapshot
+from envoy_reader.inverters import InverterTable
+from envoy_reader.spool import SnapshotSpool, decode_record, encode_record
+
+from . import make_snapshot
+
+
+def _snapshot(**fields):
+    return make_snapshot(
+        endpoint_type="PC",
+        is_metering_enabled=True,
+        lifetime_production=2**40,
+        **fields,
+    )
+
+
+def _readings(count, start=0):
+    return [
+        (f"envoy-{idx % 3}", _snapshot(production=idx)) for idx in range(start, count)
+    ]
+
+
+def _productions(readings):
+    return [snapshot.production for _, snapshot in readings]
+
+
+class _FlakySink:
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.readings = []
+
+    async def write(self, readings):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database down")
+        self.readings.extend(readings)
+
+
+def test_record_round_trip():
+    """Verify readings survive encoding, including missing values."""
+    inverters = InverterTable(
+        ["121900000001", "121900000002"], [250, -1], [1600000000, 1599990000]
+    )
+    full = EnvoySnapshot(
+        timestamp=1600000000.25,
+        endpoint_type="P",
+        is_metering_enabled=False,
+        production=-5,
+        consumption=300,
+        battery_storage={"percentFull": 42, "whNow": 1200},
+        inverters=inverters,
+    )
+    for snapshot in (
+        full,
+        EnvoySnapshot(),
+        _snapshot(inverters=InverterTable([], [], [])),
+    ):
+        host, decoded = decode_record(encode_record("envoy.local", snapshot))
+        assert host == "envoy.local"
+        assert decoded == snapshot
+
+    assert len(encode_record("envoy", _snapshot())) < 60
+
+
+def test_replay_in_order_across_segments_and_restarts(tmp_path):
+    """Verify readings are replayed in order until committed, after reopening."""
+    with SnapshotSpool(tmp_path, segment_size=1024, max_bytes=None) as spool:
+        spool.extend(_readings(50))
+        for host, snapshot in _readings(100, 50):
+            spool.append(host, snapshot)
+        assert len(os.listdir(tmp_path)) > 3
+        assert _productions(spool.read(30)) == list(range(30))
+        spool.commit()
+        assert _productions(spool.read(10)) == list(range(30, 40))
+        spool.rewind()
+
+    with SnapshotSpool(tmp_path, segment_size=1024, max_bytes=None) as spool:
+        assert len(spool) == 70
+        readings = spool.read(1000)
+        assert _productions(readings) == list(range(30, 100))
+        assert readings[1] == ("envoy-1", _snapshot(production=31))
+        spool.commit()
+        assert len(spool) == 0
+        assert spool.read() == []
+        segments = [name for name in os.listdir(tmp_path) if name.endswith(".seg")]
+        assert len(segments) == 1
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    """Verify a record torn by a crash is dropped and appending continues."""
+    with SnapshotSpool(tmp_path) as spool:
+        spool.extend(_readings(3))
+    (segment,) = [path for path in tmp_path.iterdir() if path.suffix == ".seg"]
+    size = segment.stat().st_size
+    with open(segment, "r+b") as torn:
+        torn.truncate(size - 5)
+
+    with SnapshotSpool(tmp_path) as spool:
+        assert len(spool) == 2
+        spool.append("envoy-9", _snapshot(production=9))
+        assert _productions(spool.read()) == [0, 1, 9]
+
+
+def test_corrupt_record_skips_the_rest_of_its_segment(tmp_path):
+    """Verify the readings after a corrupt record are counted and committed."""
+    with SnapshotSpool(tmp_path, segment_size=1024, max_bytes=None) as spool:
+        spool.extend(_readings(20))
+        spool.extend(_readings(120, 20))
+        first = min(path for path in tmp_path.iterdir() if path.suffix == ".seg")
+        with open(first, "r+b") as corrupt:
+            corrupt.seek(100)
+            byte = corrupt.read(1)
+            corrupt.seek(100)
+            corrupt.write(bytes([byte[0] ^ 0xFF]))
+
+        readings = _productions(spool.read(1000))
+        assert readings[-100:] == list(range(20, 120))
+        assert len(readings) + spool.skipped == 120
+        spool.rewind()
+        spool.read(1000)
+        assert len(readings) + spool.skipped == 120
+        spool.commit()
+        assert len(spool) == 0
+
+    with SnapshotSpool(tmp_path, segment_size=1024, max_bytes=None) as spool:
+        assert len(spool) == 0
+        assert spool.read() == []
+
+
+def test_oldest_segments_are_evicted(tmp_path):
+    """Verify the spool stays within max_bytes by dropping the oldest readings."""
+    with SnapshotSpool(tmp_path, segment_size=1024, max_bytes=4096) as spool:
+        spool.extend(_readings(10))
+        assert _productions(spool.read(5)) == list(range(5))
+        for host, snapshot in _readings(1000, 10):
+            spool.append(host, snapshot)
+        assert spool.disk_usage <= 4096
+        assert spool.evicted > 0
+        assert len(spool) + spool.evicted == 1000
+
+        readings = _productions(spool.read(1000))
+        assert readings == list(range(1000 - len(readings), 1000))
+
+
+@pytest.mark.asyncio
+async def test_drain_keeps_readings_the_sink_rejected(tmp_path):
+    """Verify a failed write leaves the readings spooled for the next drain."""
+    sink = _FlakySink()
+    with SnapshotSpool(tmp_path, sync_interval=0) as spool:
+        spool.extend(_readings(12))
+        with pytest.raises(ConnectionError):
+            await spool.drain(sink, batch_size=5)
+        assert len(spool) == 12
+
+        assert await spool.drain(sink, batch_size=5) == 12
+        assert _productions(sink.readings) == list(range(12))
+        assert len(spool) == 0
+        assert await spool.drain(sink) == 0
+
+
+@pytest.mark.asyncio
+async def test_sync_runs_when_the_interval_is_up(tmp_path, monkeypatch):
+    """Verify the last appended readings are fsynced without another append."""
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(
+        os, "fsync", lambda handle: synced.append(handle) or real_fsync(handle)
+    )
+    with SnapshotSpool(tmp_path, sync_interval=0.05) as spool:
+        synced.clear()
+        spool.append("envoy", _snapshot())
+        assert not synced
+
+        await asyncio.sleep(0.15)
+        assert synced == [spool._handle]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Tests for state.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import stat
+
+import httpx
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.retry import RetryPolicy
+from envoy_reader.state import JsonFileStateStore
+
+from . import load_json_fixture
+
+
+def test_json_file_store_round_trip(tmp_path):
+    """Verify states survive a reload and stale states are ignored."""
+    path = tmp_path / "state.json"
+    store = JsonFileStateStore(str(path))
+    store.save("envoy", {"detection": {"endpoint_type": "P"}})
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert sorted(os.listdir(tmp_path)) == ["state.json", "state.json.lock"]
+
+    reloaded = JsonFileStateStore(str(path))
+    assert reloaded.load("envoy")["detection"] == {"endpoint_type": "P"}
+    assert reloaded.load("other") is None
+    assert JsonFileStateStore(str(path), max_age=-1).load("envoy") is None
+
+    reloaded.delete("envoy")
+    assert JsonFileStateStore(str(path)).load("envoy") is None
+
+
+def test_json_file_store_merges_with_other_writers(tmp_path):
+    """Verify stores sharing a file keep each other's hosts."""
+    path = str(tmp_path / "state.json")
+    first = JsonFileStateStore(path)
+    second = JsonFileStateStore(path)
+    first.save("envoy-a", {"password": "a"})
+    second.save("envoy-b", {"password": "b"})
+    first.delete("envoy-a")
+    first.save("envoy-c", {"password": "c"})
+
+    reloaded = JsonFileStateStore(path)
+    assert reloaded.load("envoy-a") is None
+    assert reloaded.load("envoy-b")["password"] == "b"
+    assert reloaded.load("envoy-c")["password"] == "c"
+
+
+@pytest.mark.asyncio
+async def test_json_file_store_batches_writes_on_a_loop(tmp_path):
+    """Verify saves on a running loop are written together, off the loop."""
+    path = str(tmp_path / "state.json")
+    store = JsonFileStateStore(path, write_delay=0.05)
+    for index in range(10):
+        store.save("envoy-%d" % index, {"password": str(index)})
+    assert store.writes == 0
+    assert not os.path.exists(path)
+
+    await asyncio.sleep(0.2)
+    assert store.writes == 1
+    assert JsonFileStateStore(path).load("envoy-9")["password"] == "9"
+
+    store.save("envoy-0", {"password": "changed"})
+    await store.aflush()
+    assert store.writes == 2
+    assert JsonFileStateStore(path).load("envoy-0")["password"] == "changed"
+
+
+def test_json_file_store_ignores_corrupt_file(tmp_path):
+    """Verify a corrupt state file is treated as empty."""
+    path = tmp_path / "state.json"
+    path.write_text("{not json")
+    assert JsonFileStateStore(str(path)).load("envoy") is None
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_warm_starts_from_store(tmp_path):
+    """Verify a restarted reader skips serial lookup and detection."""
+    version = "3.17.3"
+    info_route = respx.get("/info.xml").mock(
+        return_value=Response(200, text="<sn>121547060495</sn>")
+    )
+    json_route = respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/api/v1/production").mock(
+        return_value=Response(200, json=load_json_fixture(version, "api_v1_production"))
+    )
+    respx.get("/production").mock(return_value=Response(404))
+
+    path = str(tmp_path / "state.json")
+    reader = EnvoyReader(
+        "127.0.0.1", inverters=False, state_store=JsonFileStateStore(path)
+    )
+    await reader.getData()
+    await reader.aclose()
+    assert info_route.call_count == 1
+
+    info_route.reset()
+    json_route.reset()
+    restarted = EnvoyReader(
+        "127.0.0.1", inverters=False, state_store=JsonFileStateStore(path)
+    )
+    snapshot = await restarted.getData()
+    assert snapshot.production == 5463
+    assert restarted.password == "060495"
+    assert not info_route.called
+    assert not json_route.called
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_reprobes_when_state_is_rejected(tmp_path):
+    """Verify a stored model the Envoy no longer serves triggers detection."""
+    version = "4.2.27"
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(
+        return_value=Response(200, json=load_json_fixture(version, "production.json"))
+    )
+    respx.get("/api/v1/production").mock(
+        return_value=Response(200, json=load_json_fixture(version, "api_v1_production"))
+    )
+    respx.get("/production").mock(return_value=Response(404))
+
+    store = JsonFileStateStore(str(tmp_path / "state.json"))
+    store.save(
+        "127.0.0.1",
+        {"detection": {"endpoint_type": "P0", "is_metering_enabled": False}},
+    )
+    reader = EnvoyReader("127.0.0.1", inverters=False, state_store=store)
+    snapshot = await reader.getData()
+
+    assert reader.endpoint_type == "PC"
+    assert snapshot.consumption == 5811
+    assert store.load("127.0.0.1")["detection"]["endpoint_type"] == "PC"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_keeps_state_when_envoy_is_unreachable(tmp_path):
+    """Verify a transport error after a restart does not discard the state."""
+    info_route = respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    production_route = respx.get("/api/v1/production").mock(
+        side_effect=httpx.ConnectError("refused")
+    )
+    respx.get("/production.json").mock(return_value=Response(404))
+
+    store = JsonFileStateStore(str(tmp_path / "state.json"))
+    state = {
+        "detection": {"endpoint_type": "P", "is_metering_enabled": False},
+        "password": "060495",
+    }
+    store.save("127.0.0.1", state)
+    reader = EnvoyReader(
+        "127.0.0.1",
+        inverters=False,
+        state_store=store,
+        retry_policy=RetryPolicy(attempts=3, backoff=0),
+    )
+    with pytest.raises(httpx.ConnectError):
+        await reader.getData()
+
+    assert production_route.call_count == 3
+    assert not info_route.called
+    assert store.load("127.0.0.1")["detection"] == state["detection"]
+    assert reader.password == "060495"
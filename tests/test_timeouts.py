@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Tests for timeouts.py."""
+# -*- coding: utf-8 -*-
+import time
+
+import httpx
+import pytest
+
+from envoy_reader.envoy_reader import EnvoyReader
+from envoy_reader.retry import RetryPolicy
+from envoy_reader.simulator import EnvoySimulator
+from envoy_reader.timeouts import AdaptiveTimeouts
+
+from . import fixtures_dir
+
+
+def test_timeout_follows_latency():
+    """Verify the initial timeout until enough samples, then mean + 4 deviations."""
+    timeouts = AdaptiveTimeouts(
+        initial_timeout=30, min_timeout=0.1, max_timeout=10, min_samples=3
+    )
+    assert timeouts.timeout("/a") == 30
+    for _ in range(2):
+        timeouts.observe("/a", 0.5)
+    assert timeouts.timeout("/a") == 30
+    timeouts.observe("/a", 0.5)
+    assert timeouts.timeout("/a") == pytest.approx(0.5 + 4 * 0.25 * 0.75**2)
+    assert timeouts.timeout("/a", detecting=True) == 30
+    assert timeouts.timeout("/b") == 30
+
+    for _ in range(100):
+        timeouts.observe("/a", 0.001)
+    assert timeouts.timeout("/a") == 0.1
+    for _ in range(100):
+        timeouts.observe("/a", 60)
+    assert timeouts.timeout("/a") == 10
+
+
+def test_timeouts_back_off_until_an_answer():
+    """Verify each timeout doubles the next one, up to the maximum."""
+    timeouts = AdaptiveTimeouts(min_timeout=1, max_timeout=5, min_samples=1)
+    timeouts.observe("/a", 0.2)
+    assert timeouts.timeout("/a") == 1
+    timeouts.record_timeout("/a")
+    assert timeouts.timeout("/a") == 2
+    timeouts.record_timeout("/a")
+    assert timeouts.timeout("/a") == 4
+    for _ in range(5):
+        timeouts.record_timeout("/a")
+    assert timeouts.timeout("/a") == 5
+    timeouts.observe("/a", 0.2)
+    assert timeouts.timeout("/a") == 1
+    assert timeouts.as_dict()["/a"]["samples"] == 2
+    with pytest.raises(ValueError):
+        AdaptiveTimeouts(min_timeout=5, max_timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_hung_endpoint_is_abandoned_quickly():
+    """Verify a reader gives up on a hung Envoy after its learned timeout."""
+    simulator = EnvoySimulator(
+        fixtures_dir("3.9.36"), latency=0.002
+    )
+    async with httpx.AsyncClient(transport=simulator) as client:
+        reader = EnvoyReader(
+            "10.0.0.1",
+            async_client=client,
+            retry_policy=RetryPolicy(attempts=1),
+            timeouts=AdaptiveTimeouts(min_timeout=0.05, min_samples=2),
+        )
+        for _ in range(3):
+            await reader.getData()
+
+        simulator.latency = 10
+        start = time.monotonic()
+        with pytest.raises(httpx.ReadTimeout):
+            await reader.getData()
+
+    assert time.monotonic() - start < 1
+    assert simulator.stats["timeouts"] == 1
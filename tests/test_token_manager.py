@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Tests for token_manager.py."""
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import jwt
+import pytest
+import respx
+from httpx import Response
+
+from envoy_reader.envoy_reader import LOGIN_URL, TOKEN_URL, EnvoyReader
+from envoy_reader.token_manager import TokenManager, decode_token_expiry
+
+from . import load_json_fixture
+
+
+def _make_token(expires_in):
+    return jwt.encode({"exp": int(time.time() + expires_in)}, "envoy-reader-test-signing-key-000")
+
+
+def test_decode_token_expiry():
+    """Verify the expiry is read from the token without verifying it."""
+    token = _make_token(100)
+    assert (
+        decode_token_expiry(token)
+        == jwt.decode(token, options={"verify_signature": False})["exp"]
+    )
+    assert decode_token_expiry("not a token") is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_are_collapsed():
+    """Verify concurrent callers share a single refresh."""
+    calls = []
+
+    async def _refresh():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        manager.set_token(_make_token(7200))
+
+    manager = TokenManager(_refresh)
+    tokens = await asyncio.gather(*(manager.async_get_token() for _ in range(10)))
+
+    assert len(calls) == 1
+    assert manager.refresh_count == 1
+    assert len(set(tokens)) == 1
+    assert not manager.expired
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_refresh_is_scheduled_before_expiry():
+    """Verify the token is refreshed in the background ahead of expiry."""
+
+    async def _refresh():
+        manager.set_token(_make_token(7200))
+
+    manager = TokenManager(_refresh, refresh_margin=3600)
+    manager.set_token("old", expires_at=time.time() + 3600.05)
+    assert manager.token == "old"
+    await asyncio.sleep(0.2)
+
+    assert manager.refresh_count == 1
+    assert manager.token != "old"
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_background_refresh_is_retried():
+    """Verify a failed background refresh is retried before the token expires."""
+    failures = [ConnectionError("Enlighten down")] * 2
+
+    async def _refresh():
+        if failures:
+            raise failures.pop()
+        manager.set_token(_make_token(7200))
+
+    manager = TokenManager(_refresh, refresh_margin=3600, retry_backoff=0.05)
+    manager.set_token("old", expires_at=time.time() + 3600.05)
+    await asyncio.sleep(0.15)
+    assert manager.refresh_count == 2
+    assert manager.failed_refreshes == 2
+    assert manager.token == "old"
+
+    await asyncio.sleep(0.15)
+    assert manager.refresh_count == 3
+    assert manager.failed_refreshes == 0
+    assert manager.token != "old"
+    manager.close()
+
+
+@pytest.mark.asyncio
+async def test_no_retry_after_expiry():
+    """Verify a retry that would land after the expiry is left to the poll."""
+
+    async def _refresh():
+        raise ConnectionError("Enlighten down")
+
+    manager = TokenManager(_refresh, refresh_margin=0.1, retry_backoff=60)
+    manager.set_token("old", expires_at=time.time() + 0.15)
+    await asyncio.sleep(0.1)
+    assert manager.refresh_count == 1
+    assert manager._scheduled_refresh is None
+    manager.close()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_reader_refreshes_token_on_401():
+    """Verify a rejected token is refreshed once and the request retried."""
+    version = "3.17.3"
+    tokens = [_make_token(7200), _make_token(7200)]
+    respx.post(LOGIN_URL).mock(return_value=Response(200))
+    token_route = respx.post(TOKEN_URL).mock(
+        side_effect=[
+            Response(200, text=f"<textarea>{token}</textarea>") for token in tokens
+        ]
+    )
+    respx.get("/auth/check_jwt").mock(
+        return_value=Response(200, text="<h2>Valid token.</h2>")
+    )
+    respx.get("/info.xml").mock(return_value=Response(200, text=""))
+    respx.get("/production.json").mock(return_value=Response(404))
+    respx.get("/production").mock(return_value=Response(404))
+    production_route = respx.get("/api/v1/production").mock(
+        return_value=Response(
+            200, json=load_json_fixture(version, "api_v1_production")
+        )
+    )
+
+    reader = EnvoyReader(
+        "127.0.0.1",
+        inverters=False,
+        enlighten_user="user",
+        enlighten_pass="pass",
+        https_flag="s",
+    )
+    await reader.getData()
+    await reader.getData()
+    assert token_route.call_count == 1
+
+    production_route.side_effect = [
+        Response(401),
+        Response(200, json=load_json_fixture(version, "api_v1_production")),
+    ]
+    snapshot = await reader.getData()
+
+    assert snapshot.production == 5463
+    assert token_route.call_count == 2
+    assert reader._token == tokens[1]
+    await reader.aclose()